@@ -1,16 +1,19 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
 import logging
 import datetime
-from collections import Counter
-import pandas as pd
+import os
+import random
 import traceback
-from kpi_master_v1_07 import (
-    load_initial_holdings, load_trades, load_product_info, load_client_sales,
-    calculate_daily_holdings, calculate_daily_income, calculate_cumulative_income,
-    show_income_statistics, generate_forecasts, generate_sales_person_breakdowns,
-    generate_client_breakdowns, calculate_fund_income, calculate_all_funds_client_breakdown
-)
+from concurrent import futures
+from income_store import funds_client_breakdown
+from forecast_service import FORECAST_MODELS, GRANULARITIES
+from fee_engine import FEE_SELECTORS, DEFAULT_FEE_TYPE
+from leaderboards import LEADERBOARD_PERIODS, LEADERBOARD_DEPTH
+from kpi_state import StateManager
+from profiling import SamplingProfiler, ProfileStore
+from charts import (CHART_FORMATS, CHART_SIZES, ChartService, draw_cumulative_income, draw_income_composition,
+                    draw_forecasts, entity_series, forecast_lines)
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -18,46 +21,416 @@ CORS(app, resources={r"/api/*": {"origins": "*"}})
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+DATA_DIR = os.environ.get('KPI_DATA_DIR', 'data')
+ADMIN_TOKEN = os.environ.get('KPI_ADMIN_TOKEN')
+# Fraction of requests profiled without being asked to (0 = only on request)
+PROFILE_SAMPLE_RATE = float(os.environ.get('KPI_PROFILE_SAMPLE_RATE', '0'))
+profile_store = ProfileStore(int(os.environ.get('KPI_PROFILE_KEEP', '50')))
+chart_service = ChartService(workers=int(os.environ.get('KPI_CHART_WORKERS', '2')),
+                             cache_bytes=int(os.environ.get('KPI_CHART_CACHE_MB', '64')) * 1024 * 1024)
+CHART_TIMEOUT = float(os.environ.get('KPI_CHART_TIMEOUT', '30'))
+CHARTS = ('cumulative', 'composition', 'forecast')
+
 # Load data
-start_date = datetime.date(2023, 12, 31)
-end_date = datetime.date(2024, 8, 31)
-initial_holdings = load_initial_holdings('data/2023DEC.csv')
-trades = load_trades('data/TRADES_LOG.csv')
-product_info = load_product_info('data/PRODUCT_INFO.csv')
-client_sales = load_client_sales('data/CLIENT_LIST.csv')
-
-# Calculate data
-daily_holdings = calculate_daily_holdings(initial_holdings, trades, start_date, end_date)
-daily_income, sales_income, client_income = calculate_daily_income(daily_holdings, product_info, client_sales)
-cumulative_sales_income = calculate_cumulative_income(sales_income)
-cumulative_client_income = calculate_cumulative_income(client_income)
-client_stats, fund_stats, sales_stats = show_income_statistics(daily_income, sales_income, client_income, daily_holdings, product_info)
-forecasts = generate_forecasts(daily_income, product_info, daily_holdings, trades, end_date)
-sales_person_breakdowns = generate_sales_person_breakdowns(daily_income, client_sales)
-client_breakdowns = generate_client_breakdowns(daily_income)
+# The KPI state is rebuilt in the background whenever a file in DATA_DIR
+# changes; handlers read state_manager.current once per request. The async
+# server (asgi.py) sets KPI_DEFER_STARTUP=1 and builds the first state
+# itself so startup does not block its event loop.
+start_date = datetime.date.fromisoformat(os.environ.get('KPI_START_DATE', '2023-12-31'))
+end_date = datetime.date.fromisoformat(os.environ.get('KPI_END_DATE', '2024-08-31'))
+state_manager = StateManager(
+    DATA_DIR, start_date, end_date,
+    poll_interval=float(os.environ.get('KPI_WATCH_INTERVAL', '5')),
+    rebuild_mode=os.environ.get('KPI_REBUILD_MODE', 'process'),
+)
+if os.environ.get('KPI_DEFER_STARTUP') != '1':
+    startup_profile = os.environ.get('KPI_PROFILE_STARTUP')
+    if startup_profile in ('1', 'memory'):
+        with SamplingProfiler('startup pipeline', trace_memory=startup_profile == 'memory') as startup_profiler:
+            state_manager.start()
+        profile_store.add(startup_profiler, kind='startup')
+    else:
+        state_manager.start()
+
+
+class ApiError(ValueError):
+    """Invalid request parameters; reported to the client as a 400."""
+
+
+def is_admin(headers):
+    return ADMIN_TOKEN is not None and headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+
+def wants_profile(headers, args):
+    """Profile mode for a request: None, 'cpu' or 'memory' (stack samples plus allocations).
+
+    Admins ask with ``X-Kpi-Profile: 1|memory`` or ``?profile=1|memory``;
+    other requests are stack-sampled at PROFILE_SAMPLE_RATE.
+    """
+    requested = headers.get('X-Kpi-Profile') or args.get('profile')
+    if requested in ('1', 'memory') and is_admin(headers):
+        return 'memory' if requested == 'memory' else 'cpu'
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return 'cpu'
+    return None
+
+
+def fee_view(state, args):
+    """The state's view of the revenue line selected by ``?fee_type=``."""
+    fee_type = args.get('fee_type', DEFAULT_FEE_TYPE)
+    if fee_type not in FEE_SELECTORS:
+        raise ApiError(f"fee_type must be one of {', '.join(FEE_SELECTORS)}")
+    return state.fee_views.get(fee_type)
+
+
+def changes_since(state, args):
+    """``Changes`` since the client's ``?since=`` version, or None for a full payload."""
+    since = args.get('since')
+    if since is None:
+        return None
+    if not since.isdigit():
+        raise ApiError("since must be a version number")
+    return state.changelog.changes_since(int(since))
+
+
+def sync_fields(state, changes):
+    """Version fields of a payload; deltas also list the dates that no longer exist."""
+    fields = {'version': state.changelog.version, 'full': changes is None}
+    if changes is not None:
+        fields['removedDates'] = sorted(date.isoformat() for date in changes.removed_dates)
+    return fields
+
+
+# Payload builders shared by the Flask routes and the async server. Each
+# takes one KPI state and the query arguments and returns a JSON-ready value.
+def build_dashboard(state, args):
+    income_store = fee_view(state, args).income_store
+    changes = changes_since(state, args)
+    daily_totals = income_store.daily_totals()
+    total_income = float(daily_totals[-1])
+    total_clients = len(income_store.clients)
+    total_funds = len(income_store.funds)
+    total_sales = len(income_store.sales)
+
+    income_trend = [{'date': date.isoformat(), 'income': income}
+                    for date, income in zip(income_store.dates, daily_totals.tolist())
+                    if changes is None or date in changes.dates]
+
+    dashboard_data = {
+        'total_income': total_income,
+        'total_clients': total_clients,
+        'total_funds': total_funds,
+        'total_sales': total_sales,
+        'income_trend': income_trend
+    }
+    dashboard_data.update(sync_fields(state, changes))
+    return dashboard_data
+
+
+def build_sales(state, args):
+    view = fee_view(state, args)
+    changes = changes_since(state, args)
+    if changes is not None:
+        return sales_payload(state, view, changes)
+    # The full payload only changes with the state; build it once per view
+    payload = view.payloads.get('sales')
+    if payload is None:
+        payload = view.payloads['sales'] = sales_payload(state, view, None)
+    return payload
+
+
+def sales_payload(state, view, changes):
+    income_store, leaderboards = view.income_store, view.leaderboards
+    sales_data = {
+        'salesPersons': [],
+        'dailyContribution': [],
+        'individualPerformance': {}
+    }
+
+    sales_daily = income_store.sales_daily().tolist()
+    sales_persons = income_store.sales.names
+
+    # Prepare daily contribution data
+    for date, incomes in zip(income_store.dates, sales_daily):
+        if changes is not None and date not in changes.dates:
+            continue
+        daily_data = {'date': date.isoformat()}
+        daily_data.update(zip(sales_persons, incomes))
+        sales_data['dailyContribution'].append(daily_data)
+
+    # 'income' is cumulative, so a delta resends every row from the first change on
+    first_removed = min(changes.removed_dates, default=None) if changes is not None else None
+    rows_from = {}
+    for sales_person in sales_persons:
+        if changes is None:
+            rows_from[sales_person] = income_store.dates[0] if income_store.dates else None
+        else:
+            rows_from[sales_person] = min(filter(None, (changes.sales_from.get(sales_person), first_removed)),
+                                          default=None)
+
+    # Derive the per-day breakdowns once for all sales persons, only for the dates sent
+    first_sent = min(filter(None, rows_from.values()), default=None)
+    breakdowns = {date: income_store.sales_breakdown(date) for date in income_store.dates
+                  if first_sent is not None and date >= first_sent}
+    members_clients, members_funds = income_store.sales_members()
+
+    # Prepare individual performance and sales persons data
+    for sales_id, sales_person in enumerate(sales_persons):
+        sales_from = rows_from[sales_person]
+        if sales_from is not None:
+            sales_data['individualPerformance'][sales_person] = []
+            if changes is not None:
+                sales_data.setdefault('performanceFrom', {})[sales_person] = sales_from.isoformat()
+        cumulative_income = 0
+
+        for date, incomes in zip(income_store.dates, sales_daily):
+            cumulative_income += incomes[sales_id]
+            if sales_from is None or date < sales_from:
+                continue
+            # Get actual client and fund data
+            breakdown = breakdowns[date][sales_person]
+            sales_data['individualPerformance'][sales_person].append({
+                'date': date.isoformat(),
+                'income': cumulative_income,
+                'clients': breakdown['clients'],
+                'funds': breakdown['funds']
+            })
+
+        all_clients, all_funds = members_clients[sales_id], members_funds[sales_id]
+        sales_data['salesPersons'].append({
+            'name': sales_person,
+            'cumulativeIncome': cumulative_income,
+            'totalClients': len(all_clients),
+            'totalFunds': len(all_funds),
+            'topClients': [name for name, _ in leaderboards.top('all', 'clientsBySalesPerson', LEADERBOARD_DEPTH, sales_person)
+                           if name in all_clients][:10],
+            'topFunds': [name for name, _ in leaderboards.top('all', 'fundsBySalesPerson', LEADERBOARD_DEPTH, sales_person)
+                         if name in all_funds][:10]
+        })
+
+    sales_data.update(sync_fields(state, changes))
+    return sales_data
+
+
+def build_province_counts(state, args):
+    return fee_view(state, args).province_counts
+
+
+def build_province_income(state, args):
+    return fee_view(state, args).province_rollup
+
+
+def build_clients(state, args):
+    income_store, client_sales = fee_view(state, args).income_store, state.client_sales
+    clients_data = []
+    client_totals = income_store.named(income_store.client_totals(), income_store.clients)
+
+    for client, sales_person in client_sales.items():
+        logger.debug(f"Processing client: {client}, Sales Person: {sales_person}")
+        client_value = client_totals.get(client, 0)
+        logger.debug(f"Client value: {client_value}")
+
+        found = False
+        for sales_data in clients_data:
+            if sales_data["name"] == sales_person:
+                sales_data["clients"].append({
+                    "name": client,
+                    "value": client_value
+                })
+                sales_data["clientCount"] += 1
+                sales_data["totalClientValue"] += client_value
+                found = True
+                break
+
+        if not found:
+            clients_data.append({
+                "name": sales_person,
+                "clientCount": 1,
+                "totalClientValue": client_value,
+                "clients": [{
+                    "name": client,
+                    "value": client_value
+                }]
+            })
+
+    logger.info(f"Processed data for {len(clients_data)} sales persons")
+    return clients_data
+
+
+def build_funds(state, args):
+    income_store = fee_view(state, args).income_store
+    fund_income = income_store.named(income_store.fund_totals(), income_store.funds)
+    funds_data = [
+        {
+            "name": fund,
+            "income": income
+        }
+        for fund, income in fund_income.items()
+    ]
+    funds_data.sort(key=lambda x: x['income'], reverse=True)
+
+    funds_breakdown = funds_client_breakdown(income_store)
+
+    return {
+        "allFunds": funds_data,
+        "fundsBreakdown": funds_breakdown
+    }
+
+
+def build_forecast(state, args):
+    forecast_service = fee_view(state, args).forecast_service
+
+    model = args.get('model', 'simple')
+    granularity = args.get('granularity', 'day')
+    if model not in FORECAST_MODELS:
+        raise ApiError(f"model must be one of {', '.join(FORECAST_MODELS)}")
+    if granularity not in GRANULARITIES:
+        raise ApiError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    try:
+        horizon = forecast_service.parse_horizon(args.get('horizon'))
+    except ValueError as e:
+        raise ApiError(f"Invalid horizon: {str(e)}")
+
+    points = forecast_service.points(model, horizon, granularity)
+    if args.get('since') is None:
+        return points
+
+    # A delta resends the points from the first changed actual date; after any
+    # change that includes every forecast point, as the models are refit and
+    # future trades may have changed.
+    changes = changes_since(state, args)
+    forecast_data = sync_fields(state, changes)
+    if changes is None:
+        forecast_data.update(fromDate=None, points=points)
+        return forecast_data
+    from_date = changes.first_date
+    if changes.changed:
+        next_day = forecast_service.last_date + datetime.timedelta(days=1)
+        from_date = min(from_date or next_day, next_day)
+    from_date = from_date.isoformat() if from_date is not None else None
+    forecast_data.update(fromDate=from_date,
+                         points=[p for p in points if from_date is not None and p['date'] >= from_date])
+    return forecast_data
+
+
+def build_leaderboards(state, args):
+    k = args.get('k', '10')
+    if not k.isdigit() or not 1 <= int(k) <= LEADERBOARD_DEPTH:
+        raise ApiError(f"k must be an integer between 1 and {LEADERBOARD_DEPTH}")
+    period = args.get('period')
+    if period is not None and period not in LEADERBOARD_PERIODS:
+        raise ApiError(f"period must be one of {', '.join(LEADERBOARD_PERIODS)}")
+    periods = [period] if period else LEADERBOARD_PERIODS
+    return fee_view(state, args).leaderboards.view(periods, int(k))
+
+
+def parse_date_arg(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ApiError(f"{name} must be an ISO date")
+
+
+def chart_catalog():
+    """Available charts, formats and sizes, with the chart cache statistics."""
+    return {'charts': list(CHARTS), 'formats': list(CHART_FORMATS), 'sizes': list(CHART_SIZES),
+            'cache': chart_service.cache.stats()}
+
+
+def build_chart(state, chart, args):
+    """``(image bytes, mimetype)`` of one chart, rendered by the chart service or cached."""
+    view = fee_view(state, args)
+    fmt = args.get('format', 'png')
+    size = args.get('size', 'full')
+    if chart not in CHARTS:
+        raise ApiError(f"chart must be one of {', '.join(CHARTS)}")
+    if fmt not in CHART_FORMATS:
+        raise ApiError(f"format must be one of {', '.join(CHART_FORMATS)}")
+    if size not in CHART_SIZES:
+        raise ApiError(f"size must be one of {', '.join(CHART_SIZES)}")
+    start = parse_date_arg(args, 'start')
+
+    if chart == 'forecast':
+        entity = 'total'
+        try:
+            end = view.forecast_service.parse_horizon(args.get('horizon'))
+        except ValueError as e:
+            raise ApiError(f"Invalid horizon: {str(e)}")
+
+        def prepare():
+            return draw_forecasts, (*forecast_lines(view.forecast_service, end, start), 'Income Forecast')
+    else:
+        entity = args.get('entity', 'sales')
+        end = parse_date_arg(args, 'end')
+        sales_person = entity[len('sales:'):] if entity.startswith('sales:') else None
+        if entity != 'sales' and sales_person not in view.income_store.sales:
+            raise ApiError("entity must be 'sales' or 'sales:<name>' with a known sales person")
+        draw = draw_cumulative_income if chart == 'cumulative' else draw_income_composition
+        label = 'Cumulative Income' if chart == 'cumulative' else 'Income Composition'
+        title = f"{label} of {sales_person}'s Clients" if sales_person else f"{label} by Sales Person"
+
+        def prepare():
+            return draw, (*entity_series(view.income_store, state.client_sales, entity, start, end), title)
+
+    key = (chart, entity, start, end, view.fee_type, fmt, size, state.changelog.version)
+    return chart_service.render(key, prepare, fmt, size, CHART_TIMEOUT), CHART_FORMATS[fmt]
+
+
+# Endpoint name -> payload builder; also served by asgi.py
+ENDPOINTS = {
+    'dashboard': build_dashboard,
+    'sales': build_sales,
+    'province_counts': build_province_counts,
+    'province_income': build_province_income,
+    'clients': build_clients,
+    'funds': build_funds,
+    'forecast': build_forecast,
+    'leaderboards': build_leaderboards,
+}
+
+
+# 性能分析
+@app.before_request
+def start_profile():
+    if request.path.startswith('/api/admin/'):
+        return
+    mode = wants_profile(request.headers, request.args)
+    if mode is not None:
+        g.profiler = SamplingProfiler(request.full_path, trace_memory=mode == 'memory').start()
+
+
+@app.after_request
+def finish_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+        profile_id = profile_store.add(profiler, kind='request', path=request.path,
+                                       query=request.query_string.decode('latin-1'),
+                                       status=response.status_code)
+        response.headers['X-Kpi-Profile-Id'] = str(profile_id)
+    return response
+
+
+@app.teardown_request
+def abandon_profile(exc):
+    # after_request is skipped on unhandled errors; never leave a sampler running
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+
 
 @app.route('/api/dashboard')
 def get_dashboard():
     try:
         logger.info("Processing dashboard data")
-        total_income = sum(sum(client.values()) for client in daily_income[max(daily_income.keys())].values())
-        total_clients = len(set(client for day in daily_income.values() for client in day.keys()))
-        total_funds = len(set(fund for day in daily_income.values() for client in day.values() for fund in client.keys()))
-        total_sales = len(set(sales_income[max(sales_income.keys())].keys()))
-
-        income_trend = [{'date': date.isoformat(), 'income': sum(sum(client.values()) for client in clients.values())}
-                        for date, clients in daily_income.items()]
-
-        dashboard_data = {
-            'total_income': total_income,
-            'total_clients': total_clients,
-            'total_funds': total_funds,
-            'total_sales': total_sales,
-            'income_trend': income_trend
-        }
-
+        dashboard_data = build_dashboard(state_manager.current, request.args)
         logger.info("Dashboard data processed successfully")
         return jsonify(dashboard_data)
+    except ApiError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error processing dashboard data: {str(e)}")
         logger.error(traceback.format_exc())
@@ -67,120 +440,49 @@ def get_dashboard():
 def get_sales():
     try:
         logger.info("Processing sales data")
-        sales_data = {
-            'salesPersons': [],
-            'dailyContribution': [],
-            'individualPerformance': {}
-        }
-
-        # Prepare daily contribution data
-        for date in sales_income.keys():
-            daily_data = {'date': date.isoformat()}
-            for sales_person in sales_income[date].keys():
-                daily_data[sales_person] = sales_income[date][sales_person]
-            sales_data['dailyContribution'].append(daily_data)
-
-        # Prepare individual performance and sales persons data
-        for sales_person in set(person for daily in sales_income.values() for person in daily.keys()):
-            sales_data['individualPerformance'][sales_person] = []
-            cumulative_income = 0
-            all_clients = set()
-            all_funds = set()
-
-            for date in sorted(sales_income.keys()):
-                if sales_person in sales_income[date]:
-                    cumulative_income += sales_income[date][sales_person]
-
-                    # Get actual client and fund data
-                    client_data = sales_person_breakdowns[date][sales_person]['clients']
-                    fund_data = sales_person_breakdowns[date][sales_person]['funds']
-
-                    all_clients.update(client_data.keys())
-                    all_funds.update(fund_data.keys())
-
-                    sales_data['individualPerformance'][sales_person].append({
-                        'date': date.isoformat(),
-                        'income': cumulative_income,
-                        'clients': client_data,
-                        'funds': fund_data
-                    })
-
-            sales_data['salesPersons'].append({
-                'name': sales_person,
-                'cumulativeIncome': cumulative_income,
-                'totalClients': len(all_clients),
-                'totalFunds': len(all_funds),
-                'topClients': sorted(all_clients)[:10],  # Just for reference, not used for counting
-                'topFunds': sorted(all_funds)[:10]  # Just for reference, not used for counting
-            })
-
+        sales_data = build_sales(state_manager.current, request.args)
         logger.info("Sales data processed successfully")
         return jsonify(sales_data)
+    except ApiError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error processing sales data: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({'error': 'An error occurred while processing sales data'}), 500
 
-def load_client_list(filename):
-    client_list = pd.read_csv(filename, encoding='utf-8')
-    return client_list
-
-def calculate_province_counts(client_list):
-    provinces = client_list['PROVINCE'].tolist()
-    # Remove '-' entries and strip suffixes
-    provinces = [p.replace('省', '').replace('市', '') for p in provinces if p != '-']
-    return dict(Counter(provinces))
-
 @app.route('/api/province_counts')
 def get_province_counts():
     try:
         logger.info("Processing province count data")
-        client_list = load_client_list('data/CLIENT_LIST.csv')
-        province_counts = calculate_province_counts(client_list)
-        return jsonify(province_counts)
+        return jsonify(build_province_counts(state_manager.current, request.args))
+    except ApiError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error processing province count data: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({'error': 'An error occurred while processing province count data'}), 500
 
+@app.route('/api/province_income')
+def get_province_income():
+    try:
+        logger.info("Processing province income data")
+        return jsonify(build_province_income(state_manager.current, request.args))
+    except ApiError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error processing province income data: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'An error occurred while processing province income data'}), 500
+
 @app.route('/api/clients', methods=['GET'])
 def get_clients():
     try:
         logger.info("Processing clients data")
-        clients_data = []
-
-        for client, sales_person in client_sales.items():
-            logger.debug(f"Processing client: {client}, Sales Person: {sales_person}")
-            client_value = sum(sum(daily_income[date].get(client, {}).values()) for date in daily_income)
-            logger.debug(f"Client value: {client_value}")
-
-            found = False
-            for sales_data in clients_data:
-                if sales_data["name"] == sales_person:
-                    sales_data["clients"].append({
-                        "name": client,
-                        "value": client_value
-                    })
-                    sales_data["clientCount"] += 1
-                    sales_data["totalClientValue"] += client_value
-                    found = True
-                    break
-
-            if not found:
-                clients_data.append({
-                    "name": sales_person,
-                    "clientCount": 1,
-                    "totalClientValue": client_value,
-                    "clients": [{
-                        "name": client,
-                        "value": client_value
-                    }]
-                })
-
-        logger.info(f"Processed data for {len(clients_data)} sales persons")
+        clients_data = build_clients(state_manager.current, request.args)
         logger.debug(f"Clients data: {clients_data}")
-
         return jsonify(clients_data)
+    except ApiError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error processing clients data: {str(e)}")
         logger.error(traceback.format_exc())
@@ -190,25 +492,11 @@ def get_clients():
 def get_funds():
     try:
         logger.info("Processing funds data")
-        fund_income = calculate_fund_income(daily_income)
-        funds_data = [
-            {
-                "name": fund,
-                "income": income
-            }
-            for fund, income in fund_income.items()
-        ]
-        funds_data.sort(key=lambda x: x['income'], reverse=True)
-
-        funds_breakdown = calculate_all_funds_client_breakdown(daily_income)
-
-        response_data = {
-            "allFunds": funds_data,
-            "fundsBreakdown": funds_breakdown
-        }
-
+        response_data = build_funds(state_manager.current, request.args)
         logger.info("Funds data processed successfully")
         return jsonify(response_data)
+    except ApiError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error processing funds data: {str(e)}")
         logger.error(traceback.format_exc())
@@ -219,41 +507,81 @@ def get_funds():
 def get_forecast():
     try:
         logger.info("Processing forecast data")
-
-        # Get the last day's total income
-        last_date = max(daily_income.keys())
-        last_day_income = sum(sum(client.values()) for client in daily_income[last_date].values())
-
-        # Create a date range from the start of our data to 2024-12-31
-        start_date = min(daily_income.keys())
-        end_date = datetime.date(2024, 12, 31)
-        date_range = pd.date_range(start=start_date, end=end_date)
-
-        # Create the forecast data
-        forecast_data = []
-        cumulative_income = 0
-        for date in date_range:
-            if date.date() <= last_date:
-                # Use actual data for past dates
-                daily_total = sum(sum(client.values()) for client in daily_income[date.date()].values())
-            else:
-                # Use last day's income for future dates
-                daily_total = last_day_income
-
-            cumulative_income += daily_total
-            forecast_data.append({
-                'date': date.strftime('%Y-%m-%d'),
-                'income': daily_total,
-                'cumulativeIncome': cumulative_income,
-                'isActual': date.date() <= last_date
-            })
-
+        forecast_data = build_forecast(state_manager.current, request.args)
         logger.info("Forecast data processed successfully")
         return jsonify(forecast_data)
+    except ApiError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error processing forecast data: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({'error': 'An error occurred while processing forecast data'}), 500
 
+@app.route('/api/leaderboards')
+def get_leaderboards():
+    try:
+        logger.info("Processing leaderboard data")
+        leaderboard_data = build_leaderboards(state_manager.current, request.args)
+        logger.info("Leaderboard data processed successfully")
+        return jsonify(leaderboard_data)
+    except ApiError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error processing leaderboard data: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'An error occurred while processing leaderboard data'}), 500
+
+@app.route('/api/charts')
+def get_charts():
+    return jsonify(chart_catalog())
+
+@app.route('/api/charts/<chart>')
+def get_chart(chart):
+    try:
+        logger.info(f"Rendering {chart} chart")
+        body, mimetype = build_chart(state_manager.current, chart, request.args)
+        return Response(body, mimetype=mimetype)
+    except ApiError as e:
+        return jsonify({'error': str(e)}), 400
+    except futures.TimeoutError:
+        logger.error(f"Timed out rendering {chart} chart after {CHART_TIMEOUT}s")
+        return jsonify({'error': f'Timed out while rendering the {chart} chart'}), 504
+    except Exception as e:
+        logger.error(f"Error rendering {chart} chart: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'An error occurred while rendering the chart'}), 500
+
+@app.route('/api/admin/rebuild', methods=['GET', 'POST'])
+def admin_rebuild():
+    if not is_admin(request.headers):
+        return jsonify({'error': 'Forbidden'}), 403
+    try:
+        if request.method == 'POST':
+            started = state_manager.request_rebuild('admin request')
+            logger.info(f"Rebuild requested via admin endpoint (started={started})")
+            return jsonify({'started': started, 'status': state_manager.status()}), 202
+        return jsonify(state_manager.status())
+    except Exception as e:
+        logger.error(f"Error handling rebuild request: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'An error occurred while handling the rebuild request'}), 500
+
+@app.route('/api/admin/profiles')
+def admin_profiles():
+    if not is_admin(request.headers):
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(profile_store.summaries())
+
+@app.route('/api/admin/profiles/<int:profile_id>')
+def admin_profile(profile_id):
+    if not is_admin(request.headers):
+        return jsonify({'error': 'Forbidden'}), 403
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    if request.args.get('format') == 'folded':
+        return Response(profile['folded'], mimetype='text/plain')
+    return jsonify({key: value for key, value in profile.items() if key != 'folded'})
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
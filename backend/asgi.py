@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Async (ASGI) serving mode for the KPI API.
+
+Serves the same /api endpoints as app.py without blocking the event loop:
+payloads are built and serialised in a thread pool, each request is bounded
+by KPI_REQUEST_TIMEOUT, and concurrent identical requests are coalesced so
+only one of them computes while the others await its result. The first KPI
+state is built in the background after the server starts accepting
+connections (requests get a 503 until it is ready), and later rebuilds run
+out of process through the StateManager, so the dashboard stays responsive.
+
+Run with either of:
+
+    uvicorn asgi:app --workers 2
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+"""
+
+import asyncio
+import json
+import logging
+import os
+import traceback
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+os.environ.setdefault('KPI_DEFER_STARTUP', '1')
+
+from app import ENDPOINTS, ApiError, build_chart, chart_catalog, is_admin, state_manager  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = float(os.environ.get('KPI_REQUEST_TIMEOUT', '30'))
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get('KPI_ASYNC_THREADS', '4')),
+                              thread_name_prefix='kpi-handler')
+
+
+class RequestCoalescer:
+    """Runs one computation per key; concurrent callers with the same key share it."""
+
+    def __init__(self):
+        self._inflight = {}
+
+    def _done(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.cancelled():
+            future.exception()  # Mark as retrieved even if every waiter timed out
+
+    async def run(self, key, fn, *args):
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        # shield() so one caller timing out does not cancel the shared work
+        return await asyncio.wait_for(asyncio.shield(future), REQUEST_TIMEOUT)
+
+
+coalescer = RequestCoalescer()
+
+
+def render(builder, state, args):
+    return json.dumps(builder(state, args), ensure_ascii=False, sort_keys=True).encode('utf-8')
+
+
+async def respond(send, status, body, extra_headers=(), content_type='application/json'):
+    if not isinstance(body, bytes):
+        body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    headers = [
+        (b'content-type', content_type.encode('latin-1')),
+        (b'content-length', str(len(body)).encode('latin-1')),
+        (b'access-control-allow-origin', b'*'),
+    ]
+    headers.extend(extra_headers)
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _initial_build():
+    try:
+        state_manager.start()
+    except Exception as e:
+        logger.error(f"Error building initial KPI state: {str(e)}")
+        logger.error(traceback.format_exc())
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Not awaited: the server starts accepting requests immediately.
+            asyncio.get_running_loop().run_in_executor(None, _initial_build)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            state_manager.stop()
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def handle_admin_rebuild(method, headers, send):
+    if not is_admin(headers):
+        return await respond(send, 403, {'error': 'Forbidden'})
+    if method == 'POST':
+        started = state_manager.request_rebuild('admin request')
+        logger.info(f"Rebuild requested via admin endpoint (started={started})")
+        return await respond(send, 202, {'started': started, 'status': state_manager.status()})
+    return await respond(send, 200, state_manager.status())
+
+
+async def handle_chart(chart, scope, send):
+    state = state_manager.current
+    if state is None:
+        return await respond(send, 503, {'error': 'KPI data is still loading'}, [(b'retry-after', b'5')])
+    args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+    try:
+        # The chart service renders in its own pool and coalesces identical charts
+        loop = asyncio.get_running_loop()
+        body, content_type = await asyncio.wait_for(
+            loop.run_in_executor(executor, build_chart, state, chart, args), REQUEST_TIMEOUT)
+        return await respond(send, 200, body, content_type=content_type)
+    except ApiError as e:
+        return await respond(send, 400, {'error': str(e)})
+    except (asyncio.TimeoutError, futures.TimeoutError):
+        # The chart service's own timeout raises in the worker thread
+        logger.error(f"Timed out rendering {chart} chart after {REQUEST_TIMEOUT}s")
+        return await respond(send, 504, {'error': f'Timed out while rendering the {chart} chart'})
+    except Exception as e:
+        logger.error(f"Error rendering {chart} chart: {str(e)}")
+        logger.error(traceback.format_exc())
+        return await respond(send, 500, {'error': 'An error occurred while rendering the chart'})
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    path, method = scope['path'].rstrip('/'), scope['method']
+    headers = {name.decode('latin-1').title(): value.decode('latin-1') for name, value in scope['headers']}
+
+    if method == 'OPTIONS':
+        return await respond(send, 204, b'', [
+            (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+            (b'access-control-allow-headers', b'*'),
+        ])
+    if path == '/api/admin/rebuild' and method in ('GET', 'POST'):
+        return await handle_admin_rebuild(method, headers, send)
+
+    if path == '/api/charts' and method == 'GET':
+        return await respond(send, 200, chart_catalog())
+    if path.startswith('/api/charts/') and method == 'GET':
+        return await handle_chart(path[len('/api/charts/'):], scope, send)
+
+    name = path[len('/api/'):] if path.startswith('/api/') else None
+    builder = ENDPOINTS.get(name)
+    if builder is None or method != 'GET':
+        return await respond(send, 404, {'error': 'Not found'})
+
+    state = state_manager.current
+    if state is None:
+        return await respond(send, 503, {'error': 'KPI data is still loading'}, [(b'retry-after', b'5')])
+
+    args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+    key = (name, tuple(sorted(args.items())), id(state))
+    try:
+        logger.info(f"Processing {name} data")
+        body = await coalescer.run(key, render, builder, state, args)
+        return await respond(send, 200, body)
+    except ApiError as e:
+        return await respond(send, 400, {'error': str(e)})
+    except asyncio.TimeoutError:
+        logger.error(f"Timed out processing {name} data after {REQUEST_TIMEOUT}s")
+        return await respond(send, 504, {'error': f'Timed out while processing {name} data'})
+    except Exception as e:
+        logger.error(f"Error processing {name} data: {str(e)}")
+        logger.error(traceback.format_exc())
+        return await respond(send, 500, {'error': f'An error occurred while processing {name} data'})
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""Headless batch generation of KPI reports.
+
+Takes a list of jobs, each a (window, scope, format) triple, builds the KPI
+state once for the union of the windows and renders the reports in a
+process pool. Every worker receives the shared state once, through the pool
+initializer.
+
+Windows are clipped to the data range (SNAPSHOT_DATE to ``--end-date``); a
+clipped report is named after the dates it covers and flagged as partial,
+and a window outside the range is skipped. Job progress is recorded in
+``batch_state.json`` in the output directory after every job. A rerun skips
+jobs that are already done, unless the input files have changed since or
+``--fresh`` is given.
+
+Windows are ``YYYY``, ``YYYY-MM``, ``YYYYQn`` or ``START:END`` (ISO dates);
+scopes are ``all`` or ``sales:<name>``; formats are ``xlsx`` (the workbook
+``main()`` in kpi_master_v1_07.py writes) and ``json``. Jobs come from a
+JSON file and/or presets:
+
+    python batch_reports.py --preset monthly --preset quarterly --preset sales --workers 4
+    python batch_reports.py --jobs jobs.json --output-dir reports
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import re
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import openpyxl
+
+from kpi_master_v1_07 import (calculate_cumulative_income, show_income_statistics, generate_forecasts,
+                              generate_sales_person_breakdowns, generate_client_breakdowns,
+                              generate_excel_report)
+from kpi_state import build_state, SNAPSHOT_DATE
+from forecast_service import DEFAULT_HORIZON
+
+REPORT_FORMATS = ('xlsx', 'json')
+PRESETS = ('monthly', 'quarterly', 'sales')
+STATE_FILE = 'batch_state.json'
+
+
+# 任务定义
+def parse_window(spec):
+    """``(start_date, end_date)`` of a window spec."""
+    if ':' in spec:
+        start, end = spec.split(':', 1)
+        return datetime.date.fromisoformat(start), datetime.date.fromisoformat(end)
+    match = re.fullmatch(r'(\d{4})Q([1-4])', spec)
+    if match:
+        year, quarter = int(match.group(1)), int(match.group(2))
+        start = datetime.date(year, 3 * quarter - 2, 1)
+        end = datetime.date(year + quarter // 4, 3 * quarter % 12 + 1, 1) - datetime.timedelta(days=1)
+        return start, end
+    match = re.fullmatch(r'(\d{4})-(\d{2})', spec)
+    if match:
+        year, month = int(match.group(1)), int(match.group(2))
+        end = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+        return datetime.date(year, month, 1), end
+    if re.fullmatch(r'\d{4}', spec):
+        return datetime.date(int(spec), 1, 1), datetime.date(int(spec), 12, 31)
+    raise ValueError(f"Invalid window: {spec}")
+
+
+def parse_scope(spec):
+    if spec == 'all':
+        return None
+    kind, _, name = spec.partition(':')
+    if kind != 'sales' or not name:
+        raise ValueError(f"Invalid scope: {spec}")
+    return name
+
+
+def covered_window(job, first_date, last_date):
+    """Part of the job's window within ``[first_date, last_date]``, None if they do not overlap."""
+    start, end = parse_window(job['window'])
+    start, end = max(start, first_date), min(end, last_date)
+    return (start, end) if start <= end else None
+
+
+def job_id(job, window):
+    """Output file name of a job covering ``window``."""
+    start, end = window
+    scope = re.sub(r'[\\/:*?"<>|\s]+', '_', job['scope'])
+    return f"{start.strftime('%Y%m%d')}-{end.strftime('%Y%m%d')}_{scope}.{job['format']}"
+
+
+def preset_jobs(preset, first_date, last_date, sales_persons, report_format):
+    if preset == 'monthly':
+        windows = []
+        month = datetime.date(first_date.year, first_date.month, 1)
+        while month <= last_date:
+            windows.append(month.strftime('%Y-%m'))
+            month = datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        return [{'window': w, 'scope': 'all', 'format': report_format} for w in windows]
+    if preset == 'quarterly':
+        quarters = []
+        for year in range(first_date.year, last_date.year + 1):
+            for quarter in range(1, 5):
+                start, end = parse_window(f"{year}Q{quarter}")
+                if start <= last_date and end >= first_date:
+                    quarters.append(f"{year}Q{quarter}")
+        return [{'window': q, 'scope': 'all', 'format': report_format} for q in quarters]
+    if preset == 'sales':
+        window = f"{first_date.isoformat()}:{last_date.isoformat()}"
+        return [{'window': window, 'scope': f"sales:{name}", 'format': report_format} for name in sales_persons]
+    raise ValueError(f"Unknown preset: {preset}")
+
+
+# 报表视图
+def legacy_views(state, start_date, end_date, sales_person=None):
+    """The pipeline's nested dicts for one window and scope, derived from the shared state."""
+    store = state.income_store
+    lo, hi = store._date_bounds(start_date, end_date)
+    dates = store.dates[lo:hi]
+    if not dates:
+        raise ValueError(f"No income data between {start_date} and {end_date}")
+    if sales_person is not None and sales_person not in store.sales:
+        raise ValueError(f"Unknown sales person: {sales_person}")
+
+    in_scope = [sales_person is None or store.sales[s] == sales_person for s in store.client_sales_idx.tolist()]
+    clients = [client for client, keep in zip(store.clients.names, in_scope) if keep]
+    client_set = set(clients)
+    sales_names = store.sales.names if sales_person is None else [sales_person]
+    sales_ids = [store.sales.get(name) for name in sales_names]
+    client_ids = [store.clients.get(client) for client in clients]
+
+    sales_daily = store.sales_daily()[lo:hi].tolist()
+    client_daily = store.client_daily()[lo:hi].tolist()
+    daily_income, sales_income, client_income = {}, {}, {}
+    for date, sales_row, client_row in zip(dates, sales_daily, client_daily):
+        breakdown = store.day_breakdown(date)
+        daily_income[date] = {client: breakdown.get(client, {}) for client in clients}
+        sales_income[date] = {name: sales_row[i] for name, i in zip(sales_names, sales_ids)}
+        client_income[date] = {client: client_row[i] for client, i in zip(clients, client_ids)}
+
+    daily_holdings = {client: funds for client, funds in
+                      state.holding_intervals.to_daily_holdings(dates[0], dates[-1]).items()
+                      if client in client_set}
+    return daily_income, sales_income, client_income, daily_holdings
+
+
+def forecast_end(spec, end_date):
+    """Last forecast date for a report ending on ``end_date``: an ISO date or a number of days after it."""
+    if spec.isdigit():
+        return end_date + datetime.timedelta(days=int(spec))
+    return datetime.date.fromisoformat(spec)
+
+
+def render_xlsx(state, views, path, forecast_until):
+    daily_income, sales_income, client_income, daily_holdings = views
+    cumulative_sales_income = calculate_cumulative_income(sales_income)
+    cumulative_client_income = calculate_cumulative_income(client_income)
+    client_stats, fund_stats, sales_stats = show_income_statistics(
+        daily_income, sales_income, client_income, daily_holdings, state.product_info)
+    # Forecast from the last day of the window, with the trades of the clients in scope. The
+    # models sum each day's values, so they take the per-client totals.
+    clients = next(iter(client_income.values()))
+    trades = {client: funds for client, funds in state.trades.items() if client in clients}
+    forecasts = generate_forecasts(client_income, state.product_info, daily_holdings, trades, forecast_until)
+    sales_person_breakdowns = generate_sales_person_breakdowns(daily_income, state.client_sales)
+    client_breakdowns = generate_client_breakdowns(daily_income)
+    wb = openpyxl.Workbook()
+    generate_excel_report(daily_income, sales_income, client_income, cumulative_sales_income,
+                          cumulative_client_income, client_stats, fund_stats, sales_stats, forecasts,
+                          daily_holdings, sales_person_breakdowns, client_breakdowns, wb)
+    wb.save(path)
+
+
+def render_json(state, views, path, forecast_until):
+    daily_income, sales_income, client_income, _ = views
+    funds = {}
+    for clients in daily_income.values():
+        for client_funds in clients.values():
+            for fund, income in client_funds.items():
+                funds[fund] = funds.get(fund, 0) + income
+    report = {
+        'start': min(daily_income).isoformat(),
+        'end': max(daily_income).isoformat(),
+        'totalIncome': sum(sum(incomes.values()) for incomes in sales_income.values()),
+        'daily': [{'date': date.isoformat(), 'income': sum(incomes.values())}
+                  for date, incomes in sales_income.items()],
+        'salesPersons': {name: sum(incomes[name] for incomes in sales_income.values())
+                         for name in next(iter(sales_income.values()))},
+        'clients': {name: sum(incomes[name] for incomes in client_income.values())
+                    for name in next(iter(client_income.values()))},
+        'funds': dict(sorted(funds.items(), key=lambda x: x[1], reverse=True)),
+    }
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+RENDERERS = {'xlsx': render_xlsx, 'json': render_json}
+
+# Shared state of a worker process, set once by the pool initializer
+_state = None
+
+
+def _init_worker(state):
+    global _state
+    _state = state
+
+
+def run_job(job, window, output_dir, forecast_horizon):
+    """Render one report over ``window``; returns ``(job, output_path, seconds)``."""
+    started = time.perf_counter()
+    start_date, end_date = window
+    path = os.path.join(output_dir, job_id(job, window))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    # The legacy report steps print per row and the forecast models warn; keep worker output quiet.
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        views = legacy_views(_state, start_date, end_date, parse_scope(job['scope']))
+        RENDERERS[job['format']](_state, views, tmp_path, forecast_end(forecast_horizon, end_date))
+    os.replace(tmp_path, path)
+    return job, path, time.perf_counter() - started
+
+
+# 任务状态
+class JobState:
+    """Per-job status persisted to ``batch_state.json`` after every change."""
+
+    def __init__(self, path, fingerprint, fresh=False):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.jobs = {}
+        if not fresh and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                saved = json.load(file)
+            if saved.get('fingerprint') == fingerprint:
+                self.jobs = saved.get('jobs', {})
+            else:
+                print("Input data changed since the last run; regenerating all reports.")
+
+    def is_done(self, key):
+        entry = self.jobs.get(key)
+        return entry is not None and entry['status'] == 'done' and os.path.exists(entry['output'])
+
+    def mark(self, key, status, **info):
+        self.jobs[key] = dict(info, status=status, updated=datetime.datetime.now().isoformat())
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'fingerprint': self.fingerprint, 'jobs': self.jobs}, file, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def load_jobs(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        jobs = json.load(file)
+    for job in jobs:
+        job.setdefault('scope', 'all')
+        job.setdefault('format', 'xlsx')
+    return jobs
+
+
+def validate_job(job):
+    parse_window(job['window'])
+    parse_scope(job['scope'])
+    if job['format'] not in REPORT_FORMATS:
+        raise ValueError(f"Invalid format: {job['format']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render many KPI reports from one pipeline run.")
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--end-date', default='2024-08-31', help="Last date with data; later windows are clipped")
+    parser.add_argument('--jobs', help="JSON list of {window, scope, format} jobs")
+    parser.add_argument('--preset', action='append', choices=PRESETS, default=[])
+    parser.add_argument('--format', choices=REPORT_FORMATS, default='xlsx', help="Format of preset jobs")
+    parser.add_argument('--forecast-horizon', default=DEFAULT_HORIZON.isoformat(),
+                        help="Last forecast date of xlsx reports: an ISO date or days after the window")
+    parser.add_argument('--output-dir', default='reports')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--fresh', action='store_true', help="Ignore the saved job state")
+    args = parser.parse_args()
+
+    data_start, data_end = SNAPSHOT_DATE, datetime.date.fromisoformat(args.end_date)
+    try:
+        forecast_end(args.forecast_horizon, data_end)
+    except ValueError:
+        parser.error(f"invalid --forecast-horizon: {args.forecast_horizon}")
+    jobs = load_jobs(args.jobs) if args.jobs else []
+    for preset in args.preset:
+        if preset != 'sales':
+            jobs += preset_jobs(preset, data_start, data_end, [], args.format)
+    for job in jobs:
+        validate_job(job)
+    if not jobs and 'sales' not in args.preset:
+        parser.error("no jobs given; use --jobs and/or --preset")
+
+    # The shared state spans the union of the windows within the data range
+    if 'sales' in args.preset:
+        first_date, last_date = data_start, data_end
+    else:
+        windows = [w for w in (covered_window(job, data_start, data_end) for job in jobs) if w is not None]
+        if not windows:
+            parser.error(f"no job window overlaps the data range {data_start} to {data_end}")
+        first_date, last_date = min(w[0] for w in windows), max(w[1] for w in windows)
+    print(f"Building shared KPI state for {first_date} to {last_date}...")
+    state = build_state(args.data_dir, first_date, last_date, storage='memory')
+    if 'sales' in args.preset:
+        jobs += preset_jobs('sales', first_date, last_date, state.income_store.sales.names, args.format)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    fingerprint = {'inputs': state.mtimes,
+                   'start_date': first_date.isoformat(),
+                   'end_date': last_date.isoformat(),
+                   'forecast_horizon': args.forecast_horizon}
+    job_state = JobState(os.path.join(args.output_dir, STATE_FILE), fingerprint, args.fresh)
+    unique, windows = {}, {}
+    for job in jobs:
+        window = covered_window(job, first_date, last_date)
+        if window is None:
+            print(f"Skipping {job['window']} ({job['scope']}): outside the data range {data_start} to {data_end}")
+            continue
+        key = job_id(job, window)
+        unique[key], windows[key] = job, window
+    pending = {key: job for key, job in unique.items() if not job_state.is_done(key)}
+    print(f"{len(unique)} jobs, {len(unique) - len(pending)} already done, {len(pending)} to render.")
+
+    done = failed = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(state,)) as executor:
+        futures = {executor.submit(run_job, job, windows[key], args.output_dir, args.forecast_horizon): key
+                   for key, job in pending.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            # A window clipped to the data range is rendered and flagged
+            partial = windows[key] != parse_window(pending[key]['window'])
+            try:
+                job, path, seconds = future.result()
+                done += 1
+                job_state.mark(key, 'done', output=path, seconds=seconds, job=job, partial=partial)
+                note = f" (partial: {job['window']} clipped to the data range)" if partial else ""
+                print(f"[{done + failed}/{len(pending)}] {key} done in {seconds:.1f}s{note}")
+            except Exception as e:
+                failed += 1
+                job_state.mark(key, 'failed', error=str(e), job=pending[key], partial=partial,
+                               output=os.path.join(args.output_dir, key))
+                print(f"[{done + failed}/{len(pending)}] {key} failed: {str(e)}")
+
+    print(f"Rendered {done} reports in {time.perf_counter() - started:.1f}s; {failed} failed.")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Versioned change tracking for delta sync of the KPI datasets.
+
+Every state is versioned by the latest modification time (ms) of its input
+files, so all workers that built from the same files agree on the version
+and it only grows as the files are updated. The pipeline digests the income
+rows of every date, and of every (date, sales person), into order-independent
+64-bit sums. When a rebuilt state replaces the old one, the digests are
+compared and the changed dates are appended to the new state's
+``Changelog``. ``changes_since(version)`` merges the entries after a
+client's version. It returns None if the version is unknown, e.g. older than
+the retained history or from before a restart; the client then needs the
+full payload.
+"""
+
+import zlib
+
+import numpy as np
+
+CHANGELOG_DEPTH = 100
+# Odd 64-bit multipliers for mixing the row hashes
+_MIX = tuple(np.uint64(k) for k in (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9,
+                                     0xD6E8FEB86659FD93))
+
+
+def data_version(mtimes):
+    """Version of a state: the newest input modification time in milliseconds."""
+    known = [mtime for mtime in mtimes.values() if mtime is not None]
+    return max(known) // 1_000_000 if known else 0
+
+
+def _name_hashes(index):
+    return np.array([zlib.crc32(name.encode('utf-8')) for name in index.names], dtype=np.uint64)
+
+
+def _segment_sums(values, bounds):
+    """Wrap-around sums of ``values`` between consecutive ``bounds``."""
+    cumulative = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(values, dtype=np.uint64)])
+    return cumulative[bounds[1:]] - cumulative[bounds[:-1]]
+
+
+class StateDigest:
+    """Per-date and per-(date, sales person) digests of an in-memory income store.
+
+    A row hashes its client, fund, sales person and every fee column, so any
+    change to holdings, fee rates or the client list changes the digest of the
+    dates it touches.
+    """
+
+    def __init__(self, store):
+        self.dates = list(store.dates)
+        self.sales = list(store.sales.names)
+        values = store.fee_income if store.fee_income is not None else store.income[:, None]
+        row_sales = store.row_sales()
+        row_keys = (_name_hashes(store.clients)[store.client_idx] * _MIX[0]
+                    ^ _name_hashes(store.funds)[store.fund_idx] * _MIX[1]
+                    ^ _name_hashes(store.sales)[row_sales] * _MIX[2])
+        for column in np.ascontiguousarray(values, dtype=np.float64).view(np.uint64).T:
+            row_keys = (row_keys ^ column) * _MIX[3]
+
+        self.date_digests = _segment_sums(row_keys, store.date_ptr)
+        n_sales = len(self.sales)
+        keys = store.row_dates().astype(np.int64) * n_sales + row_sales
+        order = np.argsort(keys, kind='stable')
+        bounds = np.searchsorted(keys[order], np.arange(len(self.dates) * n_sales + 1))
+        self.sales_digests = _segment_sums(row_keys[order], bounds).reshape(len(self.dates), n_sales)
+
+    @classmethod
+    def concat(cls, digests):
+        """Digest of consecutive date windows of one store (see ``income_store_chunks``)."""
+        digest = cls.__new__(cls)
+        digest.dates = [date for part in digests for date in part.dates]
+        digest.sales = digests[0].sales
+        digest.date_digests = np.concatenate([part.date_digests for part in digests])
+        digest.sales_digests = np.concatenate([part.sales_digests for part in digests])
+        return digest
+
+    def diff(self, old):
+        """``Changes`` from ``old`` to this digest."""
+        old_dates = {date: i for i, date in enumerate(old.dates)}
+        old_sales = {name: i for i, name in enumerate(old.sales)}
+        old_digests = old.date_digests.tolist()
+        changed_dates = {date for date, digest in zip(self.dates, self.date_digests.tolist())
+                         if date not in old_dates or old_digests[old_dates[date]] != digest}
+        removed_dates = set(old_dates) - set(self.dates)
+
+        sales_from = {}
+        for j, name in enumerate(self.sales):
+            old_j = old_sales.get(name)
+            for i, date in enumerate(self.dates):
+                old_i = old_dates.get(date)
+                old_digest = 0 if old_i is None or old_j is None else int(old.sales_digests[old_i, old_j])
+                if int(self.sales_digests[i, j]) != old_digest:
+                    sales_from[name] = date
+                    break
+        return Changes(changed_dates, removed_dates, sales_from,
+                       bool(changed_dates or removed_dates or sales_from))
+
+
+class Changes:
+    """What changed between two versions.
+
+    ``sales_from`` maps a sales person to the first date whose rows changed;
+    ``changed`` is True whenever the version moved on, even if no income row
+    changed (e.g. future trades that only affect the forecast).
+    """
+
+    def __init__(self, dates=(), removed_dates=(), sales_from=None, changed=False):
+        self.dates = set(dates)
+        self.removed_dates = set(removed_dates)
+        self.sales_from = dict(sales_from or {})
+        self.changed = changed
+
+    @property
+    def first_date(self):
+        """Earliest changed or removed date, None if no date changed."""
+        return min(self.dates | self.removed_dates, default=None)
+
+    def merge(self, later):
+        sales_from = dict(self.sales_from)
+        for name, date in later.sales_from.items():
+            sales_from[name] = min(date, sales_from.get(name, date))
+        return Changes(self.dates | later.dates, self.removed_dates | later.removed_dates,
+                       sales_from, self.changed or later.changed)
+
+
+class Changelog:
+    """The version and digest of one state, with the changes that led to it."""
+
+    def __init__(self, version, digest, entries=()):
+        self.version = version
+        self.digest = digest
+        # (from_version, Changes) pairs, oldest first
+        self.entries = list(entries)[-CHANGELOG_DEPTH:]
+
+    def advance(self, new):
+        """``new`` (the changelog of a freshly built state) extended with this history."""
+        if new.version < self.version:
+            # Inputs went back in time; clients holding a newer version get full payloads
+            return new
+        changes = new.digest.diff(self.digest)
+        if new.version == self.version:
+            if not changes.changed:
+                return Changelog(new.version, new.digest, self.entries)
+            # Same version but different data (e.g. another window): history is unusable
+            return new
+        changes.changed = True
+        return Changelog(new.version, new.digest, self.entries + [(self.version, changes)])
+
+    def changes_since(self, version):
+        """Merged ``Changes`` after ``version``, or None if the version is unknown."""
+        if version == self.version:
+            return Changes()
+        start = next((i for i, (from_version, _) in enumerate(self.entries) if from_version == version), None)
+        if start is None:
+            return None
+        merged = Changes()
+        for _, changes in self.entries[start:]:
+            merged = merged.merge(changes)
+        current = set(self.digest.dates)
+        merged.removed_dates -= current
+        merged.dates &= current
+        return merged
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""Server-side rendering of the KPI charts.
+
+The drawing functions take plain arrays and draw on an Axes of their own
+``Figure`` through the object-oriented Agg API, so no pyplot state is shared.
+The CJK fonts are applied with ``rc_context`` around each render only, so
+importing this module leaves ``matplotlib.rcParams`` alone; since rcParams
+are process-wide, that part of a render holds a lock. ``ChartService`` renders
+in a bounded thread pool and keeps the PNG/SVG bytes in an LRU cache bounded
+by total size. Keys include the data version, so a rebuild with changed
+inputs never serves a stale chart; concurrent requests for the same key wait
+for one render.
+"""
+
+import collections
+import datetime
+import io
+import logging
+import os
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import matplotlib
+from matplotlib import font_manager
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CHART_FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+# name -> (width in, height in, dpi, legend)
+CHART_SIZES = {
+    'full': (12, 6, 100, True),
+    'thumb': (4, 2, 80, False),
+}
+TOP_SERIES = 10
+OTHERS = '其他'
+
+# Client and sales names are Chinese; use a CJK font when one is installed
+_CJK_FONTS = ('Noto Sans CJK SC', 'Source Han Sans SC', 'WenQuanYi Zen Hei', 'SimHei', 'Microsoft YaHei',
+              'PingFang SC')
+_installed = [font.name for font in font_manager.fontManager.ttflist if font.name in _CJK_FONTS]
+_rc_lock = threading.Lock()
+if not _installed:
+    # Names render as boxes; say so once instead of warning for every glyph
+    logger.warning("No CJK font installed; Chinese names in charts will not render")
+    warnings.filterwarnings('ignore', message='Glyph .* missing from font', category=UserWarning)
+
+
+# 绘图
+def draw_cumulative_income(ax, dates, series, title):
+    """One line of cumulative income per ``{name: daily values}`` entry."""
+    for name, values in series.items():
+        ax.plot(dates, np.cumsum(values), label=name)
+    ax.set_title(title)
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Cumulative Income')
+    ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+
+
+def draw_income_composition(ax, dates, series, title):
+    """Stacked share of each ``{name: daily values}`` entry in the daily total."""
+    values = np.array([np.asarray(v, dtype=np.float64) for v in series.values()]).reshape(len(series), len(dates))
+    totals = values.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percentages = np.where(totals != 0, values / totals * 100, 0.0)
+    ax.stackplot(dates, percentages, labels=list(series))
+    ax.set_title(title)
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Percentage of Total Income')
+    ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+
+
+def draw_forecasts(ax, actual_dates, actual_cumulative, forecasts, title):
+    """Actual cumulative income and ``{label: (dates, cumulative)}`` forecasts."""
+    ax.plot(actual_dates, actual_cumulative, label='Actual')
+    for label, (dates, cumulative) in forecasts.items():
+        ax.plot(dates, cumulative, label=label)
+    ax.set_title(title)
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Cumulative Income')
+    ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+
+
+def render_chart(draw, args, fmt='png', size='full'):
+    """Bytes of one chart drawn by ``draw(ax, *args)``."""
+    width, height, dpi, legend = CHART_SIZES[size]
+    buffer = io.BytesIO()
+    rc = {'font.sans-serif': _installed + list(matplotlib.rcParams['font.sans-serif']), 'axes.unicode_minus': False}
+    with _rc_lock, matplotlib.rc_context(rc):
+        fig = Figure(figsize=(width, height), dpi=dpi)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        draw(ax, *args)
+        if not legend and ax.get_legend() is not None:
+            ax.get_legend().remove()
+            ax.set_title('')
+        fig.tight_layout()
+        fig.savefig(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def save_chart(filename, draw, *args):
+    """Render to ``filename``, in the format of its extension (PNG by default)."""
+    fmt = os.path.splitext(filename)[1][1:].lower() or 'png'
+    with open(filename, 'wb') as file:
+        file.write(render_chart(draw, args, fmt))
+
+
+# 图表数据
+def _top_series(names, matrix, top=TOP_SERIES):
+    """``{name: column}`` of the ``top`` columns by total, the rest summed as OTHERS."""
+    totals = matrix.sum(axis=0)
+    order = np.argsort(-totals, kind='stable')
+    series = {names[i]: matrix[:, i] for i in order[:top]}
+    if len(order) > top:
+        series[OTHERS] = matrix[:, order[top:]].sum(axis=1)
+    return series
+
+
+def entity_series(income_store, client_sales, entity, start_date=None, end_date=None):
+    """``(dates, {name: daily income})`` for ``'sales'`` or ``'sales:<name>'`` (its clients)."""
+    lo, hi = income_store._date_bounds(start_date, end_date)
+    dates = income_store.dates[lo:hi]
+    if entity == 'sales':
+        return dates, _top_series(income_store.sales.names, income_store.sales_daily()[lo:hi])
+    kind, _, sales_person = entity.partition(':')
+    if kind != 'sales' or sales_person not in income_store.sales:
+        raise ValueError("entity must be 'sales' or 'sales:<name>' with a known sales person")
+    clients = [client for client in income_store.clients.names
+               if client_sales.get(client, 'Unknown') == sales_person]
+    ids = [income_store.clients.get(client) for client in clients]
+    return dates, _top_series(clients, income_store.client_daily()[lo:hi][:, ids])
+
+
+def forecast_lines(forecast_service, horizon, start_date=None):
+    """``draw_forecasts`` arguments for the actual income and every model up to ``horizon``."""
+    first = forecast_service.first_date.toordinal()
+    n_actual = len(forecast_service.actual)
+    actual_cumulative = np.cumsum(forecast_service.actual)
+    offset = 0 if start_date is None else max(0, min(start_date.toordinal() - first, n_actual - 1))
+    actual_dates = [datetime.date.fromordinal(first + i) for i in range(offset, n_actual)]
+    lines = {}
+    for model in ('simple', 'complex'):
+        _, cumulative = forecast_service.series(model, horizon)
+        future = cumulative[n_actual:]
+        dates = [datetime.date.fromordinal(first + n_actual + i) for i in range(len(future))]
+        lines[f"{model.title()} Forecast"] = (dates, future)
+    return actual_dates, actual_cumulative[offset:], lines
+
+
+# 缓存与渲染池
+class ChartCache:
+    """LRU cache of rendered charts bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old)
+            self._items[key] = value
+            self.nbytes += len(value)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._items), 'bytes': self.nbytes, 'maxBytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+class ChartService:
+    """Renders charts in a thread pool and caches the bytes by key."""
+
+    def __init__(self, workers=2, cache_bytes=64 * 1024 * 1024):
+        self.cache = ChartCache(cache_bytes)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='kpi-chart')
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def render(self, key, prepare, fmt='png', size='full', timeout=None):
+        """Cached chart for ``key``; ``prepare()`` returns ``(draw, args)`` on a miss."""
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._render, key, prepare, fmt, size)
+                self._pending[key] = future
+        return future.result(timeout)
+
+    def _render(self, key, prepare, fmt, size):
+        try:
+            draw, args = prepare()
+            chart = render_chart(draw, args, fmt, size)
+            self.cache.put(key, chart)
+            return chart
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
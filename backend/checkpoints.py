@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Periodic holdings checkpoints for arbitrary as-of dates.
+
+A checkpoint is the full set of holdings at the end of a date (trades on
+that date included), written next to the data as
+``checkpoints/<set>/holdings_YYYYMMDD.csv`` in the same layout that
+``load_initial_holdings`` reads. Holdings for any as-of date are obtained by
+loading the nearest checkpoint on or before it and replaying only the
+trades after it.
+
+Each set of checkpoints is named after the snapshot and trade log it was
+built from, written to a private temporary directory and renamed into
+place, so concurrent builds (several workers, or a rebuild next to a live
+worker) never see a partial set or one another's files. Only the most
+recently used sets are kept; a reader whose set was pruned meanwhile
+replays from the base snapshot instead.
+"""
+
+import csv
+import datetime
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from kpi_master_v1_07 import load_initial_holdings
+
+CHECKPOINT_PATTERN = re.compile(r'^holdings_(\d{8})\.csv$')
+MANIFEST = 'manifest.json'
+KEEP_SETS = 3
+TMP_PREFIX = '.tmp_'
+# Temporary directories older than this are left over from crashed builds
+STALE_TMP_SECONDS = 3600
+
+
+def month_ends(start_date, end_date):
+    """Month-end dates in ``[start_date, end_date]``."""
+    dates = []
+    year, month = start_date.year, start_date.month
+    while True:
+        next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+        month_end = next_month - datetime.timedelta(days=1)
+        if month_end > end_date:
+            return dates
+        if month_end >= start_date:
+            dates.append(month_end)
+        year, month = next_month.year, next_month.month
+
+
+def sorted_trades(trades, after=None, through=None):
+    """Flatten ``{client: {fund: {date: amount}}}`` into date-ordered tuples."""
+    flat = [(date, client, fund, amount)
+            for client, funds in trades.items()
+            for fund, fund_trades in funds.items()
+            for date, amount in fund_trades.items()
+            if (after is None or date > after) and (through is None or date <= through)]
+    flat.sort(key=lambda x: x[0])
+    return flat
+
+
+def replay_trades(holdings, trades, after, through):
+    """Apply the trades in ``(after, through]`` to a copy of ``holdings``."""
+    result = {client: dict(funds) for client, funds in holdings.items()}
+    for date, client, fund, amount in sorted_trades(trades, after, through):
+        client_funds = result.setdefault(client, {})
+        client_funds[fund] = client_funds.get(fund, 0) + amount
+    return result
+
+
+# 写入检查点
+def checkpoint_key(base_date, through, sources=None):
+    """Name of the checkpoint set built from ``sources`` over ``(base_date, through]``."""
+    text = json.dumps({'base_date': base_date.isoformat(), 'through': through.isoformat(),
+                       'sources': sources or {}}, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def _write_holdings(path, holdings, date):
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['CLIENT_NAME', 'FUND_NAME', 'SHARES_DATE', 'MONEY_VALUE'])
+        for client, funds in holdings.items():
+            for fund, amount in funds.items():
+                writer.writerow([client, fund, date.strftime('%Y%m%d'),
+                                 np.format_float_positional(amount, trim='-')])
+
+
+def write_checkpoints(directory, base_holdings, base_date, trades, through, sources=None):
+    """Write the checkpoint set for every month end in ``(base_date, through]``; returns its directory."""
+    os.makedirs(directory, exist_ok=True)
+    set_dir = os.path.join(directory, checkpoint_key(base_date, through, sources))
+    dates = [d for d in month_ends(base_date, through) if d > base_date]
+    tmp_dir = tempfile.mkdtemp(prefix=TMP_PREFIX, dir=directory)
+    try:
+        holdings = {client: dict(funds) for client, funds in base_holdings.items()}
+        events = sorted_trades(trades, base_date, through)
+        i = 0
+        for checkpoint_date in dates:
+            while i < len(events) and events[i][0] <= checkpoint_date:
+                _, client, fund, amount = events[i]
+                client_funds = holdings.setdefault(client, {})
+                client_funds[fund] = client_funds.get(fund, 0) + amount
+                i += 1
+            path = os.path.join(tmp_dir, f"holdings_{checkpoint_date.strftime('%Y%m%d')}.csv")
+            _write_holdings(path, holdings, checkpoint_date)
+
+        manifest = {'base_date': base_date.isoformat(), 'through': through.isoformat(),
+                    'sources': sources or {}, 'checkpoints': [d.isoformat() for d in dates]}
+        with open(os.path.join(tmp_dir, MANIFEST), 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, indent=2)
+        try:
+            os.rename(tmp_dir, set_dir)
+        except OSError:
+            # Another build published the same set first
+            if read_manifest(set_dir) is None:
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    print(f"Wrote {len(dates)} holdings checkpoints to {set_dir}.")
+    prune_checkpoints(directory, set_dir)
+    return set_dir
+
+
+def prune_checkpoints(directory, current):
+    """Remove all but the ``KEEP_SETS`` most recently used sets, and stale temporary directories."""
+    sets = []
+    now = time.time()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if not os.path.isdir(path):
+            continue
+        if name.startswith(TMP_PREFIX):
+            if now - os.stat(path).st_mtime > STALE_TMP_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+        elif path != current:
+            sets.append((os.stat(path).st_mtime, path))
+    for _, path in sorted(sets, reverse=True)[KEEP_SETS - 1:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST), 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def ensure_checkpoints(directory, base_holdings, base_date, trades, sources=None):
+    """Directory of the checkpoint set built from ``sources``, written first if it is missing."""
+    through = max((date for funds in trades.values() for fund_trades in funds.values()
+                   for date in fund_trades), default=base_date)
+    set_dir = os.path.join(directory, checkpoint_key(base_date, through, sources))
+    if read_manifest(set_dir) is not None:
+        try:
+            # Mark as recently used so other builds do not prune it
+            os.utime(set_dir)
+            return set_dir
+        except FileNotFoundError:
+            pass
+    return write_checkpoints(directory, base_holdings, base_date, trades, through, sources)
+
+
+# 读取检查点
+def list_checkpoints(directory):
+    """Sorted ``[(date, path)]`` of the checkpoints in ``directory``."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    checkpoints = []
+    for name in names:
+        match = CHECKPOINT_PATTERN.match(name)
+        if match:
+            date = datetime.datetime.strptime(match.group(1), '%Y%m%d').date()
+            checkpoints.append((date, os.path.join(directory, name)))
+    return sorted(checkpoints)
+
+
+def nearest_checkpoint(directory, as_of):
+    """Latest ``(date, path)`` checkpoint on or before ``as_of``, or None."""
+    candidates = [c for c in list_checkpoints(directory) if c[0] <= as_of]
+    return candidates[-1] if candidates else None
+
+
+def holdings_as_of(as_of, directory, base_holdings, base_date, trades):
+    """Holdings at the end of ``as_of``, replayed from the nearest checkpoint in the set ``directory``."""
+    checkpoint = nearest_checkpoint(directory, as_of)
+    start_holdings, start = base_holdings, base_date
+    if checkpoint is not None and checkpoint[0] > base_date:
+        try:
+            start_holdings = load_initial_holdings(checkpoint[1], target_date=checkpoint[0].strftime('%Y%m%d'))
+            start = checkpoint[0]
+        except FileNotFoundError:
+            # The set was pruned by another build; replay from the base snapshot
+            pass
+    if as_of < start:
+        raise ValueError(f"No holdings snapshot on or before {as_of}")
+    return replay_trades(start_holdings, trades, start, as_of)
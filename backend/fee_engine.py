@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Fee schedule covering every revenue line in PRODUCT_INFO.csv.
+
+Each fee column (management, redemption, advisory, custody) is loaded into
+one ``(version, fund, fee_type)`` array of rates. An optional
+``EFFECTIVE_DATE`` column makes rates time-varying: a row applies from its
+date until the next row for the same fund, and rows without a date apply
+from the start. Management, advisory and custody fees accrue daily on the
+holdings: annual rates are converted to daily ones as ``rate / 365``, and
+for management fees the published ``MA_FEES_DAILY`` figure is used when
+present. The income of those lines is one array multiply over the expanded
+holding rows (see ``income_store_from_intervals``). The redemption fee is
+charged once, at its ``RD_FEES`` rate, on the amount of each redemption.
+"""
+
+import csv
+import datetime
+
+import numpy as np
+
+from income_store import NameIndex
+
+FEE_TYPES = ('ma', 'rd', 'ad', 'cus')
+FEE_COLUMNS = {'ma': 'MA_FEES', 'rd': 'RD_FEES', 'ad': 'AD_FEES', 'cus': 'CUS_FEES'}
+# Fees charged on the traded amount instead of accruing on holdings
+TRADE_FEE_TYPES = ('rd',)
+ACCRUAL_MASK = np.array([fee_type not in TRADE_FEE_TYPES for fee_type in FEE_TYPES])
+REDEMPTION = '赎回'
+DEFAULT_FEE_TYPE = 'ma'
+# Selector for the sum of all revenue lines
+TOTAL_FEE_TYPE = 'total'
+FEE_SELECTORS = FEE_TYPES + (TOTAL_FEE_TYPE,)
+DAYS_PER_YEAR = 365
+
+
+def parse_rate(value):
+    """Fee rate from a CSV cell; blank and '-' mean no fee."""
+    value = (value or '').strip()
+    if value in ('', '-'):
+        return 0.0
+    return float(value)
+
+
+def parse_effective_date(value):
+    value = (value or '').strip()
+    if not value:
+        return datetime.date.min
+    if '-' in value:
+        return datetime.date.fromisoformat(value)
+    return datetime.datetime.strptime(value, '%Y%m%d').date()
+
+
+def daily_rates(row):
+    """Rate of every fee type for one PRODUCT_INFO row: daily, or per traded amount for trade fees."""
+    rates = [parse_rate(row.get(FEE_COLUMNS[fee_type])) / (1 if fee_type in TRADE_FEE_TYPES else DAYS_PER_YEAR)
+             for fee_type in FEE_TYPES]
+    if (row.get('MA_FEES_DAILY') or '').strip():
+        rates[FEE_TYPES.index('ma')] = parse_rate(row['MA_FEES_DAILY'])
+    return rates
+
+
+class FeeSchedule:
+    """Daily fee rates per (fund, fee type), forward-filled between effective dates."""
+
+    def __init__(self, funds, effective_dates, rates, active):
+        self.funds = funds
+        self.effective_dates = effective_dates
+        self.effective_ordinals = np.array([d.toordinal() for d in effective_dates], dtype=np.int64)
+        # Index 0 is "before the first effective date": no fund has a rate yet.
+        self.rates = rates
+        self.active = active
+
+    def versions(self, ordinals):
+        """Rate version in force on each day (as date ordinals)."""
+        return np.searchsorted(self.effective_ordinals, ordinals, side='right')
+
+    def version_on(self, date=None):
+        if date is None:
+            return len(self.effective_dates)
+        return int(self.versions(np.array([date.toordinal()]))[0])
+
+    def product_info(self, fee_type=DEFAULT_FEE_TYPE, date=None):
+        """Legacy ``{fund: daily rate}`` for one fee type (``None``: all lines) on ``date``.
+
+        Trade fees do not accrue daily, so their daily rate is 0.
+        """
+        version = self.version_on(date)
+        rates = self.rates[version] * ACCRUAL_MASK
+        if fee_type is None:
+            rates = rates.sum(axis=1)
+        else:
+            rates = rates[:, FEE_TYPES.index(fee_type)]
+        return {fund: rate for fund, rate, active in
+                zip(self.funds.names, rates.tolist(), self.active[version].tolist()) if active}
+
+
+# 加载费率表
+def load_fee_schedule(filename):
+    funds = NameIndex()
+    rows = []
+    with open(filename, 'r', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            fund_id = funds.add(row['FUND_NAME'])
+            rows.append((parse_effective_date(row.get('EFFECTIVE_DATE')), fund_id, daily_rates(row)))
+
+    effective_dates = sorted({effective for effective, _, _ in rows})
+    rates = np.zeros((len(effective_dates) + 1, len(funds), len(FEE_TYPES)))
+    active = np.zeros((len(effective_dates) + 1, len(funds)), dtype=bool)
+    rows.sort(key=lambda x: x[0])  # Stable, so later rows for the same date win
+    i = 0
+    for version, effective in enumerate(effective_dates, start=1):
+        rates[version] = rates[version - 1]
+        active[version] = active[version - 1]
+        while i < len(rows) and rows[i][0] == effective:
+            _, fund_id, fund_rates = rows[i]
+            rates[version, fund_id] = fund_rates
+            active[version, fund_id] = True
+            i += 1
+
+    print(f"Loaded {len(FEE_TYPES)} fee types for {len(funds)} funds "
+          f"({len(effective_dates)} effective date(s)).")
+    return FeeSchedule(funds, effective_dates, rates, active)
+
+
+def add_redemptions(redemptions, validated):
+    """Add one chunk of validated trade rows to ``{(client, fund, date): redeemed amount}``."""
+    rows = validated[validated['ACTION'] == REDEMPTION]
+    totals = rows['money'].abs().groupby([rows['CLIENT_NAME'], rows['FUND_NAME'], rows['date']], sort=False).sum()
+    for key, amount in totals.items():
+        redemptions[key] = redemptions.get(key, 0) + float(amount)
+    return redemptions
+
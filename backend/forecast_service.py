@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Precomputed income forecasts for ``/api/forecast``.
+
+Actual daily income is reduced once to a prefix-sum array, and each model
+is forecast once per state out to ``MAX_HORIZON_DAYS``. A request for a
+given (model, horizon, granularity) then only slices cached arrays, so the
+response costs O(points returned) and never re-aggregates the history.
+"""
+
+import datetime
+import threading
+
+import numpy as np
+import pandas as pd
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+FORECAST_MODELS = ('simple', 'complex')
+GRANULARITIES = ('day', 'week', 'month')
+DEFAULT_HORIZON = datetime.date(2024, 12, 31)
+MAX_HORIZON_DAYS = 731
+
+
+def future_trade_adjustment(trades, product_info, last_date, days):
+    """Change in daily income from trades already booked after ``last_date``.
+
+    A trade changes the holding from its date on, so its income effect is a
+    step that persists for the rest of the horizon.
+    """
+    delta = np.zeros(days)
+    for client_funds in trades.values():
+        for fund, fund_trades in client_funds.items():
+            fee = product_info.get(fund)
+            if fee is None:
+                continue
+            for date, amount in fund_trades.items():
+                offset = (date - last_date).days - 1
+                if 0 <= offset < days:
+                    delta[offset] += amount * fee
+    return np.cumsum(delta)
+
+
+def fit_complex_forecast(dates, daily_totals, steps):
+    """SARIMA forecast of total daily income, or None with under two weeks of data."""
+    if len(daily_totals) < 14:
+        return None
+    income_series = pd.Series(daily_totals, index=pd.DatetimeIndex(dates, freq='D'))
+    model = SARIMAX(income_series,
+                    order=(1, 1, 1),
+                    seasonal_order=(1, 1, 1, 7),  # Weekly seasonality
+                    enforce_stationarity=False,
+                    enforce_invertibility=False)
+    results = model.fit(disp=False)
+    return np.asarray(results.forecast(steps=steps))
+
+
+class ForecastService:
+    """Actual income plus cached model forecasts for one KPI state."""
+
+    def __init__(self, dates, daily_totals, trade_adjustment=None, complex_forecast=None):
+        self.first_date = dates[0]
+        self.last_date = dates[-1]
+        self.actual = np.asarray(daily_totals, dtype=np.float64)
+        self.forecasts = {
+            'simple': np.full(MAX_HORIZON_DAYS, self.actual[-1]),
+        }
+        if complex_forecast is not None:
+            adjustment = trade_adjustment if trade_adjustment is not None else 0
+            self.forecasts['complex'] = np.asarray(complex_forecast)[:MAX_HORIZON_DAYS] + adjustment
+        else:
+            # Too little history for SARIMA; fall back like forecast_income_complex
+            self.forecasts['complex'] = self.forecasts['simple']
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_series'] = {}
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, income_store, trades, product_info):
+        dates = income_store.dates
+        daily_totals = income_store.daily_totals()
+        adjustment = future_trade_adjustment(trades, product_info, dates[-1], MAX_HORIZON_DAYS)
+        complex_forecast = fit_complex_forecast(dates, daily_totals, MAX_HORIZON_DAYS)
+        return cls(dates, daily_totals, adjustment, complex_forecast)
+
+    def parse_horizon(self, value):
+        """Horizon as an ISO end date or a number of days after the last actual date."""
+        if value is None or value == '':
+            horizon = DEFAULT_HORIZON
+        elif value.isdigit():
+            horizon = self.last_date + datetime.timedelta(days=int(value))
+        else:
+            horizon = datetime.date.fromisoformat(value)
+        if horizon < self.first_date:
+            raise ValueError(f"horizon must not be before {self.first_date.isoformat()}")
+        if (horizon - self.last_date).days > MAX_HORIZON_DAYS:
+            raise ValueError(f"horizon must be within {MAX_HORIZON_DAYS} days of {self.last_date.isoformat()}")
+        return horizon
+
+    def series(self, model, horizon):
+        """``(income, cumulative)`` daily arrays from the first date to ``horizon``."""
+        key = (model, horizon)
+        cached = self._series.get(key)
+        if cached is None:
+            days = (horizon - self.first_date).days + 1
+            income = np.concatenate([self.actual, self.forecasts[model]])[:days]
+            cached = (income, np.cumsum(income))
+            with self._lock:
+                if len(self._series) > 64:
+                    self._series.clear()
+                self._series[key] = cached
+        return cached
+
+    def _bucket_ends(self, days, granularity):
+        """Index of the last day of every bucket in a ``days``-long series."""
+        if granularity == 'day':
+            return np.arange(days)
+        if granularity == 'week':
+            first_sunday = (6 - self.first_date.weekday()) % 7
+            ends = np.arange(first_sunday, days, 7)
+        else:
+            ends = []
+            year, month = self.first_date.year, self.first_date.month
+            while True:
+                year, month = year + month // 12, month % 12 + 1
+                offset = (datetime.date(year, month, 1) - self.first_date).days - 1
+                if offset >= days:
+                    break
+                ends.append(offset)
+            ends = np.array(ends, dtype=np.int64)
+        if len(ends) == 0 or ends[-1] != days - 1:
+            ends = np.append(ends, days - 1)
+        return ends
+
+    def points(self, model, horizon, granularity):
+        income, cumulative = self.series(model, horizon)
+        ends = self._bucket_ends(len(income), granularity)
+        bucket_cumulative = cumulative[ends]
+        if granularity == 'day':
+            bucket_income = income
+        else:
+            bucket_income = np.diff(bucket_cumulative, prepend=0.0)
+        n_actual = len(self.actual)
+        first = self.first_date.toordinal()
+        return [{
+            'date': datetime.date.fromordinal(first + end).isoformat(),
+            'income': value,
+            'cumulativeIncome': total,
+            'isActual': end < n_actual
+        } for end, value, total in zip(ends.tolist(), bucket_income.tolist(), bucket_cumulative.tolist())]
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""Run-length (interval) representation of holdings.
+
+Holdings only change on trade dates, so each (client, fund) position is kept
+as a sequence of ``(start_date, end_date, amount)`` intervals instead of one
+value per calendar day. Zero-amount stretches (e.g. after a full redemption)
+are not stored. Memory and compute scale with the number of trades rather
+than positions x days.
+"""
+
+import datetime
+
+import numpy as np
+
+from income_store import IncomeStore, NameIndex
+from fee_engine import FEE_TYPES, ACCRUAL_MASK
+
+# Days of income expanded at a time when streaming to the SQLite store
+INCOME_CHUNK_DAYS = 31
+
+
+class HoldingIntervals:
+    """Per-position holding intervals between ``start_date`` and ``end_date``.
+
+    Intervals are stored as flat arrays sorted by position and start date;
+    ``pos_ptr`` gives the interval range of each position. Dates are kept as
+    proleptic ordinals and both interval ends are inclusive.
+    """
+
+    __slots__ = ('start_date', 'end_date', 'clients', 'funds', 'positions',
+                 'pos_client', 'pos_fund', 'pos_ptr', 'interval_pos',
+                 'starts', 'ends', 'amounts', 'keys')
+
+    def __init__(self, start_date, end_date, clients, funds, pos_client, pos_fund,
+                 interval_pos, starts, ends, amounts):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.clients = clients
+        self.funds = funds
+        self.pos_client = np.asarray(pos_client, dtype=np.int32)
+        self.pos_fund = np.asarray(pos_fund, dtype=np.int32)
+        self.positions = {(c, f): i for i, (c, f) in
+                          enumerate(zip(self.pos_client.tolist(), self.pos_fund.tolist()))}
+
+        interval_pos = np.asarray(interval_pos, dtype=np.int32)
+        starts = np.asarray(starts, dtype=np.int64)
+        order = np.lexsort((starts, interval_pos))
+        self.interval_pos = interval_pos[order]
+        self.starts = starts[order]
+        self.ends = np.asarray(ends, dtype=np.int64)[order]
+        self.amounts = np.asarray(amounts, dtype=np.float64)[order]
+        self.pos_ptr = np.searchsorted(self.interval_pos, np.arange(len(self.pos_client) + 1))
+        # Sorted (position, start) keys for as-of lookups
+        self.keys = self.interval_pos.astype(np.int64) * (1 << 32) + self.starts
+
+    def __len__(self):
+        return len(self.amounts)
+
+    @property
+    def nbytes(self):
+        return (self.pos_client.nbytes + self.pos_fund.nbytes + self.pos_ptr.nbytes
+                + self.interval_pos.nbytes + self.starts.nbytes + self.ends.nbytes
+                + self.amounts.nbytes)
+
+    def _position(self, client, fund):
+        client_id = self.clients.get(client)
+        fund_id = self.funds.get(fund)
+        return self.positions.get((client_id, fund_id))
+
+    def intervals(self, client, fund):
+        """``[(start_date, end_date, amount)]`` for one position."""
+        pos = self._position(client, fund)
+        if pos is None:
+            return []
+        lo, hi = self.pos_ptr[pos], self.pos_ptr[pos + 1]
+        return [(datetime.date.fromordinal(s), datetime.date.fromordinal(e), a)
+                for s, e, a in zip(self.starts[lo:hi].tolist(), self.ends[lo:hi].tolist(),
+                                   self.amounts[lo:hi].tolist())]
+
+    # 查询
+    def amounts_on(self, positions, ordinals):
+        """Holding amount of each (position, date ordinal) pair, 0 where not held.
+
+        One ``searchsorted`` over the sorted (position, start) keys finds the
+        interval starting last on or before each day.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        idx = np.searchsorted(self.keys, positions * (1 << 32) + ordinals, side='right') - 1
+        held = idx >= 0
+        held[held] &= (self.interval_pos[idx[held]] == positions[held]) & (self.ends[idx[held]] >= ordinals[held])
+        result = np.zeros(len(positions))
+        result[held] = self.amounts[idx[held]]
+        return result
+
+    def amount_on(self, client, fund, date):
+        """Holding amount of one position on ``date`` (0 when not held)."""
+        pos = self._position(client, fund)
+        if pos is None:
+            return 0
+        amount = self.amounts_on([pos], [date.toordinal()])[0]
+        return float(amount) if amount else 0
+
+    def active_on(self, date):
+        """``{client: {fund: amount}}`` for every position held on ``date``."""
+        day = date.toordinal()
+        mask = (self.starts <= day) & (self.ends >= day)
+        active = {}
+        for pos, amount in zip(self.interval_pos[mask].tolist(), self.amounts[mask].tolist()):
+            client = self.clients[self.pos_client[pos]]
+            active.setdefault(client, {})[self.funds[self.pos_fund[pos]]] = amount
+        return active
+
+    def overlap_days(self, start_date=None, end_date=None):
+        """Number of days each interval overlaps ``[start_date, end_date]``."""
+        lo = (start_date or self.start_date).toordinal()
+        hi = (end_date or self.end_date).toordinal()
+        return np.clip(np.minimum(self.ends, hi) - np.maximum(self.starts, lo) + 1, 0, None)
+
+    def range_sum(self, client, fund, start_date=None, end_date=None):
+        """Amount-days of one position over ``[start_date, end_date]``."""
+        pos = self._position(client, fund)
+        if pos is None:
+            return 0.0
+        lo, hi = self.pos_ptr[pos], self.pos_ptr[pos + 1]
+        days = self.overlap_days(start_date, end_date)[lo:hi]
+        return float(np.dot(self.amounts[lo:hi], days))
+
+    def fee_rates(self, product_info):
+        """Daily fee of each interval's fund (NaN where the fund is unknown)."""
+        fund_fees = np.array([product_info.get(fund, np.nan) for fund in self.funds], dtype=np.float64)
+        return fund_fees[self.pos_fund[self.interval_pos]]
+
+    def income_between(self, product_info, start_date=None, end_date=None):
+        """Total income over a range: sum of amount x ``MA_FEES_DAILY`` x days."""
+        fees = np.nan_to_num(self.fee_rates(product_info))
+        return float(np.sum(self.amounts * fees * self.overlap_days(start_date, end_date)))
+
+    # 兼容视图
+    def to_daily_holdings(self, start_date=None, end_date=None):
+        """Legacy ``{client: {fund: {date: amount}}}`` view over a window.
+
+        Every position known at the start of the window is carried on every
+        day, including days at zero, exactly as ``calculate_daily_holdings``
+        produced it. Only use this for small windows.
+        """
+        first_day = (start_date or self.start_date).toordinal()
+        last_day = (end_date or self.end_date).toordinal()
+        # Each position is carried from the later of the window start and its first interval
+        has_intervals = self.pos_ptr[1:] > self.pos_ptr[:-1]
+        positions = np.nonzero(has_intervals)[0]
+        firsts = np.maximum(self.starts[self.pos_ptr[positions]], first_day)
+        positions, firsts = positions[firsts <= last_day], firsts[firsts <= last_day]
+        lengths = last_day - firsts + 1
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        ordinals = np.repeat(firsts, lengths) + offsets
+        amounts = self.amounts_on(np.repeat(positions, lengths), ordinals).tolist()
+        dates = {day: datetime.date.fromordinal(day) for day in range(first_day, last_day + 1)}
+
+        holdings = {}
+        start = 0
+        for pos, length in zip(positions.tolist(), lengths.tolist()):
+            client, fund = self.clients[self.pos_client[pos]], self.funds[self.pos_fund[pos]]
+            days = ordinals[start:start + length].tolist()
+            holdings.setdefault(client, {})[fund] = {dates[day]: amount for day, amount in
+                                                     zip(days, amounts[start:start + length])}
+            start += length
+        return holdings
+
+
+# 构建持仓区间
+def build_holding_intervals(initial_holdings, trades, start_date, end_date):
+    """Build holding intervals from initial holdings and trades.
+
+    Follows ``calculate_daily_holdings``: initial holdings are held from
+    ``start_date``, a trade on date ``d`` in ``(start_date, end_date]`` changes
+    the amount from ``d`` on, and a position first seen in trades starts on its
+    first trade date.
+    """
+    clients, funds = NameIndex(), NameIndex()
+    opening = {}
+    changes = {}
+    for client, client_funds in initial_holdings.items():
+        for fund, amount in client_funds.items():
+            opening[(clients.add(client), funds.add(fund))] = amount
+    for client, client_funds in trades.items():
+        for fund, fund_trades in client_funds.items():
+            dated = sorted((date, amount) for date, amount in fund_trades.items()
+                           if start_date < date <= end_date)
+            if dated:
+                changes[(clients.add(client), funds.add(fund))] = dated
+
+    first_day, last_day = start_date.toordinal(), end_date.toordinal()
+    pos_client, pos_fund = [], []
+    interval_pos, starts, ends, amounts = [], [], [], []
+    for pos, key in enumerate(list(opening) + [k for k in changes if k not in opening]):
+        pos_client.append(key[0])
+        pos_fund.append(key[1])
+        events = changes.get(key, [])
+        if key in opening:
+            amount, begin = opening[key], first_day
+        else:
+            amount, begin = 0, events[0][0].toordinal()
+        for date, trade_amount in events:
+            day = date.toordinal()
+            if day > begin:
+                if amount:
+                    interval_pos.append(pos)
+                    starts.append(begin)
+                    ends.append(day - 1)
+                    amounts.append(amount)
+                begin = day
+            amount += trade_amount
+        if amount:
+            interval_pos.append(pos)
+            starts.append(begin)
+            ends.append(last_day)
+            amounts.append(amount)
+
+    print(f"Built {len(amounts)} holding intervals for {len(pos_client)} positions.")
+    return HoldingIntervals(start_date, end_date, clients, funds, pos_client, pos_fund,
+                            interval_pos, starts, ends, amounts)
+
+
+def income_store_from_intervals(intervals, fee_schedule, client_sales, nav_series=None,
+                                start_date=None, end_date=None, redemptions=None):
+    """Expand holding intervals into an ``IncomeStore`` with one column per fee type.
+
+    Every accrued revenue line comes out of a single multiply of the expanded
+    daily holdings by the ``(row, fee_type)`` rate matrix, so extra fee
+    columns add width rather than passes. With a ``nav_series`` the interval
+    amounts are shares, and each day is first valued at the fund's as-of NAV.
+    Trade fees are charged on ``redemptions`` (``{(client, fund, date):
+    amount}``, see ``add_redemptions``) on the day of the redemption.
+    ``start_date``/``end_date`` expand only part of the intervals' window; the
+    client, fund and sales indexes are the same for every part.
+    """
+    first_day = (start_date or intervals.start_date).toordinal()
+    last_day = (end_date or intervals.end_date).toordinal()
+    dates = [datetime.date.fromordinal(d) for d in range(first_day, last_day + 1)]
+
+    clients, funds, sales = NameIndex(), NameIndex(), NameIndex()
+    client_map = np.empty(len(intervals.clients), dtype=np.int32)
+    for client_id, client in enumerate(intervals.clients):
+        client_map[client_id] = clients.add(client)
+    client_sales_idx = [sales.add(client_sales.get(client, "Unknown")) for client in clients]
+
+    # Only funds in the fee schedule produce income; keep them in position order.
+    fund_map = np.full(len(intervals.funds), -1, dtype=np.int32)
+    schedule_map = np.full(len(intervals.funds), -1, dtype=np.int32)
+    for fund_id in intervals.pos_fund.tolist():
+        fund = intervals.funds[fund_id]
+        if fund_map[fund_id] < 0 and fund in fee_schedule.funds:
+            fund_map[fund_id] = funds.add(fund)
+            schedule_map[fund_id] = fee_schedule.funds.get(fund)
+
+    starts = np.maximum(intervals.starts, first_day)
+    ends = np.minimum(intervals.ends, last_day)
+    keep = ((intervals.amounts != 0) & (starts <= ends)
+            & (schedule_map[intervals.pos_fund[intervals.interval_pos]] >= 0))
+    lengths = (ends - starts + 1)[keep]
+    interval_start = starts[keep] - first_day
+    pos = intervals.interval_pos[keep]
+
+    # Day offset within each interval via a cumulative-sum ramp
+    row_offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    date_idx = np.repeat(interval_start, lengths) + row_offsets
+    client_idx = np.repeat(client_map[intervals.pos_client[pos]], lengths)
+    fund_idx = np.repeat(fund_map[intervals.pos_fund[pos]], lengths)
+    amounts = np.repeat(intervals.amounts[keep], lengths)
+    if nav_series is not None:
+        nav_map = np.array([nav_series.funds.get(fund, -1) for fund in intervals.funds], dtype=np.int64)
+        navs = nav_series.asof(np.repeat(nav_map[intervals.pos_fund[pos]], lengths), date_idx + first_day)
+        amounts = amounts * np.nan_to_num(navs)
+
+    # 计算收入: rates in force on each row's date, all fee types at once
+    versions = fee_schedule.versions(date_idx + first_day)
+    rates = fee_schedule.rates[versions, np.repeat(schedule_map[intervals.pos_fund[pos]], lengths)]
+    income = amounts[:, None] * (rates * ACCRUAL_MASK)
+
+    if redemptions:
+        keys = [(clients.get(client), funds.get(fund), fee_schedule.funds.get(fund), date.toordinal(), amount)
+                for (client, fund, date), amount in redemptions.items()
+                if first_day <= date.toordinal() <= last_day and client in clients and fund in funds]
+        if keys:
+            r_client, r_fund, r_schedule, r_day, r_amount = (np.array(column) for column in zip(*keys))
+            r_rates = fee_schedule.rates[fee_schedule.versions(r_day), r_schedule] * ~ACCRUAL_MASK
+            date_idx = np.concatenate([date_idx, r_day - first_day])
+            client_idx = np.concatenate([client_idx, r_client])
+            fund_idx = np.concatenate([fund_idx, r_fund])
+            income = np.concatenate([income, r_amount[:, None] * r_rates])
+            # A redemption day of a position still held has an accrual row too
+            row_keys = (date_idx.astype(np.int64) * len(clients) + client_idx) * len(funds) + fund_idx
+            unique_keys, inverse = np.unique(row_keys, return_inverse=True)
+            merged = np.zeros((len(unique_keys), income.shape[1]))
+            np.add.at(merged, inverse, income)
+            date_idx, rest = np.divmod(unique_keys, len(clients) * len(funds))
+            client_idx, fund_idx = np.divmod(rest, len(funds))
+            income = merged
+    nonzero = income.any(axis=1)
+
+    return IncomeStore(dates, clients, funds, sales, client_sales_idx,
+                       date_idx[nonzero], client_idx[nonzero], fund_idx[nonzero], income[nonzero],
+                       fee_types=FEE_TYPES)
+
+
+def income_store_chunks(intervals, fee_schedule, client_sales, nav_series=None, redemptions=None,
+                        days=INCOME_CHUNK_DAYS):
+    """Yield the ``IncomeStore`` of consecutive ``days``-day windows of the intervals.
+
+    Used to stream the income rows into another store without holding them
+    all in memory at once.
+    """
+    first_day, last_day = intervals.start_date.toordinal(), intervals.end_date.toordinal()
+    for lo in range(first_day, last_day + 1, days):
+        hi = min(lo + days - 1, last_day)
+        yield income_store_from_intervals(intervals, fee_schedule, client_sales, nav_series,
+                                          datetime.date.fromordinal(lo), datetime.date.fromordinal(hi),
+                                          redemptions)
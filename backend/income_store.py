@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""Sparse, dictionary-encoded storage for daily income.
+
+Client, fund and sales person names are interned to integer IDs and income is
+kept as COO rows (client, fund, income) sorted by date, with a CSR-style row
+pointer per date. Zero-income positions are not stored at all. The nested
+``{date: {client: {fund: income}}}`` views used by the report and the API are
+derived from the store on demand instead of being kept resident.
+"""
+
+import heapq
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+class NameIndex:
+    """Interns names to consecutive integer IDs."""
+
+    __slots__ = ('names', 'ids')
+
+    def __init__(self, names=()):
+        self.names = []
+        self.ids = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        idx = self.ids.get(name)
+        if idx is None:
+            idx = len(self.names)
+            self.ids[name] = idx
+            self.names.append(name)
+        return idx
+
+    def get(self, name, default=None):
+        return self.ids.get(name, default)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __getitem__(self, idx):
+        return self.names[idx]
+
+
+class IncomeStore:
+    """Daily income per (date, client, fund), stored sparsely."""
+
+    __slots__ = ('dates', 'date_ids', 'clients', 'funds', 'sales',
+                 'client_sales_idx', 'date_ptr', 'client_idx', 'fund_idx', 'income',
+                 'fee_types', 'fee_income')
+
+    def __init__(self, dates, clients, funds, sales, client_sales_idx,
+                 date_idx, client_idx, fund_idx, income, fee_types=()):
+        self.dates = list(dates)
+        self.date_ids = {date: i for i, date in enumerate(self.dates)}
+        self.clients = clients
+        self.funds = funds
+        self.sales = sales
+        self.client_sales_idx = np.asarray(client_sales_idx, dtype=np.int32)
+
+        date_idx = np.asarray(date_idx, dtype=np.int32)
+        client_idx = np.asarray(client_idx, dtype=np.int32)
+        fund_idx = np.asarray(fund_idx, dtype=np.int32)
+        order = np.lexsort((fund_idx, client_idx, date_idx))
+        self.client_idx = client_idx[order]
+        self.fund_idx = fund_idx[order]
+        income = np.asarray(income, dtype=np.float64)[order]
+        if income.ndim == 2:
+            # One column per revenue line; ``income`` is their sum
+            self.fee_types = tuple(fee_types)
+            self.fee_income = income
+            self.income = income.sum(axis=1)
+        else:
+            self.fee_types = ()
+            self.fee_income = None
+            self.income = income
+        self.date_ptr = np.searchsorted(date_idx[order], np.arange(len(self.dates) + 1))
+
+    @classmethod
+    def from_daily_holdings(cls, daily_holdings, product_info, client_sales):
+        """Build the store from ``{client: {fund: {date: amount}}}`` holdings."""
+        all_dates = set()
+        for client_funds in daily_holdings.values():
+            for fund_holdings in client_funds.values():
+                all_dates.update(fund_holdings.keys())
+        dates = sorted(all_dates)
+        date_ids = {date: i for i, date in enumerate(dates)}
+
+        clients, funds, sales = NameIndex(), NameIndex(), NameIndex()
+        client_sales_idx = []
+        date_idx, client_idx, fund_idx, income = [], [], [], []
+        for client, client_funds in daily_holdings.items():
+            client_id = clients.add(client)
+            client_sales_idx.append(sales.add(client_sales.get(client, "Unknown")))
+            for fund, holdings in client_funds.items():
+                fee = product_info.get(fund)
+                if fee is None:
+                    continue
+                fund_id = funds.add(fund)
+                for date, amount in holdings.items():
+                    value = amount * fee
+                    if value:
+                        date_idx.append(date_ids[date])
+                        client_idx.append(client_id)
+                        fund_idx.append(fund_id)
+                        income.append(value)
+
+        return cls(dates, clients, funds, sales, client_sales_idx,
+                   date_idx, client_idx, fund_idx, income)
+
+    # 基本属性
+    def __len__(self):
+        return len(self.income)
+
+    @property
+    def nbytes(self):
+        fee_bytes = self.fee_income.nbytes if self.fee_income is not None else 0
+        return (self.date_ptr.nbytes + self.client_idx.nbytes + self.fund_idx.nbytes
+                + self.income.nbytes + self.client_sales_idx.nbytes + fee_bytes)
+
+    @property
+    def last_date(self):
+        return self.dates[-1] if self.dates else None
+
+    def fee_line(self, fee_type=None):
+        """Store of one revenue line, or of the sum of all lines for ``None``.
+
+        Shares the dimension indexes; rows where the line is zero are dropped.
+        """
+        if fee_type is None:
+            income = self.income
+        else:
+            income = self.fee_income[:, self.fee_types.index(fee_type)]
+        keep = income != 0
+        line = IncomeStore.__new__(IncomeStore)
+        line.dates = self.dates
+        line.date_ids = self.date_ids
+        line.clients = self.clients
+        line.funds = self.funds
+        line.sales = self.sales
+        line.client_sales_idx = self.client_sales_idx
+        line.client_idx = self.client_idx[keep]
+        line.fund_idx = self.fund_idx[keep]
+        line.income = income[keep]
+        line.fee_types = ()
+        line.fee_income = None
+        line.date_ptr = np.searchsorted(self.row_dates()[keep], np.arange(len(self.dates) + 1))
+        return line
+
+    def row_dates(self):
+        """Date index of every stored row."""
+        return np.repeat(np.arange(len(self.dates), dtype=np.int32), np.diff(self.date_ptr))
+
+    def row_sales(self):
+        """Sales person index of every stored row."""
+        return self.client_sales_idx[self.client_idx]
+
+    def _date_bounds(self, start_date=None, end_date=None):
+        lo = 0 if start_date is None else bisect_left(self.dates, start_date)
+        hi = len(self.dates) if end_date is None else bisect_right(self.dates, end_date)
+        return lo, max(lo, hi)
+
+    def _rows(self, start_date=None, end_date=None):
+        lo, hi = self._date_bounds(start_date, end_date)
+        return slice(int(self.date_ptr[lo]), int(self.date_ptr[hi]))
+
+    # 聚合
+    def daily_totals(self):
+        return np.bincount(self.row_dates(), weights=self.income, minlength=len(self.dates))
+
+    def client_totals(self, start_date=None, end_date=None):
+        rows = self._rows(start_date, end_date)
+        return np.bincount(self.client_idx[rows], weights=self.income[rows], minlength=len(self.clients))
+
+    def fund_totals(self, start_date=None, end_date=None):
+        rows = self._rows(start_date, end_date)
+        return np.bincount(self.fund_idx[rows], weights=self.income[rows], minlength=len(self.funds))
+
+    def sales_totals(self, start_date=None, end_date=None):
+        rows = self._rows(start_date, end_date)
+        return np.bincount(self.row_sales()[rows], weights=self.income[rows], minlength=len(self.sales))
+
+    def sales_daily(self):
+        """Dense ``(dates, sales persons)`` income matrix."""
+        n_sales = len(self.sales)
+        keys = self.row_dates().astype(np.int64) * n_sales + self.row_sales()
+        totals = np.bincount(keys, weights=self.income, minlength=len(self.dates) * n_sales)
+        return totals.reshape(len(self.dates), n_sales)
+
+    def client_daily(self):
+        """Dense ``(dates, clients)`` income matrix."""
+        n_clients = len(self.clients)
+        keys = self.row_dates().astype(np.int64) * n_clients + self.client_idx
+        totals = np.bincount(keys, weights=self.income, minlength=len(self.dates) * n_clients)
+        return totals.reshape(len(self.dates), n_clients)
+
+    def sales_members(self):
+        """Per sales person ID, the sets of client and fund names with income rows."""
+        clients = [set() for _ in self.sales]
+        funds = [set() for _ in self.sales]
+        row_sales = self.row_sales().astype(np.int64)
+        for members, index, ids in ((clients, self.clients, self.client_idx), (funds, self.funds, self.fund_idx)):
+            pairs = np.unique(row_sales * len(index) + ids)
+            for sales_id, member_id in zip(*(part.tolist() for part in np.divmod(pairs, len(index)))):
+                members[sales_id].add(index[member_id])
+        return clients, funds
+
+    def fund_client_totals(self, start_date=None, end_date=None):
+        """Total income per (fund, client) pair, as three parallel arrays."""
+        rows = self._rows(start_date, end_date)
+        n_clients = max(len(self.clients), 1)
+        keys = self.fund_idx[rows].astype(np.int64) * n_clients + self.client_idx[rows]
+        pairs, inverse = np.unique(keys, return_inverse=True)
+        totals = np.bincount(inverse, weights=self.income[rows], minlength=len(pairs))
+        return (pairs // n_clients).astype(np.int32), (pairs % n_clients).astype(np.int32), totals
+
+    def sales_fund_totals(self, start_date=None, end_date=None):
+        """Total income per (sales person, fund) pair, as three parallel arrays."""
+        rows = self._rows(start_date, end_date)
+        n_funds = max(len(self.funds), 1)
+        keys = self.row_sales()[rows].astype(np.int64) * n_funds + self.fund_idx[rows]
+        pairs, inverse = np.unique(keys, return_inverse=True)
+        totals = np.bincount(inverse, weights=self.income[rows], minlength=len(pairs))
+        return (pairs // n_funds).astype(np.int32), (pairs % n_funds).astype(np.int32), totals
+
+    def named(self, values, index):
+        """Map a per-ID array back to ``{name: value}``."""
+        return {name: float(value) for name, value in zip(index.names, values)}
+
+    # 明细视图
+    def day_breakdown(self, date):
+        """``{client: {fund: income}}`` for one date (the old ``client_breakdowns[date]``)."""
+        breakdown = {}
+        i = self.date_ids.get(date)
+        if i is None:
+            return breakdown
+        lo, hi = self.date_ptr[i], self.date_ptr[i + 1]
+        for client_id, fund_id, value in zip(self.client_idx[lo:hi].tolist(),
+                                             self.fund_idx[lo:hi].tolist(),
+                                             self.income[lo:hi].tolist()):
+            breakdown.setdefault(self.clients[client_id], {})[self.funds[fund_id]] = value
+        return breakdown
+
+    def sales_breakdown(self, date):
+        """``{sales: {'clients': {...}, 'funds': {...}}}`` for one date."""
+        breakdown = {name: {"clients": {}, "funds": {}} for name in self.sales}
+        i = self.date_ids.get(date)
+        if i is None:
+            return breakdown
+        lo, hi = self.date_ptr[i], self.date_ptr[i + 1]
+        sales_idx = self.client_sales_idx
+        for client_id, fund_id, value in zip(self.client_idx[lo:hi].tolist(),
+                                             self.fund_idx[lo:hi].tolist(),
+                                             self.income[lo:hi].tolist()):
+            entry = breakdown[self.sales[sales_idx[client_id]]]
+            client = self.clients[client_id]
+            fund = self.funds[fund_id]
+            entry["clients"][client] = entry["clients"].get(client, 0) + value
+            entry["funds"][fund] = entry["funds"].get(fund, 0) + value
+        return breakdown
+
+    def nested(self, start_date=None, end_date=None):
+        """Legacy ``{date: {client: {fund: income}}}`` view, zero rows omitted."""
+        lo, hi = self._date_bounds(start_date, end_date)
+        return {self.dates[i]: self.day_breakdown(self.dates[i]) for i in range(lo, hi)}
+
+
+def funds_client_breakdown(store, top=10, start_date=None, end_date=None):
+    """Per-fund totals with the top clients of each fund, sorted by income."""
+    fund_totals = store.fund_totals(start_date, end_date)
+    fund_ids, client_ids, totals = store.fund_client_totals(start_date, end_date)
+    per_fund = {}
+    for fund_id, client_id, total in zip(fund_ids.tolist(), client_ids.tolist(), totals.tolist()):
+        per_fund.setdefault(fund_id, []).append((store.clients[client_id], total))
+
+    result = []
+    for fund_id, fund in enumerate(store.funds):
+        client_breakdown = heapq.nlargest(top, per_fund.get(fund_id, []), key=lambda x: x[1])
+        result.append({
+            "fund": fund,
+            "totalIncome": float(fund_totals[fund_id]),
+            "clientBreakdown": [{"client": client, "income": income} for client, income in client_breakdown]
+        })
+
+    result.sort(key=lambda x: x['totalIncome'], reverse=True)
+    return result
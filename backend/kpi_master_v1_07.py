@@ -9,13 +9,16 @@ Original file is located at
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import datetime
 import csv
+import os
+import heapq
 import re
 import openpyxl
 from openpyxl.styles import Font, Alignment, PatternFill
 from openpyxl.utils import get_column_letter
+from charts import save_chart, draw_cumulative_income, draw_income_composition, draw_forecasts
+from validation import validate_trades
 from statsmodels.tsa.seasonal import seasonal_decompose
 from statsmodels.tsa.statespace.sarimax import SARIMAX
 from datetime import timedelta
@@ -61,26 +64,28 @@ def load_initial_holdings(filename, target_date='20231231'):
     return holdings
 
 # 加载交易记录
-def load_trades(filename):
+def add_trades(trades, validated):
+    """Add one chunk of ``validate_trades`` rows to ``{client: {fund: {date: money}}}``."""
+    totals = validated.groupby(['CLIENT_NAME', 'FUND_NAME', 'date'], sort=False)['money'].sum()
+    for (client_name, fund_name, date), money_changed in totals.items():
+        fund_trades = trades.setdefault(client_name, {}).setdefault(fund_name, {})
+        fund_trades[date] = fund_trades.get(date, 0) + money_changed
+    return trades
+
+
+def load_trades(filename, known_funds=None, known_clients=None, quarantine_path=None, report_path=None,
+                validated=None):
+    """Trades as ``{client: {fund: {date: money}}}``; same-day trades of a position are summed.
+
+    Rows are checked by ``validate_trades`` (see validation.py); rejected rows
+    go to ``quarantine_path`` and one summary is printed instead of per-row errors.
+    ``validated`` takes the chunks of an earlier ``validate_trades`` call instead.
+    """
+    if validated is None:
+        validated = validate_trades(filename, known_funds, known_clients, quarantine_path, report_path)
     trades = {}
-    with open(filename, 'r', encoding='utf-8') as file:
-        csv_reader = csv.DictReader(file)
-        for row in csv_reader:
-            try:
-                date = datetime.datetime.strptime(row['CONFIRMED_DATE'], '%Y%m%d').date()
-                client_name = row['CLIENT_NAME']
-                fund_name = row['FUND_NAME']
-                money_changed = clean_money_string(row['MONEY_CHANGED'])
-
-                if client_name not in trades:
-                    trades[client_name] = {}
-                if fund_name not in trades[client_name]:
-                    trades[client_name][fund_name] = {}
-                trades[client_name][fund_name][date] = money_changed
-            except ValueError as e:
-                print(f"Error processing row: {row}")
-                print(f"Error message: {str(e)}")
-                continue  # Skip this row and continue with the next
+    for chunk in validated:
+        add_trades(trades, chunk)
 
     print(f"Loaded trades for {len(trades)} clients.")
     return trades
@@ -196,6 +201,8 @@ def calculate_daily_income(daily_holdings, product_info, client_sales):
         for fund_holdings in client_funds.values():
             all_dates.update(fund_holdings.keys())
     dates = sorted(list(all_dates))
+    missing_funds = set()
+    missing_holdings = 0
 
     for date in dates:
         daily_income[date] = {}
@@ -210,9 +217,9 @@ def calculate_daily_income(daily_holdings, product_info, client_sales):
                         fund_income = holdings[date] * product_info[fund]
                         client_daily_income[fund] = fund_income
                     else:
-                        print(f"Warning: No product info for fund {fund}")
+                        missing_funds.add(fund)
                 else:
-                    print(f"Warning: No holding data for {client} - {fund} on {date}")
+                    missing_holdings += 1
 
             daily_income[date][client] = client_daily_income
             client_income[date][client] = sum(client_daily_income.values())
@@ -224,6 +231,12 @@ def calculate_daily_income(daily_holdings, product_info, client_sales):
 
         print(f"Processed income for date: {date}")
 
+    # One warning per kind instead of one per cell
+    if missing_funds:
+        print(f"Warning: No product info for {len(missing_funds)} funds: {', '.join(sorted(missing_funds))}")
+    if missing_holdings:
+        print(f"Warning: No holding data for {missing_holdings} client-fund-date cells")
+
     return daily_income, sales_income, client_income
 
 def calculate_cumulative_income(daily_income):
@@ -610,53 +623,22 @@ def search_by_sales_person(sales_person, data, client_sales, start_date=None, en
     return result
 
 def plot_cumulative_income(data, title, filename):
-    df = pd.DataFrame(data).T
-    df = df.cumsum()
-
-    plt.figure(figsize=(12, 6))
-    for column in df.columns:
-        plt.plot(df.index, df[column], label=column)
-
-    plt.title(title)
-    plt.xlabel('Date')
-    plt.ylabel('Cumulative Income')
-    plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-    plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
+    df = pd.DataFrame(data).T.sort_index()
+    save_chart(filename, draw_cumulative_income, list(df.index),
+               {column: df[column].fillna(0).to_numpy() for column in df.columns}, title)
 
 def plot_income_composition(data, title, filename):
-    df = pd.DataFrame(data)
-    df_percentage = df.div(df.sum(axis=1), axis=0) * 100
-
-    plt.figure(figsize=(12, 6))
-    df_percentage.plot(kind='area', stacked=True)
-
-    plt.title(title)
-    plt.xlabel('Date')
-    plt.ylabel('Percentage of Total Income')
-    plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-    plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
+    df = pd.DataFrame(data).sort_index()
+    save_chart(filename, draw_income_composition, list(df.index),
+               {column: df[column].fillna(0).to_numpy() for column in df.columns}, title)
 
 def plot_forecasts(actual_data, forecasts, title, filename):
-    actual_df = pd.Series(actual_data).cumsum()
-    simple_forecast = pd.Series(forecasts['simple']['cumulative'])
-    complex_forecast = pd.Series(forecasts['complex']['cumulative'])
-
-    plt.figure(figsize=(12, 6))
-    plt.plot(actual_df.index, actual_df, label='Actual')
-    plt.plot(simple_forecast.index, simple_forecast, label='Simple Forecast')
-    plt.plot(complex_forecast.index, complex_forecast, label='Complex Forecast')
-
-    plt.title(title)
-    plt.xlabel('Date')
-    plt.ylabel('Cumulative Income')
-    plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-    plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
+    actual_df = pd.Series(actual_data).sort_index().cumsum()
+    lines = {}
+    for model in ('simple', 'complex'):
+        forecast = pd.Series(forecasts[model]['cumulative']).sort_index()
+        lines[f"{model.title()} Forecast"] = (list(forecast.index), forecast.to_numpy())
+    save_chart(filename, draw_forecasts, list(actual_df.index), actual_df.to_numpy(), lines, title)
 
 # Funds Tab Backend
 def calculate_fund_income(daily_income):
@@ -687,7 +669,7 @@ def calculate_all_funds_client_breakdown(daily_income):
 
     result = []
     for fund, total_income in fund_income.items():
-        client_breakdown = sorted(fund_client_breakdown[fund].items(), key=lambda x: x[1], reverse=True)[:10]  # Top 10 clients per fund
+        client_breakdown = heapq.nlargest(10, fund_client_breakdown[fund].items(), key=lambda x: x[1])  # Top 10 clients per fund
         result.append({
             "fund": fund,
             "totalIncome": total_income,
@@ -705,20 +687,34 @@ def main():
     print("Loading initial holdings...")
     initial_holdings = load_initial_holdings('data/2023DEC.csv')
 
-    print("\nLoading trades...")
-    trades = load_trades('data/TRADES_LOG.csv')
-
     print("\nLoading product info...")
     product_info = load_product_info('data/PRODUCT_INFO.csv')
 
     print("\nLoading client sales info...")
     client_sales = load_client_sales('data/CLIENT_LIST.csv')
 
-    print("\nCalculating daily holdings...")
-    daily_holdings = calculate_daily_holdings(initial_holdings, trades, start_date, end_date)
+    print("\nLoading trades...")
+    trades = load_trades('data/TRADES_LOG.csv', known_funds=product_info, known_clients=client_sales,
+                         quarantine_path='data/validation/TRADES_LOG.quarantine.csv',
+                         report_path='data/validation/trades_report.json')
+
+    workers = int(os.environ.get('KPI_PIPELINE_WORKERS', '1'))
+    if workers > 1:
+        # Holdings, income and sales breakdowns per client shard, merged
+        from sharded_pipeline import run_sharded_pipeline
+        print(f"\nCalculating holdings, income and breakdowns on {workers} workers...")
+        result = run_sharded_pipeline(initial_holdings, trades, product_info, client_sales,
+                                      start_date, end_date, workers=workers)
+        daily_holdings = result['daily_holdings']
+        daily_income = result['daily_income']
+        sales_income = result['sales_income']
+        client_income = result['client_income']
+    else:
+        print("\nCalculating daily holdings...")
+        daily_holdings = calculate_daily_holdings(initial_holdings, trades, start_date, end_date)
 
-    print("\nCalculating daily income...")
-    daily_income, sales_income, client_income = calculate_daily_income(daily_holdings, product_info, client_sales)
+        print("\nCalculating daily income...")
+        daily_income, sales_income, client_income = calculate_daily_income(daily_holdings, product_info, client_sales)
 
     print("\nCalculating cumulative income...")
     cumulative_sales_income = calculate_cumulative_income(sales_income)
@@ -730,8 +726,11 @@ def main():
     print("\nGenerating forecasts...")
     forecasts = generate_forecasts(daily_income, product_info, daily_holdings, trades, end_date)
 
-    print("\nGenerating sales person breakdowns...")
-    sales_person_breakdowns = generate_sales_person_breakdowns(daily_income, client_sales)
+    if workers > 1:
+        sales_person_breakdowns = result['sales_person_breakdowns']
+    else:
+        print("\nGenerating sales person breakdowns...")
+        sales_person_breakdowns = generate_sales_person_breakdowns(daily_income, client_sales)
 
     print("\nGenerating client breakdowns...")
     client_breakdowns = generate_client_breakdowns(daily_income)
@@ -777,9 +776,9 @@ def get_top_clients_and_funds(daily_income, client_sales):
             for fund, income in funds.items():
                 sales_person_funds[sales_person][fund] = sales_person_funds[sales_person].get(fund, 0) + income
 
-    top_clients = {sp: sorted(clients.items(), key=lambda x: x[1], reverse=True)[:5] for sp, clients in
+    top_clients = {sp: heapq.nlargest(5, clients.items(), key=lambda x: x[1]) for sp, clients in
                    sales_person_clients.items()}
-    top_funds = {sp: sorted(funds.items(), key=lambda x: x[1], reverse=True)[:5] for sp, funds in
+    top_funds = {sp: heapq.nlargest(5, funds.items(), key=lambda x: x[1]) for sp, funds in
                  sales_person_funds.items()}
 
     return top_clients, top_funds
@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+"""KPI state bundle and hot reloading of the input data files.
+
+Everything the API serves is derived from the CSV files in the data
+directory. ``build_state`` runs the whole pipeline and returns an immutable
+``KPIState``. ``StateManager`` holds the current state, polls the input
+files for changes and rebuilds in the background (in a child interpreter by
+default, so request threads do not compete with the rebuild for the GIL).
+The finished state replaces the old one with a single reference assignment.
+Requests read ``state_manager.current`` once and keep a consistent view even
+if a swap happens mid-request.
+"""
+
+import datetime
+import logging
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from kpi_master_v1_07 import load_initial_holdings, add_trades, load_client_sales
+from fee_engine import load_fee_schedule, add_redemptions, DEFAULT_FEE_TYPE, FEE_SELECTORS, TOTAL_FEE_TYPE
+from holding_intervals import build_holding_intervals, income_store_from_intervals, income_store_chunks
+from province_rollup import load_province_index, build_province_rollup, read_client_list
+from checkpoints import ensure_checkpoints, holdings_as_of, replay_trades
+from forecast_service import ForecastService
+from leaderboards import Leaderboards
+from valuation import VALUATION_MODES, load_share_snapshot, share_trade_rows, report_share_trades, load_nav_history, \
+    build_nav_series, share_trades_by_position
+from sql_store import database_path, persist_state, SqlDatabase, SqlIncomeStore
+from changelog import Changelog, StateDigest, data_version
+from validation import VALIDATION_VERSION, validate_trades
+
+logger = logging.getLogger(__name__)
+
+DATA_FILES = {
+    'initial_holdings': '2023DEC.csv',
+    'trades': 'TRADES_LOG.csv',
+    'product_info': 'PRODUCT_INFO.csv',
+    'client_list': 'CLIENT_LIST.csv',
+    # Optional daily NAVs for the 'nav' valuation mode
+    'nav_history': 'NAV_HISTORY.csv',
+}
+
+# Date of the holdings snapshot in 2023DEC.csv
+SNAPSHOT_DATE = datetime.date(2023, 12, 31)
+CHECKPOINT_DIR = 'checkpoints'
+VALIDATION_DIR = 'validation'
+SQLITE_FILE = 'kpi_store.sqlite3'
+
+
+def data_paths(data_dir):
+    return {key: os.path.join(data_dir, filename) for key, filename in DATA_FILES.items()}
+
+
+def input_mtimes(data_dir):
+    """Modification time (ns) of every input file, None for missing files."""
+    mtimes = {}
+    for key, path in data_paths(data_dir).items():
+        try:
+            mtimes[key] = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtimes[key] = None
+    return mtimes
+
+
+class FeeView:
+    """Income store and derived payload data for one revenue line."""
+
+    __slots__ = ('fee_type', 'income_store', 'forecast_service', 'province_counts',
+                 'province_rollup', 'leaderboards', 'payloads')
+
+    def __init__(self, fee_type, income_store, forecast_service, province_counts, province_rollup, leaderboards):
+        self.fee_type = fee_type
+        self.income_store = income_store
+        self.forecast_service = forecast_service
+        self.province_counts = province_counts
+        self.province_rollup = province_rollup
+        self.leaderboards = leaderboards
+        # Full API payloads, filled on first request (see app.build_sales)
+        self.payloads = {}
+
+
+class FeeViews:
+    """Per-fee-type views of one state.
+
+    A served state has every view built up front (``build_served_state``),
+    so requests only read them; other callers build a view on first use.
+    """
+
+    def __init__(self, income_store, trades, fee_schedule, client_sales, province_index):
+        self.income_store = income_store
+        self.trades = trades
+        self.fee_schedule = fee_schedule
+        self.client_sales = client_sales
+        self.province_index = province_index
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def build_all(self):
+        for fee_type in FEE_SELECTORS:
+            self.get(fee_type)
+        return self
+
+    def get(self, fee_type):
+        view = self._views.get(fee_type)
+        if view is None:
+            with self._lock:
+                view = self._views.get(fee_type)
+                if view is None:
+                    view = self._build(fee_type)
+                    self._views[fee_type] = view
+        return view
+
+    def _build(self, fee_type):
+        line = None if fee_type == TOTAL_FEE_TYPE else fee_type
+        income_store = self.income_store.fee_line(line)
+        product_info = self.fee_schedule.product_info(line)
+        forecast_service = ForecastService.build(income_store, self.trades, product_info)
+        province_counts, province_rollup = build_province_rollup(self.province_index, income_store)
+        leaderboards = Leaderboards.build(income_store, self.client_sales)
+        return FeeView(fee_type, income_store, forecast_service, province_counts, province_rollup, leaderboards)
+
+
+class KPIState:
+    """Everything derived from one snapshot of the input files.
+
+    ``income_store``, ``forecast_service``, ``province_rollup`` and
+    ``leaderboards`` are those of the default revenue line; other lines are
+    served from ``fee_views``.
+    """
+
+    __slots__ = ('data_dir', 'start_date', 'end_date', 'valuation', 'trades', 'product_info', 'fee_schedule',
+                 'client_sales', 'holding_intervals', 'income_store', 'forecast_service',
+                 'province_counts', 'province_rollup', 'leaderboards', 'fee_views', 'changelog',
+                 'mtimes', 'built_at', 'build_seconds')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+
+def load_share_positions(paths, start_date, share_trades):
+    """Share holdings at ``start_date``, share trades and the NAV series for 'nav' valuation.
+
+    Share holdings are replayed straight from the snapshot; the month-end
+    checkpoints hold money values only. ``share_trades`` are the
+    ``share_trade_rows`` of the validated trade log.
+    """
+    if start_date < SNAPSHOT_DATE:
+        raise ValueError(f"No holdings snapshot on or before {start_date}")
+    snapshot, snapshot_navs = load_share_snapshot(paths['initial_holdings'],
+                                                  target_date=SNAPSHOT_DATE.strftime('%Y%m%d'))
+    nav_series = build_nav_series(snapshot_navs, share_trades, load_nav_history(paths['nav_history']))
+    trades = share_trades_by_position(share_trades, nav_series)
+    return replay_trades(snapshot, trades, SNAPSHOT_DATE, start_date), trades, nav_series
+
+
+def build_state(data_dir, start_date, end_date, storage=None, valuation=None):
+    """Run the full KPI pipeline over the files in ``data_dir``.
+
+    With ``storage='sqlite'`` (or ``KPI_STORAGE=sqlite``) the income rows are
+    persisted to an embedded database and served from it instead of memory.
+    Each build writes its own file next to ``KPI_SQLITE_PATH``; it is removed
+    when the state is dropped.
+    With ``valuation='nav'`` (or ``KPI_VALUATION=nav``) holdings are tracked
+    in shares and marked to the daily NAV instead of using fixed money values.
+    """
+    storage = storage or os.environ.get('KPI_STORAGE', 'memory')
+    valuation = valuation or os.environ.get('KPI_VALUATION', 'money')
+    started = time.perf_counter()
+    mtimes = input_mtimes(data_dir)
+    paths = data_paths(data_dir)
+
+    snapshot = load_initial_holdings(paths['initial_holdings'], target_date=SNAPSHOT_DATE.strftime('%Y%m%d'))
+    fee_schedule = load_fee_schedule(paths['product_info'])
+    product_info = fee_schedule.product_info(DEFAULT_FEE_TYPE)
+    client_sales = load_client_sales(paths['client_list'])
+    if valuation not in VALUATION_MODES:
+        raise ValueError(f"valuation must be one of {', '.join(VALUATION_MODES)}")
+    # One streaming pass over the trade log feeds every trade total. Rejected
+    # rows and the validation summary are kept next to the data.
+    validation_dir = os.path.join(data_dir, VALIDATION_DIR)
+    trades, redemptions, share_trades, bad_shares = {}, {}, [], 0
+    for chunk in validate_trades(paths['trades'], known_funds=fee_schedule.funds, known_clients=client_sales,
+                                 quarantine_path=os.path.join(validation_dir, 'TRADES_LOG.quarantine.csv'),
+                                 report_path=os.path.join(validation_dir, 'trades_report.json')):
+        add_trades(trades, chunk)
+        add_redemptions(redemptions, chunk)
+        if valuation == 'nav':
+            chunk_rows, unparseable = share_trade_rows(chunk)
+            share_trades.extend(chunk_rows)
+            bad_shares += unparseable
+    print(f"Loaded trades for {len(trades)} clients.")
+
+    # Month-end checkpoints let any window start from the nearest snapshot
+    # instead of replaying every trade since SNAPSHOT_DATE.
+    checkpoint_dir = os.path.join(data_dir, CHECKPOINT_DIR)
+    sources = {key: mtimes[key] for key in ('initial_holdings', 'trades')}
+    sources['validation'] = VALIDATION_VERSION
+    checkpoint_set = ensure_checkpoints(checkpoint_dir, snapshot, SNAPSHOT_DATE, trades, sources)
+    if start_date == SNAPSHOT_DATE:
+        initial_holdings = snapshot
+    else:
+        initial_holdings = holdings_as_of(start_date, checkpoint_set, snapshot, SNAPSHOT_DATE, trades)
+
+    # Holdings are kept as intervals between trade dates and income lives in a
+    # single sparse store; per-client, per-fund and per-sales breakdowns are
+    # derived from it on demand rather than kept as nested dicts. The store
+    # carries every fee type; each revenue line is a filtered view of it.
+    nav_series = None
+    if valuation == 'nav':
+        report_share_trades(share_trades, bad_shares)
+        initial_holdings, trade_positions, nav_series = load_share_positions(paths, start_date, share_trades)
+    else:
+        trade_positions = trades
+    holding_intervals = build_holding_intervals(initial_holdings, trade_positions, start_date, end_date)
+    province_index = load_province_index(paths['client_list'])
+    version = data_version(mtimes)
+
+    if storage == 'sqlite':
+        # Stream the income rows to this build's own database a month at a
+        # time, so the full in-memory store is never materialized.
+        sqlite_path = database_path(os.environ.get('KPI_SQLITE_PATH', os.path.join(data_dir, SQLITE_FILE)), version)
+        digests = []
+
+        def chunks():
+            for chunk in income_store_chunks(holding_intervals, fee_schedule, client_sales, nav_series, redemptions):
+                digests.append(StateDigest(chunk))
+                yield chunk
+
+        persist_state(sqlite_path, chunks(), holding_intervals, fee_schedule, read_client_list(paths['client_list']))
+        income_store = SqlIncomeStore(SqlDatabase(sqlite_path))
+        digest = StateDigest.concat(digests)
+    else:
+        income_store = income_store_from_intervals(holding_intervals, fee_schedule, client_sales, nav_series,
+                                                   redemptions=redemptions)
+        digest = StateDigest(income_store)
+    changelog = Changelog(version, digest)
+
+    fee_views = FeeViews(income_store, trades, fee_schedule, client_sales, province_index)
+    default_view = fee_views.get(DEFAULT_FEE_TYPE)
+
+    return KPIState(
+        data_dir=data_dir,
+        start_date=start_date,
+        end_date=end_date,
+        valuation=valuation,
+        trades=trades,
+        product_info=product_info,
+        fee_schedule=fee_schedule,
+        client_sales=client_sales,
+        holding_intervals=holding_intervals,
+        income_store=default_view.income_store,
+        forecast_service=default_view.forecast_service,
+        province_counts=default_view.province_counts,
+        province_rollup=default_view.province_rollup,
+        leaderboards=default_view.leaderboards,
+        fee_views=fee_views,
+        changelog=changelog,
+        mtimes=mtimes,
+        built_at=datetime.datetime.now(),
+        build_seconds=time.perf_counter() - started,
+    )
+
+
+def build_served_state(data_dir, start_date, end_date):
+    """``build_state`` with the views of every fee type built, ready to be swapped in."""
+    state = build_state(data_dir, start_date, end_date)
+    state.fee_views.build_all()
+    return state
+
+
+class StateManager:
+    """Holds the current ``KPIState`` and rebuilds it when inputs change."""
+
+    def __init__(self, data_dir, start_date, end_date, poll_interval=5.0, rebuild_mode='process'):
+        self.data_dir = data_dir
+        self.start_date = start_date
+        self.end_date = end_date
+        self.poll_interval = poll_interval
+        self.rebuild_mode = rebuild_mode
+        self.current = None
+
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self._pending_reason = None
+        self._watcher = None
+        self._stop = threading.Event()
+        self.status_info = {
+            'state': 'idle',
+            'rebuilds': 0,
+            'failures': 0,
+            'last_reason': None,
+            'last_started': None,
+            'last_finished': None,
+            'last_error': None,
+        }
+
+    def start(self, watch=True):
+        """Build the first state synchronously, then start watching the inputs."""
+        self.current = build_served_state(self.data_dir, self.start_date, self.end_date)
+        logger.info(f"Initial KPI state built in {self.current.build_seconds:.2f}s")
+        if watch and self.poll_interval > 0 and self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name='kpi-data-watcher', daemon=True)
+            self._watcher.start()
+        return self.current
+
+    def stop(self):
+        self._stop.set()
+
+    # 文件监控
+    def _watch(self):
+        # Start from the mtimes the current state was built from, so a file
+        # changed before this thread started is not missed.
+        seen = self.current.mtimes if self.current is not None else input_mtimes(self.data_dir)
+        while not self._stop.wait(self.poll_interval):
+            mtimes = input_mtimes(self.data_dir)
+            if mtimes == seen:
+                continue
+            # Wait for one quiet interval so a file that is still being
+            # written is not picked up half-way.
+            time.sleep(self.poll_interval)
+            settled = input_mtimes(self.data_dir)
+            if settled != mtimes:
+                continue
+            changed = sorted(key for key in settled if settled[key] != seen.get(key))
+            seen = settled
+            if self.current is not None and settled == self.current.mtimes:
+                continue
+            self.request_rebuild(f"changed: {', '.join(changed)}")
+
+    # 后台重建
+    def request_rebuild(self, reason='manual'):
+        """Start a background rebuild, or queue one if a rebuild is running."""
+        with self._lock:
+            if self._rebuilding:
+                self._pending_reason = reason
+                return False
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, args=(reason,), name='kpi-rebuild', daemon=True).start()
+        return True
+
+    def _build(self):
+        if self.rebuild_mode != 'process':
+            return build_served_state(self.data_dir, self.start_date, self.end_date)
+
+        # Run the pipeline in a fresh interpreter rather than a multiprocessing
+        # child, which would re-import the web app's main module.
+        fd, out_path = tempfile.mkstemp(suffix='.pkl', prefix='kpi_state_')
+        os.close(fd)
+        try:
+            subprocess.run(
+                [sys.executable, '-m', 'kpi_state', os.path.abspath(self.data_dir),
+                 self.start_date.isoformat(), self.end_date.isoformat(), out_path],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True,
+            )
+            with open(out_path, 'rb') as file:
+                state = pickle.load(file)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(e.stderr.decode('utf-8', 'replace').strip().splitlines()[-1])
+        finally:
+            os.remove(out_path)
+        state.data_dir = self.data_dir
+        return state
+
+    def _rebuild(self, reason):
+        while reason is not None:
+            self.status_info.update(state='rebuilding', last_reason=reason,
+                                    last_started=datetime.datetime.now().isoformat())
+            logger.info(f"Rebuilding KPI state ({reason})")
+            try:
+                new_state = self._build()
+                if self.current is not None:
+                    new_state.changelog = self.current.changelog.advance(new_state.changelog)
+                self.current = new_state
+                self.status_info['rebuilds'] += 1
+                self.status_info['last_error'] = None
+                logger.info(f"KPI state rebuilt in {new_state.build_seconds:.2f}s")
+            except Exception as e:
+                self.status_info['failures'] += 1
+                self.status_info['last_error'] = str(e)
+                logger.error(f"Error rebuilding KPI state: {str(e)}")
+                logger.error(traceback.format_exc())
+            self.status_info['last_finished'] = datetime.datetime.now().isoformat()
+
+            with self._lock:
+                reason, self._pending_reason = self._pending_reason, None
+                if reason is None:
+                    self._rebuilding = False
+                    self.status_info['state'] = 'idle'
+
+    def status(self):
+        current = self.current
+        status = dict(self.status_info)
+        status['pending'] = self._pending_reason is not None
+        if current is not None:
+            status['current'] = {
+                'version': current.changelog.version,
+                'built_at': current.built_at.isoformat(),
+                'build_seconds': current.build_seconds,
+                'start_date': current.start_date.isoformat(),
+                'end_date': current.end_date.isoformat(),
+                'income_rows': len(current.income_store),
+            }
+        return status
+
+
+if __name__ == '__main__':
+    # Used by StateManager for out-of-process rebuilds:
+    # python -m kpi_state DATA_DIR START_DATE END_DATE OUTPUT_PICKLE
+    # Import by module name so the pickle references kpi_state.KPIState.
+    import kpi_state
+    _data_dir, _start, _end, _output = sys.argv[1:5]
+    _state = kpi_state.build_served_state(_data_dir, datetime.date.fromisoformat(_start),
+                                          datetime.date.fromisoformat(_end))
+    with open(_output, 'wb') as _file:
+        pickle.dump(_state, _file, protocol=pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Period leaderboards for clients, funds and sales persons.
+
+For each period (day, week-, month- and year-to-date, whole window) the
+income store is reduced once to per-entity totals, and only the top
+``LEADERBOARD_DEPTH`` entries of every list are kept. Selection uses bounded
+heaps, so a fund with thousands of clients costs O(n log k), not a full
+sort. Requests for any ``k`` up to the depth just slice the kept lists.
+"""
+
+import datetime
+import heapq
+
+LEADERBOARD_PERIODS = ('day', 'week', 'month', 'ytd', 'all')
+LEADERBOARD_DEPTH = 100
+
+
+def period_bounds(period, first_date, last_date):
+    """``(start_date, end_date)`` of a to-date period ending on ``last_date``."""
+    if period == 'day':
+        start = last_date
+    elif period == 'week':
+        start = last_date - datetime.timedelta(days=last_date.weekday())
+    elif period == 'month':
+        start = last_date.replace(day=1)
+    elif period == 'ytd':
+        start = last_date.replace(month=1, day=1)
+    elif period == 'all':
+        start = first_date
+    else:
+        raise ValueError(f"Unknown period: {period}")
+    return max(start, first_date), last_date
+
+
+def top_k(names, values, k):
+    """Top ``k`` ``(name, value)`` pairs by value, via heap selection."""
+    best = heapq.nlargest(k, range(len(values)), key=values.__getitem__)
+    return [(names[i], float(values[i])) for i in best]
+
+
+def grouped_top_k(group_ids, item_ids, values, k):
+    """Top ``k`` items per group from parallel arrays, keeping a min-heap per group."""
+    heaps = {}
+    for group, item, value in zip(group_ids, item_ids, values):
+        heap = heaps.get(group)
+        if heap is None:
+            heaps[group] = [(value, item)]
+        elif len(heap) < k:
+            heapq.heappush(heap, (value, item))
+        elif value > heap[0][0]:
+            heapq.heapreplace(heap, (value, item))
+    return {group: sorted(heap, reverse=True) for group, heap in heaps.items()}
+
+
+def _entries(pairs):
+    return [{'name': name, 'income': income} for name, income in pairs]
+
+
+class Leaderboards:
+    """Top-``LEADERBOARD_DEPTH`` lists per period for one KPI state."""
+
+    def __init__(self, as_of, periods):
+        self.as_of = as_of
+        self.periods = periods
+
+    @classmethod
+    def build(cls, income_store, client_sales, depth=LEADERBOARD_DEPTH):
+        clients, funds, sales = income_store.clients, income_store.funds, income_store.sales
+        client_sales_ids = [sales.get(client_sales.get(client, "Unknown")) for client in clients]
+        periods = {}
+        for period in LEADERBOARD_PERIODS:
+            start, end = period_bounds(period, income_store.dates[0], income_store.last_date)
+            client_totals = income_store.client_totals(start, end)
+            fund_ids, fund_client_ids, fund_client_totals = income_store.fund_client_totals(start, end)
+            sales_ids, sales_fund_ids, sales_fund_totals = income_store.sales_fund_totals(start, end)
+
+            clients_by_fund = grouped_top_k(fund_ids.tolist(), fund_client_ids.tolist(),
+                                            fund_client_totals.tolist(), depth)
+            funds_by_sales = grouped_top_k(sales_ids.tolist(), sales_fund_ids.tolist(),
+                                           sales_fund_totals.tolist(), depth)
+            clients_by_sales = grouped_top_k(client_sales_ids, range(len(clients)),
+                                             client_totals.tolist(), depth)
+
+            periods[period] = {
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                'salesPersons': top_k(sales.names, income_store.sales_totals(start, end), depth),
+                'clients': top_k(clients.names, client_totals, depth),
+                'funds': top_k(funds.names, income_store.fund_totals(start, end), depth),
+                'clientsByFund': {funds[g]: [(clients[i], v) for v, i in top]
+                                  for g, top in clients_by_fund.items()},
+                'fundsBySalesPerson': {sales[g]: [(funds[i], v) for v, i in top]
+                                       for g, top in funds_by_sales.items()},
+                'clientsBySalesPerson': {sales[g]: [(clients[i], v) for v, i in top]
+                                         for g, top in clients_by_sales.items()},
+            }
+        return cls(income_store.last_date, periods)
+
+    def top(self, period, key, k, group=None):
+        """Top ``k`` ``(name, income)`` pairs of one list, optionally within a group."""
+        board = self.periods[period][key]
+        if group is not None:
+            board = board.get(group, [])
+        return board[:k]
+
+    def view(self, periods, k):
+        result = {'asOf': self.as_of.isoformat(), 'k': k, 'periods': {}}
+        for period in periods:
+            board = self.periods[period]
+            result['periods'][period] = {
+                'start': board['start'],
+                'end': board['end'],
+                'salesPersons': _entries(board['salesPersons'][:k]),
+                'clients': _entries(board['clients'][:k]),
+                'funds': _entries(board['funds'][:k]),
+                'clientsByFund': {name: _entries(top[:k]) for name, top in board['clientsByFund'].items()},
+                'fundsBySalesPerson': {name: _entries(top[:k]) for name, top in board['fundsBySalesPerson'].items()},
+                'clientsBySalesPerson': {name: _entries(top[:k]) for name, top in board['clientsBySalesPerson'].items()},
+            }
+        return result
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""Local HTTP load test for the API under gunicorn.
+
+Starts ``gunicorn app:app`` (or the ASGI app with ``--worker-class
+uvicorn.workers.UvicornWorker --app asgi:app``) with N workers against a
+data directory, drives a weighted mix of endpoints from C concurrent
+clients for a fixed duration, and reports requests/sec, p50/p95/p99
+latency per endpoint and the RSS of every gunicorn worker. ``--scale K``
+first writes a synthetic dataset with K copies of every client (holdings,
+trades and CLIENT_LIST rows) next to the sample data. Results are printed
+and, with ``--output``, written as JSON so runs can be compared:
+
+    python loadtest.py --workers 4 --concurrency 16 --duration 30 --output base.json
+    python loadtest.py --scale 10 --mix dashboard=4,sales=1,funds=1 --output scaled.json
+"""
+
+import argparse
+import csv
+import datetime
+import http.client
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+ENDPOINTS = {
+    'dashboard': '/api/dashboard',
+    'sales': '/api/sales',
+    'clients': '/api/clients',
+    'funds': '/api/funds',
+    'forecast': '/api/forecast',
+    'province_counts': '/api/province_counts',
+}
+PERCENTILES = (50, 95, 99)
+SCALED_FILES = {
+    '2023DEC.csv': 'CLIENT_NAME',
+    'TRADES_LOG.csv': 'CLIENT_NAME',
+    'CLIENT_LIST.csv': 'CLIENT_NAME',
+}
+
+
+# 合成数据
+def make_scaled_dataset(source_dir, scale, target_dir=None):
+    """Copy ``source_dir`` with every client repeated ``scale`` times under new names."""
+    target_dir = target_dir or os.path.join(source_dir, f'scaled_x{scale}')
+    os.makedirs(target_dir, exist_ok=True)
+    for name in os.listdir(source_dir):
+        path = os.path.join(source_dir, name)
+        if not os.path.isfile(path):
+            continue
+        if name not in SCALED_FILES:
+            shutil.copyfile(path, os.path.join(target_dir, name))
+            continue
+        with open(path, 'r', encoding='utf-8', newline='') as file:
+            reader = csv.reader(file)
+            header = next(reader)
+            rows = list(reader)
+        # Match on the column name without a BOM, but write the header back unchanged
+        column = [h.lstrip('\ufeff') for h in header].index(SCALED_FILES[name])
+        with open(os.path.join(target_dir, name), 'w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            for copy in range(scale):
+                for row in rows:
+                    if copy:
+                        row = list(row)
+                        row[column] = f"{row[column]}#{copy}"
+                    writer.writerow(row)
+    print(f"Wrote synthetic dataset with {scale}x clients to {target_dir}.")
+    return target_dir
+
+
+def parse_mix(value):
+    """``'dashboard=3,sales=1'`` -> ``[('dashboard', 3.0), ('sales', 1.0)]``."""
+    if not value:
+        return [(name, 1.0) for name in ENDPOINTS]
+    mix = []
+    for part in value.split(','):
+        name, _, weight = part.rpartition('=')
+        query = name.partition('?')[2]
+        try:
+            if query and '=' not in query.split('&')[-1]:
+                # 'forecast?horizon=30': the last '=' belongs to the query string
+                raise ValueError(weight)
+            weight = float(weight)
+        except ValueError:
+            name, weight = part, 1.0
+        if weight < 0:
+            raise ValueError(f"Negative weight in mix: {part}")
+        if name.split('?')[0] not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint in mix: {name}")
+        mix.append((name, weight))
+    return mix
+
+
+def endpoint_path(name):
+    endpoint, _, query = name.partition('?')
+    return ENDPOINTS[endpoint] + (f'?{query}' if query else '')
+
+
+# 服务进程
+def start_server(args, data_dir):
+    env = dict(os.environ, KPI_DATA_DIR=data_dir, KPI_WATCH_INTERVAL='0')
+    command = [sys.executable, '-m', 'gunicorn', args.app,
+               '--workers', str(args.workers),
+               '--bind', f'127.0.0.1:{args.port}',
+               '--timeout', str(args.timeout),
+               '--log-level', 'warning']
+    if args.worker_class:
+        command += ['--worker-class', args.worker_class]
+    if args.threads:
+        command += ['--threads', str(args.threads)]
+    return subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdout=subprocess.DEVNULL)
+
+
+def wait_until_ready(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', ENDPOINTS['province_counts'])
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def worker_rss(master_pid):
+    """``{pid: rss_kb}`` of the gunicorn workers, read from /proc (Linux only)."""
+    rss = {}
+    try:
+        pids = [int(p) for p in os.listdir('/proc') if p.isdigit()]
+    except FileNotFoundError:
+        return rss
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as file:
+                status = dict(line.split(':', 1) for line in file if ':' in line)
+        except OSError:
+            continue
+        if int(status.get('PPid', '0').strip()) == master_pid:
+            rss[pid] = int(status.get('VmRSS', '0 kB').split()[0])
+    return rss
+
+
+# 压测
+def client_loop(port, mix, deadline, results, lock, seed):
+    rng = random.Random(seed)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    local = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    conn = None
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+            conn.request('GET', endpoint_path(name))
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors[name] += 1
+            else:
+                local[name].append(time.perf_counter() - started)
+            if response.getheader('Connection', '').lower() == 'close':
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            errors[name] += 1
+            if conn is not None:
+                conn.close()
+            conn = None
+    with lock:
+        for name in names:
+            results['latencies'][name].extend(local[name])
+            results['errors'][name] += errors[name]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = np.asarray(latencies)
+    summary = {
+        'requests': int(len(latencies)),
+        'errors': int(errors),
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+    }
+    if len(latencies):
+        summary['meanMs'] = float(latencies.mean() * 1000)
+        for p, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+            summary[f'p{p}Ms'] = float(value * 1000)
+    return summary
+
+
+def run_load(port, mix, concurrency, duration):
+    results = {'latencies': {name: [] for name, _ in mix}, 'errors': {name: 0 for name, _ in mix}}
+    lock = threading.Lock()
+    started = time.monotonic()
+    deadline = started + duration
+    threads = [threading.Thread(target=client_loop, args=(port, mix, deadline, results, lock, i), daemon=True)
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    endpoints = {name: summarize(results['latencies'][name], results['errors'][name], elapsed)
+                 for name, _ in mix}
+    all_latencies = [value for values in results['latencies'].values() for value in values]
+    overall = summarize(all_latencies, sum(results['errors'].values()), elapsed)
+    return elapsed, endpoints, overall
+
+
+def print_report(report):
+    print(f"\n{'endpoint':<28}{'req':>8}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = list(report['endpoints'].items()) + [('TOTAL', report['overall'])]
+    for name, s in rows:
+        print(f"{name:<28}{s['requests']:>8}{s['errors']:>6}{s['rps']:>9.1f}"
+              f"{s.get('p50Ms', 0):>10.1f}{s.get('p95Ms', 0):>10.1f}{s.get('p99Ms', 0):>10.1f}")
+    rss = report['workerRssKb']
+    print(f"\nWorker RSS (MB): {', '.join(f'{kb / 1024:.0f}' for kb in rss.values()) or 'n/a'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the KPI API under gunicorn.")
+    parser.add_argument('--app', default='app:app')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--worker-class', default=None)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--timeout', type=int, default=120, help="gunicorn worker timeout (s)")
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--scale', type=int, default=1, help="Repeat every client this many times")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20.0, help="Seconds of load after warm-up")
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--mix', default=None, help="Weighted endpoints, e.g. dashboard=4,sales=1,forecast?model=complex=1")
+    parser.add_argument('--startup-timeout', type=float, default=300.0)
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    data_dir = os.path.abspath(args.data_dir)
+    if args.scale > 1:
+        data_dir = make_scaled_dataset(data_dir, args.scale)
+
+    server = start_server(args, data_dir)
+    try:
+        startup_started = time.monotonic()
+        if not wait_until_ready(args.port, args.startup_timeout):
+            raise SystemExit("Server did not become ready")
+        startup_seconds = time.monotonic() - startup_started
+        print(f"Server ready after {startup_seconds:.1f}s; warming up for {args.warmup:.0f}s...")
+        if args.warmup > 0:
+            run_load(args.port, mix, args.concurrency, args.warmup)
+        print(f"Running {args.concurrency} clients for {args.duration:.0f}s...")
+        elapsed, endpoints, overall = run_load(args.port, mix, args.concurrency, args.duration)
+        rss = worker_rss(server.pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    report = {
+        'startedAt': datetime.datetime.now().isoformat(),
+        'config': {
+            'app': args.app,
+            'workers': args.workers,
+            'workerClass': args.worker_class or 'sync',
+            'threads': args.threads,
+            'concurrency': args.concurrency,
+            'durationSeconds': args.duration,
+            'scale': args.scale,
+            'dataDir': data_dir,
+            'mix': dict(mix),
+        },
+        'startupSeconds': startup_seconds,
+        'elapsedSeconds': elapsed,
+        'endpoints': endpoints,
+        'overall': overall,
+        'workerRssKb': {str(pid): kb for pid, kb in rss.items()},
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
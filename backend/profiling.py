@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Opt-in statistical profiling of API requests and the startup pipeline.
+
+``SamplingProfiler`` samples the call stack of one thread from a background
+thread and aggregates the samples into folded stacks (``root;...;leaf
+count`` lines, the input format of flamegraph.pl and speedscope), which
+costs next to nothing for the profiled thread. With ``trace_memory``,
+tracemalloc also records allocations and the profile keeps the sites that
+allocated the most memory; this slows the process several-fold while it
+runs, and because tracemalloc is process-wide, overlapping profiles see each
+other's allocations. Finished profiles are kept in a bounded
+``ProfileStore``. Nothing is sampled or traced unless a profile is running.
+"""
+
+import collections
+import datetime
+import itertools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+DEFAULT_INTERVAL = 0.002
+TOP_ALLOCATIONS = 25
+
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+# Whether the profiler started tracemalloc; tracing started by the caller
+# (e.g. ``python -X tracemalloc``) is left running.
+_started_tracing = False
+
+
+def _start_tracing():
+    global _tracing_users, _started_tracing
+    with _tracing_lock:
+        if _tracing_users == 0:
+            _started_tracing = not tracemalloc.is_tracing()
+            if _started_tracing:
+                tracemalloc.start(1)
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    global _tracing_users, _started_tracing
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def folded_stack(frame):
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class SamplingProfiler:
+    """Samples one thread's stack every ``interval`` seconds while running."""
+
+    def __init__(self, name, thread_id=None, interval=DEFAULT_INTERVAL, trace_memory=True):
+        self.name = name
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.trace_memory = trace_memory
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.allocations = []
+        self._stop = threading.Event()
+        self._sampler = None
+        self._snapshot = None
+        self._started = None
+        self.duration = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[folded_stack(frame)] += 1
+                self.samples += 1
+
+    def start(self):
+        if self.trace_memory:
+            _start_tracing()
+            self._snapshot = tracemalloc.take_snapshot()
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name='kpi-profiler', daemon=True)
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        self.duration = time.perf_counter() - self._started
+        self._stop.set()
+        self._sampler.join()
+        if self.trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _stop_tracing()
+            stats = snapshot.compare_to(self._snapshot, 'lineno')
+            self._snapshot = None
+            self.allocations = [{
+                'site': str(stat.traceback[0]),
+                'count': stat.count_diff,
+                'bytes': stat.size_diff,
+            } for stat in stats[:TOP_ALLOCATIONS] if stat.size_diff > 0]
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def folded(self):
+        """Folded stacks, one ``stack count`` line per distinct stack."""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'durationSeconds': self.duration,
+            'intervalSeconds': self.interval,
+            'samples': self.samples,
+            'stacks': dict(self.stacks.most_common()),
+            'allocations': self.allocations,
+        }
+
+
+class ProfileStore:
+    """The most recent profiles, by increasing id."""
+
+    def __init__(self, capacity=50):
+        self._profiles = collections.OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.capacity = capacity
+
+    def add(self, profiler, **info):
+        profile = profiler.to_dict()
+        profile.update(info)
+        profile['folded'] = profiler.folded()
+        with self._lock:
+            profile['id'] = next(self._ids)
+            profile['capturedAt'] = datetime.datetime.now().isoformat()
+            self._profiles[profile['id']] = profile
+            while len(self._profiles) > self.capacity:
+                self._profiles.popitem(last=False)
+        return profile['id']
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def summaries(self):
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return [{key: value for key, value in profile.items() if key not in ('stacks', 'folded', 'allocations')}
+                for profile in reversed(profiles)]
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Province index and geographic income rollup for the map view.
+
+``CLIENT_LIST.csv`` is parsed once per file version (keyed by mtime) and the
+province names are normalised with vectorised string operations. The rollup
+joins that index with the income store so ``/api/province_counts`` and
+``/api/province_income`` never touch disk per request.
+
+The parsed index is cached in module memory, so it only saves work for
+builds in the same process: thread-mode rebuilds and repeated builds such as
+batch runs. Under the default ``KPI_REBUILD_MODE=process`` every rebuild runs
+in a fresh interpreter and parses the file again, which takes milliseconds.
+The index and the finished rollups are part of the pickled state
+(``FeeViews``), so requests never recompute them in either mode.
+"""
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def read_client_list(filename):
+    """Raw ``CLIENT_NAME``/``SALES``/``PROVINCE`` frame of every client."""
+    return pd.read_csv(filename, encoding='utf-8', usecols=['CLIENT_NAME', 'SALES', 'PROVINCE'])
+
+
+def _read_province_index(filename):
+    client_list = read_client_list(filename)
+    client_list = client_list[client_list['PROVINCE'] != '-'].copy()
+    # Strip the 省/市 suffixes
+    client_list['PROVINCE'] = client_list['PROVINCE'].astype(str).str.replace(r'[省市]', '', regex=True)
+    return client_list.reset_index(drop=True)
+
+
+def load_province_index(filename):
+    """``CLIENT_NAME``/``SALES``/``PROVINCE`` frame, re-read only when the file changes."""
+    mtime = os.stat(filename).st_mtime_ns
+    with _cache_lock:
+        cached = _cache.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    index = _read_province_index(filename)
+    with _cache_lock:
+        _cache[filename] = (mtime, index)
+    return index
+
+
+def build_province_rollup(province_index, income_store):
+    """Client count and latest-day / cumulative income per province.
+
+    Returns ``(counts, rollup)``: ``counts`` is the ``{province: clients}``
+    mapping served by ``/api/province_counts`` and ``rollup`` the list served
+    by ``/api/province_income``, sorted by cumulative income.
+    """
+    provinces = province_index['PROVINCE']
+    counts = {province: int(count) for province, count in provinces.value_counts(sort=False).items()}
+
+    cumulative = income_store.client_totals()
+    latest = income_store.client_totals(income_store.last_date, income_store.last_date)
+    client_ids = np.array([income_store.clients.get(name, -1) for name in province_index['CLIENT_NAME']])
+    known = client_ids >= 0
+    frame = pd.DataFrame({
+        'province': provinces,
+        'sales': province_index['SALES'],
+        'daily': np.where(known, latest[np.maximum(client_ids, 0)], 0.0),
+        'cumulative': np.where(known, cumulative[np.maximum(client_ids, 0)], 0.0),
+    })
+
+    totals = frame.groupby('province', sort=False)[['daily', 'cumulative']].sum()
+    sales_counts = frame.groupby(['province', 'sales'], sort=False).size()
+    rollup = []
+    for province, row in totals.iterrows():
+        rollup.append({
+            'province': province,
+            'clientCount': counts[province],
+            'dailyIncome': float(row['daily']),
+            'cumulativeIncome': float(row['cumulative']),
+            'sales': {sales: int(n) for sales, n in sales_counts[province].items()},
+        })
+    rollup.sort(key=lambda x: x['cumulativeIncome'], reverse=True)
+    return counts, rollup
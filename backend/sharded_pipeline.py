@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Client-sharded execution of the report pipeline.
+
+Clients are split into shards by a stable hash of their name, each shard
+carrying its own initial holdings and trades. A shard runs the legacy steps
+from ``calculate_daily_holdings`` through ``generate_sales_person_breakdowns``
+on its clients only, and returns plain nested dicts. Shard results combine
+with ``merge_rollups``, an associative and commutative reduction: per-client
+dicts are disjoint across shards and per-sales or per-fund totals are added.
+Shards can therefore run in a local process pool, or be computed on separate
+machines with ``--shard I/N`` and merged later with ``--merge``:
+
+    python sharded_pipeline.py --workers 8
+    python sharded_pipeline.py --shard 0/4 --output shard0.pkl
+    python sharded_pipeline.py --merge shard0.pkl shard1.pkl shard2.pkl shard3.pkl --output merged.pkl
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import os
+import pickle
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+
+from kpi_master_v1_07 import (load_initial_holdings, load_trades, load_product_info, load_client_sales,
+                              calculate_daily_holdings, calculate_daily_income,
+                              generate_sales_person_breakdowns)
+
+ROLLUPS = ('daily_holdings', 'daily_income', 'sales_income', 'client_income', 'sales_person_breakdowns')
+
+
+def shard_of(client, shards):
+    """Shard number of a client; stable across processes and machines."""
+    return zlib.crc32(client.encode('utf-8')) % shards
+
+
+def partition(initial_holdings, trades, shards):
+    """Split holdings and trades into ``shards`` ``(initial_holdings, trades)`` pairs by client."""
+    parts = [({}, {}) for _ in range(shards)]
+    for client, funds in initial_holdings.items():
+        parts[shard_of(client, shards)][0][client] = funds
+    for client, funds in trades.items():
+        parts[shard_of(client, shards)][1][client] = funds
+    return parts
+
+
+def run_shard(task):
+    """Run the pipeline for one shard; ``task`` is a plain, picklable dict."""
+    # The legacy steps print every trade and date; keep worker output quiet.
+    with contextlib.redirect_stdout(io.StringIO()):
+        daily_holdings = calculate_daily_holdings(task['initial_holdings'], task['trades'],
+                                                  task['start_date'], task['end_date'])
+        daily_income, sales_income, client_income = calculate_daily_income(
+            daily_holdings, task['product_info'], task['client_sales'])
+        sales_person_breakdowns = generate_sales_person_breakdowns(daily_income, task['client_sales'])
+    return {
+        'daily_holdings': daily_holdings,
+        'daily_income': daily_income,
+        'sales_income': sales_income,
+        'client_income': client_income,
+        'sales_person_breakdowns': sales_person_breakdowns,
+    }
+
+
+# 合并
+def merge_nested(target, source):
+    """Add ``source`` into ``target``: dicts merge recursively, leaf numbers are summed."""
+    for key, value in source.items():
+        if key not in target:
+            target[key] = value
+        elif isinstance(value, dict):
+            merge_nested(target[key], value)
+        else:
+            target[key] += value
+    return target
+
+
+def merge_rollups(a, b):
+    """Associative merge of two shard results into ``a``."""
+    for name in ROLLUPS:
+        merge_nested(a.setdefault(name, {}), b.get(name, {}))
+    return a
+
+
+def empty_rollups():
+    return {name: {} for name in ROLLUPS}
+
+
+def shard_tasks(initial_holdings, trades, product_info, client_sales, start_date, end_date, shards):
+    return [{
+        'shard': i,
+        'shards': shards,
+        'initial_holdings': part_holdings,
+        'trades': part_trades,
+        'product_info': product_info,
+        'client_sales': client_sales,
+        'start_date': start_date,
+        'end_date': end_date,
+    } for i, (part_holdings, part_trades) in enumerate(partition(initial_holdings, trades, shards))]
+
+
+def run_sharded_pipeline(initial_holdings, trades, product_info, client_sales, start_date, end_date,
+                         workers=None, shards=None):
+    """Run every shard in a process pool and merge the results.
+
+    Returns a dict with the ``ROLLUPS`` produced by the single-process pipeline.
+    """
+    workers = workers or os.cpu_count() or 1
+    shards = shards or workers
+    tasks = shard_tasks(initial_holdings, trades, product_info, client_sales, start_date, end_date, shards)
+    if workers == 1:
+        results = map(run_shard, tasks)
+        return reduce(merge_rollups, results, empty_rollups())
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return reduce(merge_rollups, executor.map(run_shard, tasks), empty_rollups())
+
+
+def load_inputs(data_dir):
+    return (load_initial_holdings(os.path.join(data_dir, '2023DEC.csv')),
+            load_trades(os.path.join(data_dir, 'TRADES_LOG.csv')),
+            load_product_info(os.path.join(data_dir, 'PRODUCT_INFO.csv')),
+            load_client_sales(os.path.join(data_dir, 'CLIENT_LIST.csv')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the KPI pipeline sharded by client.")
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--start-date', default='2023-12-31')
+    parser.add_argument('--end-date', default='2024-08-31')
+    parser.add_argument('--workers', type=int, default=None, help="Process pool size (default: CPU count)")
+    parser.add_argument('--shards', type=int, default=None, help="Number of shards (default: workers)")
+    parser.add_argument('--shard', help="Run only shard I of N, given as I/N")
+    parser.add_argument('--merge', nargs='+', help="Merge pickled shard results instead of computing")
+    parser.add_argument('--output', help="Write the (merged) result to this pickle file")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.merge:
+        results = []
+        for path in args.merge:
+            with open(path, 'rb') as file:
+                results.append(pickle.load(file))
+        result = reduce(merge_rollups, results, empty_rollups())
+    else:
+        start_date = datetime.date.fromisoformat(args.start_date)
+        end_date = datetime.date.fromisoformat(args.end_date)
+        inputs = load_inputs(args.data_dir)
+        if args.shard:
+            index, shards = (int(x) for x in args.shard.split('/'))
+            result = run_shard(shard_tasks(*inputs, start_date, end_date, shards)[index])
+        else:
+            result = run_sharded_pipeline(*inputs, start_date, end_date, args.workers, args.shards)
+
+    print(f"Pipeline finished in {time.perf_counter() - started:.2f}s: "
+          f"{len(result['daily_holdings'])} clients, {len(result['daily_income'])} dates.")
+    if args.output:
+        with open(args.output, 'wb') as file:
+            pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+        print(f"Result written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""Optional SQLite storage backend for holdings and income.
+
+``persist_state`` writes the long-format income rows (one column per fee
+type, with a ``income_<fee type>`` view per revenue line), the holding
+intervals, the CLIENT_LIST mapping and the fee schedule into one embedded
+database, indexed on date, client, fund and sales person. ``SqlIncomeStore``
+answers the same aggregate calls as ``IncomeStore`` with pushed-down
+``GROUP BY`` queries, so only the small dimension tables (dates, clients,
+funds, sales persons) are held in memory and the API can serve books larger
+than RAM. Enable it with ``KPI_STORAGE=sqlite``.
+"""
+
+import copy
+import datetime
+import itertools
+import os
+import sqlite3
+import threading
+import weakref
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from income_store import NameIndex
+
+_build_ids = itertools.count()
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE dates (id INTEGER PRIMARY KEY, date TEXT NOT NULL);
+CREATE TABLE sales (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE clients (id INTEGER PRIMARY KEY, name TEXT NOT NULL, sales_id INTEGER NOT NULL);
+CREATE TABLE funds (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE fee_rates (
+    fund_name TEXT NOT NULL,
+    effective_date TEXT NOT NULL,
+    fee_type TEXT NOT NULL,
+    rate REAL NOT NULL  -- daily, or per redeemed amount for trade fees
+);
+CREATE TABLE client_list (client_name TEXT NOT NULL, sales TEXT, province TEXT);
+CREATE TABLE income (
+    date_id INTEGER NOT NULL,
+    client_id INTEGER NOT NULL,
+    fund_id INTEGER NOT NULL,
+    sales_id INTEGER NOT NULL,
+    {fee_columns}
+);
+CREATE TABLE holdings (
+    client_name TEXT NOT NULL,
+    fund_name TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    amount REAL NOT NULL
+);
+"""
+
+INDEXES = """
+CREATE INDEX income_date ON income (date_id);
+CREATE INDEX income_client ON income (client_id, date_id);
+CREATE INDEX income_fund ON income (fund_id, date_id);
+CREATE INDEX income_sales ON income (sales_id, date_id);
+CREATE INDEX holdings_client ON holdings (client_name);
+CREATE INDEX holdings_fund ON holdings (fund_name);
+CREATE INDEX holdings_dates ON holdings (start_date, end_date);
+CREATE INDEX client_list_name ON client_list (client_name);
+CREATE INDEX client_list_sales ON client_list (sales);
+"""
+
+
+# 写入数据库
+def line_views(fee_types):
+    """One view per revenue line plus ``income_total``, each exposing an ``income`` column."""
+    views = []
+    for name, expr in [(fee_type, fee_type) for fee_type in fee_types] + [('total', ' + '.join(fee_types))]:
+        views.append(f"CREATE VIEW income_{name} AS SELECT date_id, client_id, fund_id, sales_id, "
+                     f"{expr} AS income FROM income WHERE {expr} != 0;")
+    return '\n'.join(views)
+
+
+def database_path(base_path, version):
+    """Path of one build's database: ``base_path`` with the data version and a unique build id.
+
+    Every build writes its own file, so a live ``SqlIncomeStore`` never sees
+    its file replaced by another worker or a rebuild.
+    """
+    root, ext = os.path.splitext(base_path)
+    return f"{root}.{version}.{os.getpid()}-{next(_build_ids)}{ext or '.sqlite3'}"
+
+
+def persist_state(path, income_stores, holding_intervals, fee_schedule, client_list=None):
+    """Write a fresh database to ``path`` and return the number of income rows.
+
+    ``income_stores`` are the multi-line stores of consecutive date windows
+    (see ``income_store_chunks``); they share their dimension indexes, so only
+    one window of income rows is in memory at a time. ``client_list`` is the
+    raw CLIENT_LIST frame.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    rows = 0
+    try:
+        date_offset = 0
+        for chunk, income_store in enumerate(income_stores):
+            fee_types = income_store.fee_types
+            if chunk == 0:
+                conn.executescript(SCHEMA.format(
+                    fee_columns=',\n    '.join(f"{t} REAL NOT NULL" for t in fee_types)))
+                conn.executescript(line_views(fee_types))
+                conn.executemany("INSERT INTO sales VALUES (?, ?)", enumerate(income_store.sales.names))
+                conn.executemany("INSERT INTO clients VALUES (?, ?, ?)",
+                                 ((i, name, int(income_store.client_sales_idx[i]))
+                                  for i, name in enumerate(income_store.clients.names)))
+                conn.executemany("INSERT INTO funds VALUES (?, ?)", enumerate(income_store.funds.names))
+            conn.executemany("INSERT INTO dates VALUES (?, ?)",
+                             ((date_offset + i, d.isoformat()) for i, d in enumerate(income_store.dates)))
+            conn.executemany(f"INSERT INTO income VALUES (?, ?, ?, ?{', ?' * len(fee_types)})", (
+                (date_offset + date_id, client_id, fund_id, sales_id, *fees)
+                for date_id, client_id, fund_id, sales_id, fees in zip(
+                    income_store.row_dates().tolist(), income_store.client_idx.tolist(),
+                    income_store.fund_idx.tolist(), income_store.row_sales().tolist(),
+                    income_store.fee_income.tolist())))
+            date_offset += len(income_store.dates)
+            rows += len(income_store)
+
+        conn.executemany("INSERT INTO fee_rates VALUES (?, ?, ?, ?)", (
+            (fund, effective.isoformat(), fee_type, float(fee_schedule.rates[version, fund_id, t]))
+            for version, effective in enumerate(fee_schedule.effective_dates, start=1)
+            for fund_id, fund in enumerate(fee_schedule.funds.names) if fee_schedule.active[version, fund_id]
+            for t, fee_type in enumerate(fee_types)))
+        if client_list is not None:
+            conn.executemany("INSERT INTO client_list VALUES (?, ?, ?)",
+                             client_list[['CLIENT_NAME', 'SALES', 'PROVINCE']].itertuples(index=False, name=None))
+
+        hi = holding_intervals
+        conn.executemany("INSERT INTO holdings VALUES (?, ?, ?, ?, ?)", (
+            (hi.clients[hi.pos_client[pos]], hi.funds[hi.pos_fund[pos]],
+             datetime.date.fromordinal(start).isoformat(), datetime.date.fromordinal(end).isoformat(), amount)
+            for pos, start, end, amount in zip(hi.interval_pos.tolist(), hi.starts.tolist(),
+                                               hi.ends.tolist(), hi.amounts.tolist())))
+
+        conn.executescript(INDEXES)
+        conn.execute("INSERT INTO meta VALUES ('built_at', ?)", (datetime.datetime.now().isoformat(),))
+        conn.execute("INSERT INTO meta VALUES ('fee_types', ?)", (','.join(fee_types),))
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+    print(f"Persisted {rows} income rows to {path}.")
+    return rows
+
+
+def _remove_database(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class SqlDatabase:
+    """One build's database file, removed once no store of its state is left.
+
+    Pickling hands the file over to the unpickled copy (the rebuild
+    subprocess writes the database and the web process serves it).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._finalizer = weakref.finalize(self, _remove_database, path)
+
+    def __getstate__(self):
+        self._finalizer.detach()
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+
+class SqlIncomeStore:
+    """``IncomeStore``-compatible aggregates served from the SQLite database."""
+
+    def __init__(self, database, fee_type=None):
+        self.database = database
+        self.path = database.path
+        self._table = f"income_{fee_type or 'total'}"
+        self._local = threading.local()
+        conn = self._connect()
+        self.fee_types = tuple(conn.execute("SELECT value FROM meta WHERE key = 'fee_types'").fetchone()[0].split(','))
+        self.dates = [datetime.date.fromisoformat(d) for (d,) in
+                      conn.execute("SELECT date FROM dates ORDER BY id")]
+        self.date_ids = {date: i for i, date in enumerate(self.dates)}
+        self.clients = NameIndex(name for (name,) in conn.execute("SELECT name FROM clients ORDER BY id"))
+        self.funds = NameIndex(name for (name,) in conn.execute("SELECT name FROM funds ORDER BY id"))
+        self.sales = NameIndex(name for (name,) in conn.execute("SELECT name FROM sales ORDER BY id"))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def fee_line(self, fee_type=None):
+        """Store of one revenue line, or of the sum of all lines for ``None``."""
+        line = copy.copy(self)
+        line._table = f"income_{fee_type or 'total'}"
+        line._local = threading.local()
+        return line
+
+    def _connect(self):
+        # One read-only connection per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def _query(self, sql, params=()):
+        return self._connect().execute(sql, params).fetchall()
+
+    def __len__(self):
+        return self._query(f"SELECT COUNT(*) FROM {self._table}")[0][0]
+
+    @property
+    def last_date(self):
+        return self.dates[-1] if self.dates else None
+
+    def _date_bounds(self, start_date=None, end_date=None):
+        lo = 0 if start_date is None else bisect_left(self.dates, start_date)
+        hi = len(self.dates) if end_date is None else bisect_right(self.dates, end_date)
+        return lo, max(lo, hi)
+
+    def _totals(self, column, size, start_date=None, end_date=None):
+        lo, hi = self._date_bounds(start_date, end_date)
+        totals = np.zeros(size)
+        for key, value in self._query(
+                f"SELECT {column}, SUM(income) FROM {self._table} WHERE date_id >= ? AND date_id < ? GROUP BY {column}",
+                (lo, hi)):
+            totals[key] = value
+        return totals
+
+    def _matrix(self, column, size):
+        matrix = np.zeros((len(self.dates), size))
+        for date_id, key, value in self._query(
+                f"SELECT date_id, {column}, SUM(income) FROM {self._table} GROUP BY date_id, {column}"):
+            matrix[date_id, key] = value
+        return matrix
+
+    # 聚合
+    def daily_totals(self):
+        return self._totals('date_id', len(self.dates))
+
+    def client_totals(self, start_date=None, end_date=None):
+        return self._totals('client_id', len(self.clients), start_date, end_date)
+
+    def fund_totals(self, start_date=None, end_date=None):
+        return self._totals('fund_id', len(self.funds), start_date, end_date)
+
+    def sales_totals(self, start_date=None, end_date=None):
+        return self._totals('sales_id', len(self.sales), start_date, end_date)
+
+    def sales_daily(self):
+        return self._matrix('sales_id', len(self.sales))
+
+    def client_daily(self):
+        return self._matrix('client_id', len(self.clients))
+
+    def sales_members(self):
+        clients = [set() for _ in self.sales]
+        funds = [set() for _ in self.sales]
+        for members, index, column in ((clients, self.clients, 'client_id'), (funds, self.funds, 'fund_id')):
+            for sales_id, member_id in self._query(f"SELECT DISTINCT sales_id, {column} FROM {self._table}"):
+                members[sales_id].add(index[member_id])
+        return clients, funds
+
+    def fund_client_totals(self, start_date=None, end_date=None):
+        lo, hi = self._date_bounds(start_date, end_date)
+        rows = self._query(f"SELECT fund_id, client_id, SUM(income) FROM {self._table} "
+                           "WHERE date_id >= ? AND date_id < ? GROUP BY fund_id, client_id", (lo, hi))
+        if not rows:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0)
+        fund_ids, client_ids, totals = zip(*rows)
+        return np.array(fund_ids, dtype=np.int32), np.array(client_ids, dtype=np.int32), np.array(totals)
+
+    def sales_fund_totals(self, start_date=None, end_date=None):
+        lo, hi = self._date_bounds(start_date, end_date)
+        rows = self._query(f"SELECT sales_id, fund_id, SUM(income) FROM {self._table} "
+                           "WHERE date_id >= ? AND date_id < ? GROUP BY sales_id, fund_id", (lo, hi))
+        if not rows:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0)
+        sales_ids, fund_ids, totals = zip(*rows)
+        return np.array(sales_ids, dtype=np.int32), np.array(fund_ids, dtype=np.int32), np.array(totals)
+
+    def named(self, values, index):
+        return {name: float(value) for name, value in zip(index.names, values)}
+
+    # 明细视图
+    def day_breakdown(self, date):
+        breakdown = {}
+        for client_id, fund_id, value in self._query(
+                f"SELECT client_id, fund_id, income FROM {self._table} WHERE date_id = ? ORDER BY client_id, fund_id",
+                (self.date_ids.get(date, -1),)):
+            breakdown.setdefault(self.clients[client_id], {})[self.funds[fund_id]] = value
+        return breakdown
+
+    def sales_breakdown(self, date):
+        breakdown = {name: {"clients": {}, "funds": {}} for name in self.sales}
+        date_id = self.date_ids.get(date, -1)
+        for sales_id, client_id, value in self._query(
+                f"SELECT sales_id, client_id, SUM(income) FROM {self._table} WHERE date_id = ? "
+                "GROUP BY sales_id, client_id", (date_id,)):
+            breakdown[self.sales[sales_id]]["clients"][self.clients[client_id]] = value
+        for sales_id, fund_id, value in self._query(
+                f"SELECT sales_id, fund_id, SUM(income) FROM {self._table} WHERE date_id = ? "
+                "GROUP BY sales_id, fund_id", (date_id,)):
+            breakdown[self.sales[sales_id]]["funds"][self.funds[fund_id]] = value
+        return breakdown
+
+    def nested(self, start_date=None, end_date=None):
+        lo, hi = self._date_bounds(start_date, end_date)
+        return {self.dates[i]: self.day_breakdown(self.dates[i]) for i in range(lo, hi)}
+
+    # 查询
+    def holdings_on(self, date):
+        """``{client: {fund: amount}}`` of the positions held on ``date``."""
+        holdings = {}
+        day = date.isoformat()
+        for client, fund, amount in self._query(
+                "SELECT client_name, fund_name, amount FROM holdings WHERE start_date <= ? AND end_date >= ?",
+                (day, day)):
+            holdings.setdefault(client, {})[fund] = amount
+        return holdings
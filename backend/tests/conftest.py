@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Shared fixtures: the sample data files under backend/data, loaded once."""
+
+import datetime
+import os
+import shutil
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from kpi_master_v1_07 import load_client_sales, load_initial_holdings, load_trades  # noqa: E402
+from fee_engine import load_fee_schedule  # noqa: E402
+from kpi_state import DATA_FILES, SNAPSHOT_DATE, build_served_state  # noqa: E402
+
+SAMPLE_DIR = os.path.join(BACKEND_DIR, 'data')
+END_DATE = datetime.date(2024, 8, 31)
+
+
+@pytest.fixture(scope='session')
+def data_dir(tmp_path_factory):
+    """Copy of the sample data, so builds write checkpoints and reports outside the repo."""
+    directory = tmp_path_factory.mktemp('data')
+    for name in DATA_FILES.values():
+        if os.path.exists(os.path.join(SAMPLE_DIR, name)):
+            shutil.copy(os.path.join(SAMPLE_DIR, name), directory)
+    return str(directory)
+
+
+@pytest.fixture(scope='session')
+def inputs(data_dir):
+    """``(snapshot, trades, fee_schedule, client_sales)`` from the sample data."""
+    return (load_initial_holdings(os.path.join(data_dir, DATA_FILES['initial_holdings']),
+                                  target_date=SNAPSHOT_DATE.strftime('%Y%m%d')),
+            load_trades(os.path.join(data_dir, DATA_FILES['trades'])),
+            load_fee_schedule(os.path.join(data_dir, DATA_FILES['product_info'])),
+            load_client_sales(os.path.join(data_dir, DATA_FILES['client_list'])))
+
+
+@pytest.fixture(scope='session')
+def served_state(data_dir):
+    """The state the API serves for the sample data, every fee view built."""
+    return build_served_state(data_dir, SNAPSHOT_DATE, END_DATE)
+
+
+@pytest.fixture(scope='session')
+def servers(data_dir):
+    """``(app, asgi)`` modules for the sample data; importing them does not build a state."""
+    os.environ['KPI_DEFER_STARTUP'] = '1'
+    os.environ['KPI_DATA_DIR'] = data_dir
+    import app
+    import asgi
+    return app, asgi
+
+
+@pytest.fixture
+def with_state(servers, served_state, monkeypatch):
+    """Serve ``served_state`` from both servers for one test."""
+    monkeypatch.setattr(servers[0].state_manager, 'current', served_state)
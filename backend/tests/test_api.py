@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
+from concurrent import futures
+
+
+def asgi_get(asgi, path, query=''):
+    """``(status, headers, body)`` of a GET request to the ASGI app."""
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode('latin-1'),
+             'headers': []}
+    asyncio.run(asgi.app(scope, receive, send))
+    start, body = messages
+    return start['status'], dict(start['headers']), body['body']
+
+
+def test_flask_chart_catalog(servers):
+    response = servers[0].app.test_client().get('/api/charts')
+    assert response.status_code == 200
+    assert response.get_json()['charts'] == ['cumulative', 'composition', 'forecast']
+
+
+def test_asgi_chart_catalog(servers):
+    status, _, body = asgi_get(servers[1], '/api/charts')
+    assert status == 200
+    catalog = json.loads(body)
+    assert catalog['charts'] == ['cumulative', 'composition', 'forecast']
+    assert set(catalog) == set(servers[0].app.test_client().get('/api/charts').get_json())
+
+
+def test_asgi_waits_for_the_first_state(servers, monkeypatch):
+    monkeypatch.setattr(servers[0].state_manager, 'current', None)
+    status, headers, _ = asgi_get(servers[1], '/api/charts/cumulative')
+    assert status == 503
+    assert headers[b'retry-after'] == b'5'
+
+
+def test_chart_rendering(servers, with_state):
+    flask_response = servers[0].app.test_client().get('/api/charts/cumulative?size=thumb')
+    assert flask_response.status_code == 200
+    assert flask_response.mimetype == 'image/png'
+    status, headers, body = asgi_get(servers[1], '/api/charts/cumulative', 'size=thumb')
+    assert status == 200
+    assert headers[b'content-type'] == b'image/png'
+    # The second request is served from the chart cache
+    assert body == flask_response.data
+
+
+def test_bad_chart_parameters(servers, with_state):
+    assert servers[0].app.test_client().get('/api/charts/pie').status_code == 400
+    assert asgi_get(servers[1], '/api/charts/cumulative', 'format=gif')[0] == 400
+
+
+def test_chart_timeouts_are_504(servers, with_state, monkeypatch):
+    app, asgi = servers
+
+    def render(*args, **kwargs):
+        raise futures.TimeoutError()
+
+    monkeypatch.setattr(app.chart_service, 'render', render)
+    assert app.app.test_client().get('/api/charts/cumulative?size=thumb&start=2024-02-01').status_code == 504
+    assert asgi_get(asgi, '/api/charts/cumulative', 'size=thumb&start=2024-02-01')[0] == 504
+
+
+def test_asgi_payloads_match_flask(servers, with_state):
+    for name in ('dashboard', 'province_counts', 'leaderboards'):
+        status, headers, body = asgi_get(servers[1], f'/api/{name}')
+        assert status == 200
+        assert headers[b'content-type'] == b'application/json'
+        assert json.loads(body) == servers[0].app.test_client().get(f'/api/{name}').get_json()
+
+
+def test_asgi_status_codes(servers, with_state, monkeypatch):
+    asgi = servers[1]
+    assert asgi_get(asgi, '/api/nothing')[0] == 404
+    assert asgi_get(asgi, '/api/admin/rebuild')[0] == 403
+    assert asgi_get(asgi, '/api/forecast', 'model=guess')[0] == 400
+    monkeypatch.setattr(servers[0].state_manager, 'current', None)
+    status, headers, _ = asgi_get(asgi, '/api/dashboard')
+    assert status == 503
+    assert headers[b'retry-after'] == b'5'
+
+
+def test_asgi_timeouts_are_504(servers, with_state, monkeypatch):
+    asgi = servers[1]
+    monkeypatch.setattr(asgi, 'REQUEST_TIMEOUT', 0.05)
+    monkeypatch.setitem(asgi.ENDPOINTS, 'slow', lambda state, args: time.sleep(0.5))
+    assert asgi_get(asgi, '/api/slow')[0] == 504
+
+
+def test_coalescer_shares_one_computation(servers):
+    asgi = servers[1]
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        time.sleep(0.1)
+        return value * 2
+
+    async def requests():
+        coalescer = asgi.RequestCoalescer()
+        shared = [coalescer.run('a', compute, 1) for _ in range(5)]
+        results = await asyncio.gather(*shared, coalescer.run('b', compute, 2))
+        # Finished keys are dropped, so a later request computes again
+        return results, await coalescer.run('a', compute, 3), coalescer._inflight
+
+    results, later, inflight = asyncio.run(requests())
+    assert results == [2] * 5 + [4]
+    assert later == 6
+    assert sorted(calls) == [1, 2, 3]
+    assert inflight == {}
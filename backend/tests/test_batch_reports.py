@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import os
+import sys
+
+import pytest
+
+import batch_reports
+from batch_reports import JobState, covered_window, job_id, parse_window, preset_jobs
+
+D = datetime.date
+
+
+def test_parse_window():
+    assert parse_window('2024') == (D(2024, 1, 1), D(2024, 12, 31))
+    assert parse_window('2024-02') == (D(2024, 2, 1), D(2024, 2, 29))
+    assert parse_window('2023-02') == (D(2023, 2, 1), D(2023, 2, 28))
+    assert parse_window('2023-12') == (D(2023, 12, 1), D(2023, 12, 31))
+    assert parse_window('2024Q1') == (D(2024, 1, 1), D(2024, 3, 31))
+    assert parse_window('2024Q3') == (D(2024, 7, 1), D(2024, 9, 30))
+    assert parse_window('2024Q4') == (D(2024, 10, 1), D(2024, 12, 31))
+    assert parse_window('2024-03-05:2024-04-01') == (D(2024, 3, 5), D(2024, 4, 1))
+    for spec in ('2024Q5', '2024Q0', '2024-13', '2024-1', '24', 'Q1', '2024-03-05:', 'soon'):
+        with pytest.raises(ValueError):
+            parse_window(spec)
+
+
+def test_covered_window_clips_to_the_data():
+    first, last = D(2023, 12, 31), D(2024, 8, 31)
+    assert covered_window({'window': '2024-03'}, first, last) == (D(2024, 3, 1), D(2024, 3, 31))
+    assert covered_window({'window': '2024Q3'}, first, last) == (D(2024, 7, 1), D(2024, 8, 31))
+    assert covered_window({'window': '2023'}, first, last) == (D(2023, 12, 31), D(2023, 12, 31))
+    assert covered_window({'window': '2024Q4'}, first, last) is None
+    assert covered_window({'window': '2024-05-01:2024-04-01'}, first, last) is None
+    job = {'window': '2024Q3', 'scope': 'sales:A B/C', 'format': 'json'}
+    assert job_id(job, covered_window(job, first, last)) == '20240701-20240831_sales_A_B_C.json'
+
+
+def test_presets_span_the_data_range():
+    first, last = D(2023, 12, 31), D(2024, 8, 31)
+    monthly = [job['window'] for job in preset_jobs('monthly', first, last, [], 'json')]
+    assert monthly == ['2023-12'] + [f'2024-{m:02d}' for m in range(1, 9)]
+    quarterly = [job['window'] for job in preset_jobs('quarterly', first, last, [], 'json')]
+    assert quarterly == ['2023Q4', '2024Q1', '2024Q2', '2024Q3']
+    sales = preset_jobs('sales', first, last, ['a', 'b'], 'xlsx')
+    assert [job['scope'] for job in sales] == ['sales:a', 'sales:b']
+    assert {job['window'] for job in sales} == {'2023-12-31:2024-08-31'}
+    with pytest.raises(ValueError):
+        preset_jobs('weekly', first, last, [], 'json')
+
+
+def test_job_state_resumes_only_matching_runs(tmp_path):
+    path = str(tmp_path / batch_reports.STATE_FILE)
+    output = tmp_path / 'report.json'
+    output.write_text('{}')
+    state = JobState(path, {'inputs': 1})
+    state.mark('report.json', 'done', output=str(output))
+    state.mark('other.json', 'failed', output=str(tmp_path / 'other.json'), error='boom')
+
+    resumed = JobState(path, {'inputs': 1})
+    assert resumed.is_done('report.json')
+    assert not resumed.is_done('other.json') and not resumed.is_done('missing.json')
+    assert not JobState(path, {'inputs': 1}, fresh=True).is_done('report.json')
+    assert not JobState(path, {'inputs': 2}).is_done('report.json')
+    # A done job whose output was deleted is rendered again
+    output.unlink()
+    assert not JobState(path, {'inputs': 1}).is_done('report.json')
+
+
+def test_json_report_matches_the_store(served_state, tmp_path):
+    batch_reports._init_worker(served_state)
+    job = {'window': '2024-03', 'scope': 'all', 'format': 'json'}
+    window = covered_window(job, D(2023, 12, 31), D(2024, 8, 31))
+    _, path, _ = batch_reports.run_job(job, window, str(tmp_path), '30')
+    with open(path, encoding='utf-8') as file:
+        report = json.load(file)
+    store = served_state.income_store
+    assert (report['start'], report['end']) == ('2024-03-01', '2024-03-31')
+    assert report['totalIncome'] == pytest.approx(store.client_totals(*window).sum())
+    assert len(report['daily']) == 31
+    assert not os.path.exists(f"{path}.{os.getpid()}.tmp")
+
+
+def test_rerun_skips_done_jobs(data_dir, tmp_path, monkeypatch, capsys):
+    jobs = tmp_path / 'jobs.json'
+    jobs.write_text(json.dumps([{'window': '2024-07', 'format': 'json'},
+                                {'window': '2024Q3', 'format': 'json'},
+                                {'window': '2025', 'format': 'json'}]))
+    argv = ['batch_reports.py', '--data-dir', data_dir, '--jobs', str(jobs), '--workers', '1',
+            '--output-dir', str(tmp_path / 'reports')]
+    monkeypatch.setattr(sys, 'argv', argv)
+    assert batch_reports.main() == 0
+    out = capsys.readouterr().out
+    assert "Skipping 2025 (all)" in out
+    assert "2 jobs, 0 already done, 2 to render." in out
+    saved = json.loads((tmp_path / 'reports' / batch_reports.STATE_FILE).read_text(encoding='utf-8'))
+    assert saved['jobs']['20240701-20240831_all.json']['partial'] is True
+    assert saved['jobs']['20240701-20240731_all.json']['partial'] is False
+
+    assert batch_reports.main() == 0
+    assert "2 jobs, 2 already done, 0 to render." in capsys.readouterr().out
+    monkeypatch.setattr(sys, 'argv', argv + ['--fresh'])
+    assert batch_reports.main() == 0
+    assert "2 jobs, 0 already done, 2 to render." in capsys.readouterr().out
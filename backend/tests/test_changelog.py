@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from changelog import Changelog, StateDigest
+from income_store import IncomeStore, NameIndex
+
+DAY = datetime.date(2024, 1, 1)
+DATES = [DAY + datetime.timedelta(days=i) for i in range(5)]
+CLIENT_SALES = {'客户A': '张三', '客户B': '李四'}
+
+
+def make_store(rows, dates=DATES):
+    """``IncomeStore`` of ``[(day number, client, fund, income)]`` rows."""
+    clients, funds, sales = NameIndex(), NameIndex(), NameIndex()
+    for client in CLIENT_SALES:
+        clients.add(client)
+    client_sales_idx = [sales.add(CLIENT_SALES[client]) for client in clients]
+    return IncomeStore(dates, clients, funds, sales, client_sales_idx,
+                       [day for day, _, _, _ in rows], [clients.add(client) for _, client, _, _ in rows],
+                       [funds.add(fund) for _, _, fund, _ in rows], [income for _, _, _, income in rows])
+
+
+BASE = [(day, client, fund, 10.0) for day in range(5) for client in CLIENT_SALES for fund in ('X', 'Y')]
+
+
+def test_digest_ignores_row_order():
+    assert StateDigest(make_store(BASE)).date_digests.tolist() == \
+        StateDigest(make_store(BASE[::-1])).date_digests.tolist()
+
+
+def test_diff_finds_changed_dates_and_sales():
+    changed = [(day, client, fund, 11.0 if (day, client, fund) == (3, '客户B', 'Y') else income)
+               for day, client, fund, income in BASE]
+    changes = StateDigest(make_store(changed)).diff(StateDigest(make_store(BASE)))
+    assert changes.changed
+    assert changes.dates == {DATES[3]}
+    assert changes.first_date == DATES[3]
+    assert changes.sales_from == {'李四': DATES[3]}
+    assert StateDigest(make_store(BASE)).diff(StateDigest(make_store(BASE))).changed is False
+
+
+def test_concat_matches_whole_digest():
+    whole = StateDigest(make_store(BASE))
+    first = make_store([row for row in BASE if row[0] < 2], DATES[:2])
+    second = make_store([(row[0] - 2,) + row[1:] for row in BASE if row[0] >= 2], DATES[2:])
+    parts = StateDigest.concat([StateDigest(first), StateDigest(second)])
+    assert parts.dates == whole.dates
+    assert parts.date_digests.tolist() == whole.date_digests.tolist()
+    assert parts.sales_digests.tolist() == whole.sales_digests.tolist()
+
+
+def test_changes_since_merges_history():
+    v1 = Changelog(1, StateDigest(make_store(BASE)))
+    step2 = [row if row[0] != 1 else row[:3] + (12.0,) for row in BASE]
+    v2 = v1.advance(Changelog(2, StateDigest(make_store(step2))))
+    step3 = [row if row[0] != 4 or row[1] != '客户A' else row[:3] + (13.0,) for row in step2]
+    v3 = v2.advance(Changelog(3, StateDigest(make_store(step3))))
+
+    assert v3.version == 3
+    assert v3.changes_since(3).changed is False
+    since1 = v3.changes_since(1)
+    assert since1.dates == {DATES[1], DATES[4]}
+    assert since1.sales_from == {'张三': DATES[1], '李四': DATES[1]}
+    since2 = v3.changes_since(2)
+    assert since2.dates == {DATES[4]}
+    assert since2.sales_from == {'张三': DATES[4]}
+    # Unknown versions need a full payload
+    assert v3.changes_since(0) is None
+
+
+def test_new_version_without_row_changes_is_still_a_change():
+    v1 = Changelog(1, StateDigest(make_store(BASE)))
+    v2 = v1.advance(Changelog(2, StateDigest(make_store(BASE))))
+    changes = v2.changes_since(1)
+    assert changes.changed and not changes.dates
+
+
+def test_older_or_conflicting_rebuild_drops_history():
+    v2 = Changelog(1, StateDigest(make_store(BASE))).advance(
+        Changelog(2, StateDigest(make_store([row[:3] + (1.0,) for row in BASE]))))
+    assert v2.advance(Changelog(1, StateDigest(make_store(BASE)))).entries == []
+    assert v2.advance(Changelog(2, StateDigest(make_store(BASE)))).entries == []
+
+
+def test_removed_dates():
+    v1 = Changelog(1, StateDigest(make_store(BASE)))
+    v2 = v1.advance(Changelog(2, StateDigest(make_store([row for row in BASE if row[0] < 4], DATES[:4]))))
+    changes = v2.changes_since(1)
+    assert changes.removed_dates == {DATES[4]}
+    assert changes.first_date == DATES[4]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import datetime
+import importlib
+
+import matplotlib
+import numpy as np
+
+import charts
+from charts import ChartService, draw_cumulative_income, render_chart
+
+DATES = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(10)]
+SERIES = {'sales A': np.arange(10.0), 'sales B': -np.ones(10)}
+
+
+def test_rendering_leaves_rcparams_alone():
+    before = dict(matplotlib.rcParams)
+    importlib.reload(charts)
+    assert dict(matplotlib.rcParams) == before
+    assert render_chart(draw_cumulative_income, (DATES, SERIES, 'Income')).startswith(b'\x89PNG')
+    assert render_chart(draw_cumulative_income, (DATES, SERIES, 'Income'), fmt='svg', size='thumb').lstrip()[:5] in (
+        b'<?xml', b'<svg ')
+    assert dict(matplotlib.rcParams) == before
+
+
+def test_chart_service_caches_by_key():
+    service = ChartService(workers=1, cache_bytes=1024 * 1024)
+    calls = []
+
+    def prepare():
+        calls.append(1)
+        return draw_cumulative_income, (DATES, SERIES, 'Income')
+
+    first = service.render(('cumulative', 1), prepare, timeout=30)
+    assert service.render(('cumulative', 1), prepare, timeout=30) == first
+    service.render(('cumulative', 2), prepare, timeout=30)
+    assert len(calls) == 2
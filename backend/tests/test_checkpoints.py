@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import datetime
+import os
+
+import pytest
+
+from checkpoints import (KEEP_SETS, ensure_checkpoints, holdings_as_of, list_checkpoints, month_ends,
+                         replay_trades, write_checkpoints)
+from kpi_state import SNAPSHOT_DATE
+
+
+def assert_same_holdings(actual, expected):
+    assert {c for c, funds in actual.items() if funds} == {c for c, funds in expected.items() if funds}
+    for client, funds in expected.items():
+        assert set(actual.get(client, {})) == set(funds)
+        for fund, amount in funds.items():
+            assert actual[client][fund] == pytest.approx(amount, abs=1e-6)
+
+
+def test_month_ends():
+    assert month_ends(datetime.date(2023, 12, 31), datetime.date(2024, 3, 30)) == [
+        datetime.date(2023, 12, 31), datetime.date(2024, 1, 31), datetime.date(2024, 2, 29)]
+
+
+@pytest.mark.parametrize('as_of', [datetime.date(2024, 1, 31), datetime.date(2024, 3, 5),
+                                   datetime.date(2024, 6, 30), datetime.date(2024, 8, 31)])
+def test_checkpoint_replay_matches_full_replay(tmp_path, inputs, as_of):
+    snapshot, trades, _, _ = inputs
+    set_dir = ensure_checkpoints(str(tmp_path), snapshot, SNAPSHOT_DATE, trades, {'test': 1})
+    assert list_checkpoints(set_dir)
+    assert_same_holdings(holdings_as_of(as_of, set_dir, snapshot, SNAPSHOT_DATE, trades),
+                         replay_trades(snapshot, trades, SNAPSHOT_DATE, as_of))
+
+
+def test_reuses_an_existing_set(tmp_path, inputs):
+    snapshot, trades, _, _ = inputs
+    first = ensure_checkpoints(str(tmp_path), snapshot, SNAPSHOT_DATE, trades, {'test': 1})
+    written = os.stat(os.path.join(first, 'manifest.json')).st_mtime_ns
+    assert ensure_checkpoints(str(tmp_path), snapshot, SNAPSHOT_DATE, trades, {'test': 1}) == first
+    assert os.stat(os.path.join(first, 'manifest.json')).st_mtime_ns == written
+
+
+def test_old_sets_are_pruned(tmp_path, inputs):
+    snapshot, trades, _, _ = inputs
+    through = datetime.date(2024, 4, 30)
+    sets = [write_checkpoints(str(tmp_path), snapshot, SNAPSHOT_DATE, trades, through, {'build': i})
+            for i in range(KEEP_SETS + 2)]
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path) for path in sets[-KEEP_SETS:])
+
+
+def test_pruned_set_falls_back_to_the_snapshot(tmp_path, inputs):
+    snapshot, trades, _, _ = inputs
+    as_of = datetime.date(2024, 5, 15)
+    assert_same_holdings(holdings_as_of(as_of, str(tmp_path / 'missing'), snapshot, SNAPSHOT_DATE, trades),
+                         replay_trades(snapshot, trades, SNAPSHOT_DATE, as_of))
+    with pytest.raises(ValueError):
+        holdings_as_of(SNAPSHOT_DATE - datetime.timedelta(days=1), str(tmp_path), snapshot, SNAPSHOT_DATE, trades)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import pandas as pd
+import pytest
+
+from fee_engine import FEE_TYPES, REDEMPTION, add_redemptions, load_fee_schedule
+from holding_intervals import build_holding_intervals, income_store_from_intervals
+
+PRODUCT_INFO = """,FUND_NAME,RD_FEES,MA_FEES,MA_FEES_DAILY,AD_FEES,CUS_FEES,EFFECTIVE_DATE
+0,基金A,0.005,0.0365,,-,0.00365,
+1,基金A,0.005,0.073,,,0.00365,20240110
+2,基金B,,0.0365,0.0002,,,2024-01-05
+"""
+DAY = datetime.date(2024, 1, 1)
+
+
+@pytest.fixture
+def schedule(tmp_path):
+    path = tmp_path / 'PRODUCT_INFO.csv'
+    path.write_text(PRODUCT_INFO, encoding='utf-8')
+    return load_fee_schedule(str(path))
+
+
+def test_rates_are_forward_filled_between_effective_dates(schedule):
+    assert schedule.product_info('ma', datetime.date(2024, 1, 4)) == {'基金A': pytest.approx(0.0001)}
+    # 基金B starts on its effective date, and its published daily rate wins
+    assert schedule.product_info('ma', datetime.date(2024, 1, 5)) == {'基金A': pytest.approx(0.0001),
+                                                                      '基金B': pytest.approx(0.0002)}
+    later = schedule.product_info('ma', datetime.date(2024, 3, 1))
+    assert later == {'基金A': pytest.approx(0.0002), '基金B': pytest.approx(0.0002)}
+    assert schedule.product_info('ma') == later
+    assert schedule.product_info('cus', datetime.date(2024, 3, 1)) == {'基金A': pytest.approx(0.00001),
+                                                                       '基金B': 0.0}
+    assert schedule.product_info('ad')['基金A'] == 0.0
+
+
+def test_trade_fees_do_not_accrue(schedule):
+    assert schedule.product_info('rd') == {'基金A': 0.0, '基金B': 0.0}
+    rd = FEE_TYPES.index('rd')
+    assert schedule.rates[schedule.version_on(), schedule.funds.get('基金A'), rd] == pytest.approx(0.005)
+
+
+def test_redemption_fee_is_charged_on_the_redeemed_amount(schedule):
+    redeemed = datetime.date(2024, 1, 20)
+    intervals = build_holding_intervals({'客户': {'基金A': 1000.0}}, {'客户': {'基金A': {redeemed: -400.0}}},
+                                        DAY, datetime.date(2024, 1, 31))
+    store = income_store_from_intervals(intervals, schedule, {'客户': '张三'},
+                                        redemptions={('客户', '基金A', redeemed): 400.0})
+    rd_line = store.fee_line('rd')
+    assert rd_line.daily_totals()[store.date_ids[redeemed]] == pytest.approx(400.0 * 0.005)
+    assert rd_line.daily_totals().sum() == pytest.approx(400.0 * 0.005)
+    ma_line = store.fee_line('ma').daily_totals()
+    assert ma_line[store.date_ids[datetime.date(2024, 1, 9)]] == pytest.approx(1000.0 * 0.0001)
+    assert ma_line[store.date_ids[datetime.date(2024, 1, 10)]] == pytest.approx(1000.0 * 0.0002)
+    assert ma_line[store.date_ids[redeemed]] == pytest.approx(600.0 * 0.0002)
+
+
+def test_add_redemptions_sums_across_chunks():
+    def chunk(*rows):
+        return pd.DataFrame(rows, columns=['CLIENT_NAME', 'FUND_NAME', 'ACTION', 'date', 'money'])
+
+    redemptions = {}
+    add_redemptions(redemptions, chunk(('客户', '基金A', REDEMPTION, DAY, -100.0), ('客户', '基金A', '申购', DAY, 50.0)))
+    add_redemptions(redemptions, chunk(('客户', '基金A', REDEMPTION, DAY, -20.0)))
+    assert redemptions == {('客户', '基金A', DAY): 120.0}
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import numpy as np
+import pytest
+
+from forecast_service import DEFAULT_HORIZON, MAX_HORIZON_DAYS, ForecastService
+
+D = datetime.date
+
+
+@pytest.fixture
+def service():
+    # 2024-01-03 is a Wednesday; actual income 1..30 through 2024-02-01
+    dates = [D(2024, 1, 3) + datetime.timedelta(days=i) for i in range(30)]
+    return ForecastService(dates, np.arange(1, 31), complex_forecast=np.full(MAX_HORIZON_DAYS, 2.0))
+
+
+def test_parse_horizon(service):
+    assert service.parse_horizon(None) == DEFAULT_HORIZON
+    assert service.parse_horizon('') == DEFAULT_HORIZON
+    assert service.parse_horizon('10') == D(2024, 2, 11)
+    assert service.parse_horizon('2024-01-03') == D(2024, 1, 3)
+    assert service.parse_horizon(str(MAX_HORIZON_DAYS)) == D(2024, 2, 1) + datetime.timedelta(days=MAX_HORIZON_DAYS)
+    for value in ('2024-01-02', str(MAX_HORIZON_DAYS + 1), 'soon'):
+        with pytest.raises(ValueError):
+            service.parse_horizon(value)
+
+
+def test_series_joins_actual_and_forecast(service):
+    income, cumulative = service.series('simple', D(2024, 2, 5))
+    assert income.tolist() == list(range(1, 31)) + [30] * 4
+    assert cumulative[-1] == sum(range(1, 31)) + 120
+    income, _ = service.series('complex', D(2024, 2, 3))
+    assert income[-2:].tolist() == [2.0, 2.0]
+    # A horizon inside the actual history only returns the history
+    assert service.series('simple', D(2024, 1, 5))[0].tolist() == [1, 2, 3]
+
+
+def test_daily_points(service):
+    points = service.points('simple', D(2024, 2, 2), 'day')
+    assert len(points) == 31
+    assert points[0] == {'date': '2024-01-03', 'income': 1.0, 'cumulativeIncome': 1.0, 'isActual': True}
+    assert points[-1] == {'date': '2024-02-02', 'income': 30.0, 'cumulativeIncome': 495.0, 'isActual': False}
+
+
+def test_weekly_buckets_end_on_sundays(service):
+    points = service.points('simple', D(2024, 2, 14), 'week')
+    assert [p['date'] for p in points] == ['2024-01-07', '2024-01-14', '2024-01-21', '2024-01-28',
+                                           '2024-02-04', '2024-02-11', '2024-02-14']
+    # The first bucket is the partial week Wednesday to Sunday
+    assert points[0]['income'] == 1 + 2 + 3 + 4 + 5
+    assert points[3]['isActual'] and not points[4]['isActual']
+    _, cumulative = service.series('simple', D(2024, 2, 14))
+    assert sum(p['income'] for p in points) == pytest.approx(cumulative[-1])
+
+
+def test_monthly_buckets_end_on_month_ends(service):
+    points = service.points('simple', D(2024, 4, 15), 'month')
+    assert [p['date'] for p in points] == ['2024-01-31', '2024-02-29', '2024-03-31', '2024-04-15']
+    assert points[0]['income'] == sum(range(1, 30))
+    # February: the last actual day, then 28 forecast days at the last actual value
+    assert points[1]['income'] == 30 + 28 * 30
+    assert [p['isActual'] for p in points] == [True, False, False, False]
+    # A horizon on a month end does not add an empty bucket
+    assert [p['date'] for p in service.points('simple', D(2024, 2, 29), 'month')] == ['2024-01-31', '2024-02-29']
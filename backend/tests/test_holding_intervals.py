@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import numpy as np
+import pytest
+
+from conftest import END_DATE
+from holding_intervals import build_holding_intervals, income_store_chunks, income_store_from_intervals
+from income_store import IncomeStore
+from kpi_master_v1_07 import calculate_daily_holdings
+from kpi_state import SNAPSHOT_DATE
+
+
+@pytest.fixture(scope='module')
+def intervals(inputs):
+    snapshot, trades, _, _ = inputs
+    return build_holding_intervals(snapshot, trades, SNAPSHOT_DATE, END_DATE)
+
+
+@pytest.fixture(scope='module')
+def daily_holdings(inputs):
+    snapshot, trades, _, _ = inputs
+    return calculate_daily_holdings(snapshot, trades, SNAPSHOT_DATE, END_DATE)
+
+
+def test_intervals_expand_to_daily_holdings(intervals, daily_holdings):
+    assert intervals.to_daily_holdings() == daily_holdings
+
+
+def test_partial_window_expansion(intervals, daily_holdings):
+    start, end = datetime.date(2024, 3, 5), datetime.date(2024, 6, 30)
+    expected = {}
+    for client, funds in daily_holdings.items():
+        for fund, days in funds.items():
+            window = {date: amount for date, amount in days.items() if start <= date <= end}
+            if window:
+                expected.setdefault(client, {})[fund] = window
+    assert intervals.to_daily_holdings(start, end) == expected
+
+
+def test_amount_on_matches_daily_holdings(intervals, daily_holdings):
+    rng = np.random.default_rng(0)
+    positions = [(client, fund) for client, funds in daily_holdings.items() for fund in funds]
+    for i in rng.choice(len(positions), 500):
+        client, fund = positions[i]
+        date = SNAPSHOT_DATE + datetime.timedelta(days=int(rng.integers(-3, 250)))
+        assert intervals.amount_on(client, fund, date) == daily_holdings[client][fund].get(date, 0)
+    assert intervals.amount_on('no such client', 'no such fund', SNAPSHOT_DATE) == 0
+
+
+def test_interval_income_matches_daily_income(inputs, intervals, daily_holdings):
+    _, _, fee_schedule, client_sales = inputs
+    daily = IncomeStore.from_daily_holdings(daily_holdings, fee_schedule.product_info('ma'), client_sales)
+    store = income_store_from_intervals(intervals, fee_schedule, client_sales).fee_line('ma')
+
+    expected = daily.named(daily.client_totals(), daily.clients)
+    actual = store.named(store.client_totals(), store.clients)
+    assert set(k for k, v in actual.items() if v) == set(k for k, v in expected.items() if v)
+    for client, total in expected.items():
+        assert actual.get(client, 0) == pytest.approx(total, rel=1e-9, abs=1e-6)
+
+
+def test_chunks_cover_the_full_store(inputs, intervals):
+    _, _, fee_schedule, client_sales = inputs
+    full = income_store_from_intervals(intervals, fee_schedule, client_sales)
+    chunks = list(income_store_chunks(intervals, fee_schedule, client_sales, days=17))
+    assert [date for chunk in chunks for date in chunk.dates] == full.dates
+    assert sum(len(chunk) for chunk in chunks) == len(full)
+    np.testing.assert_allclose(np.concatenate([chunk.daily_totals() for chunk in chunks]), full.daily_totals())
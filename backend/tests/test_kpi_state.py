@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from fee_engine import FEE_SELECTORS
+from kpi_state import FeeViews
+
+
+def test_served_state_has_every_fee_view(served_state, monkeypatch):
+    def build(self, fee_type):
+        pytest.fail(f"{fee_type} view built on request")
+
+    monkeypatch.setattr(FeeViews, '_build', build)
+    for fee_type in FEE_SELECTORS:
+        assert served_state.fee_views.get(fee_type).fee_type == fee_type
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import numpy as np
+import pytest
+
+from leaderboards import LEADERBOARD_PERIODS, Leaderboards, grouped_top_k, period_bounds, top_k
+
+
+def sorted_top(pairs, k):
+    """Reference selection: a full sort by value."""
+    return sorted(pairs, key=lambda pair: pair[1], reverse=True)[:k]
+
+
+def test_period_bounds():
+    first, last = datetime.date(2024, 1, 1), datetime.date(2024, 8, 29)  # a Thursday
+    assert period_bounds('day', first, last) == (last, last)
+    assert period_bounds('week', first, last) == (datetime.date(2024, 8, 26), last)
+    assert period_bounds('month', first, last) == (datetime.date(2024, 8, 1), last)
+    assert period_bounds('ytd', first, last) == (datetime.date(2024, 1, 1), last)
+    assert period_bounds('all', first, last) == (first, last)
+    # Periods never start before the first date
+    assert period_bounds('ytd', datetime.date(2024, 3, 4), last)[0] == datetime.date(2024, 3, 4)
+    assert period_bounds('week', datetime.date(2024, 8, 28), last)[0] == datetime.date(2024, 8, 28)
+    with pytest.raises(ValueError):
+        period_bounds('quarter', first, last)
+
+
+def test_top_k_matches_a_full_sort():
+    rng = np.random.default_rng(0)
+    values = rng.permutation(1000).astype(np.float64)
+    names = [f"n{i}" for i in range(len(values))]
+    for k in (1, 10, 1000, 2000):
+        assert top_k(names, values, k) == sorted_top(zip(names, values.tolist()), k)
+    assert top_k([], np.array([]), 5) == []
+
+
+def test_grouped_top_k_matches_a_full_sort():
+    rng = np.random.default_rng(1)
+    groups = rng.integers(0, 7, 2000).tolist()
+    values = rng.permutation(2000).astype(np.float64).tolist()
+    items = list(range(2000))
+    for k in (1, 5, 500):
+        result = grouped_top_k(groups, items, values, k)
+        assert set(result) == set(groups)
+        for group, top in result.items():
+            expected = sorted_top([(i, v) for g, i, v in zip(groups, items, values) if g == group], k)
+            assert [(i, v) for v, i in top] == expected
+
+
+@pytest.fixture(scope='module')
+def boards(served_state):
+    store = served_state.income_store
+    return store, Leaderboards.build(store, served_state.client_sales)
+
+
+def test_leaderboards_match_the_store_totals(boards, served_state):
+    store, leaderboards = boards
+    for period in LEADERBOARD_PERIODS:
+        start, end = period_bounds(period, store.dates[0], store.last_date)
+        clients = sorted_top(store.named(store.client_totals(start, end), store.clients).items(), 20)
+        funds = sorted_top(store.named(store.fund_totals(start, end), store.funds).items(), 20)
+        sales = sorted_top(store.named(store.sales_totals(start, end), store.sales).items(), 20)
+        assert [v for _, v in leaderboards.top(period, 'clients', 20)] == [v for _, v in clients]
+        assert [v for _, v in leaderboards.top(period, 'funds', 20)] == [v for _, v in funds]
+        assert [v for _, v in leaderboards.top(period, 'salesPersons', 20)] == [v for _, v in sales]
+
+    # Per sales person, the clients are that person's clients in income order
+    start, end = period_bounds('all', store.dates[0], store.last_date)
+    totals = store.named(store.client_totals(start, end), store.clients)
+    for sales_person in store.sales:
+        mine = [(client, total) for client, total in totals.items()
+                if served_state.client_sales.get(client, 'Unknown') == sales_person]
+        top = leaderboards.top('all', 'clientsBySalesPerson', 10, group=sales_person)
+        assert [v for _, v in top] == [v for _, v in sorted_top(mine, 10)]
+    assert leaderboards.top('all', 'clientsBySalesPerson', 10, group='nobody') == []
+
+
+def test_view_slices_every_list(boards):
+    _, leaderboards = boards
+    view = leaderboards.view(['day', 'all'], 3)
+    assert view['k'] == 3 and set(view['periods']) == {'day', 'all'}
+    board = view['periods']['all']
+    assert board['clients'] == [{'name': name, 'income': income}
+                                for name, income in leaderboards.top('all', 'clients', 3)]
+    assert all(len(top) <= 3 for top in board['clientsByFund'].values())
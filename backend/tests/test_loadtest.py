@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import csv
+
+import pytest
+
+from loadtest import ENDPOINTS, endpoint_path, make_scaled_dataset, parse_mix, summarize
+
+
+def test_default_mix_is_every_endpoint():
+    assert parse_mix(None) == [(name, 1.0) for name in ENDPOINTS]
+    assert parse_mix('') == parse_mix(None)
+
+
+def test_mix_weights():
+    assert parse_mix('dashboard=3,sales=0.5,funds') == [('dashboard', 3.0), ('sales', 0.5), ('funds', 1.0)]
+
+
+def test_mix_query_strings():
+    assert parse_mix('forecast?horizon=30') == [('forecast?horizon=30', 1.0)]
+    assert parse_mix('forecast?horizon=30=2') == [('forecast?horizon=30', 2.0)]
+    assert parse_mix('forecast?model=complex&granularity=week=4,dashboard=1') == [
+        ('forecast?model=complex&granularity=week', 4.0), ('dashboard', 1.0)]
+    assert parse_mix('forecast?model=complex&horizon=30') == [('forecast?model=complex&horizon=30', 1.0)]
+    assert endpoint_path('forecast?horizon=30') == '/api/forecast?horizon=30'
+    assert endpoint_path('sales') == '/api/sales'
+
+
+def test_bad_mixes():
+    for value in ('charts=1', 'dashboard=1,nope', 'nope?x=1=2', 'sales=-1'):
+        with pytest.raises(ValueError):
+            parse_mix(value)
+
+
+def test_summarize():
+    summary = summarize([0.01] * 98 + [0.5, 1.0], 3, 2.0)
+    assert summary['requests'] == 100 and summary['errors'] == 3
+    assert summary['rps'] == 50.0
+    assert summary['p50Ms'] == pytest.approx(10.0)
+    assert summary['p99Ms'] > 500
+    assert summarize([], 1, 0.0) == {'requests': 0, 'errors': 1, 'rps': 0.0}
+
+
+def test_scaled_dataset_renames_client_copies(tmp_path):
+    source = tmp_path / 'data'
+    source.mkdir()
+    (source / 'CLIENT_LIST.csv').write_text('\ufeffCLIENT_NAME,SALES\nc1,s1\nc2,s2\n', encoding='utf-8')
+    (source / 'PRODUCT_INFO.csv').write_text('FUND_NAME\nF\n', encoding='utf-8')
+    target = make_scaled_dataset(str(source), 3)
+    with open(f'{target}/CLIENT_LIST.csv', encoding='utf-8') as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == ['\ufeffCLIENT_NAME', 'SALES']
+    assert [row[0] for row in rows[1:]] == ['c1', 'c2', 'c1#1', 'c2#1', 'c1#2', 'c2#2']
+    assert (tmp_path / 'data' / 'scaled_x3' / 'PRODUCT_INFO.csv').read_text(encoding='utf-8') == 'FUND_NAME\nF\n'
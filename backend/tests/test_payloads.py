@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import copy
+
+import pytest
+
+from changelog import Changelog
+from conftest import END_DATE
+from income_store import IncomeStore
+from kpi_master_v1_07 import calculate_daily_holdings, calculate_daily_income, generate_sales_person_breakdowns
+from kpi_state import SNAPSHOT_DATE
+
+
+@pytest.fixture(scope='module')
+def legacy(inputs, served_state):
+    """``(daily_income, sales_income, sales_person_breakdowns)`` of the nested-dict pipeline."""
+    snapshot, _, fee_schedule, client_sales = inputs
+    daily_holdings = calculate_daily_holdings(snapshot, served_state.trades, SNAPSHOT_DATE, END_DATE)
+    daily_income, sales_income, _ = calculate_daily_income(daily_holdings, fee_schedule.product_info('ma'),
+                                                           client_sales)
+    return daily_income, sales_income, generate_sales_person_breakdowns(daily_income, client_sales)
+
+
+def nonzero(values):
+    return {name: value for name, value in values.items() if value}
+
+
+def test_dashboard_matches_legacy_pipeline(servers, served_state, legacy):
+    daily_income, sales_income, _ = legacy
+    dashboard = servers[0].build_dashboard(served_state, {})
+    trend = {date: sum(sum(funds.values()) for funds in clients.values()) for date, clients in daily_income.items()}
+    assert [row['date'] for row in dashboard['income_trend']] == [date.isoformat() for date in trend]
+    assert [row['income'] for row in dashboard['income_trend']] == pytest.approx(list(trend.values()))
+    assert dashboard['total_income'] == pytest.approx(trend[max(trend)])
+    assert dashboard['total_clients'] == len({client for day in daily_income.values() for client in day})
+    assert dashboard['total_funds'] == len({fund for day in daily_income.values() for funds in day.values()
+                                            for fund in funds})
+    assert dashboard['total_sales'] == len(sales_income[max(sales_income)])
+
+
+def test_sales_match_legacy_pipeline(servers, served_state, legacy):
+    daily_income, sales_income, breakdowns = legacy
+    sales = servers[0].build_sales(served_state, {})
+    dates = sorted(sales_income)
+
+    assert [row['date'] for row in sales['dailyContribution']] == [date.isoformat() for date in dates]
+    for row, date in zip(sales['dailyContribution'], dates):
+        assert {name: value for name, value in row.items() if name != 'date'} == pytest.approx(sales_income[date])
+
+    for person in sales['salesPersons']:
+        name = person['name']
+        assert person['cumulativeIncome'] == pytest.approx(sum(sales_income[date][name] for date in dates))
+        rows = sales['individualPerformance'][name]
+        assert [row['date'] for row in rows] == [date.isoformat() for date in dates]
+        # The sparse store keeps no zero-income rows, so zero entries of the old breakdowns are left out
+        clients, funds = set(), set()
+        for row, date in zip(rows, dates):
+            expected = breakdowns[date][name]
+            assert row['clients'] == pytest.approx(nonzero(expected['clients']))
+            assert row['funds'] == pytest.approx(nonzero(expected['funds']))
+            clients.update(nonzero(expected['clients']))
+            funds.update(nonzero(expected['funds']))
+        # Counts are of the clients and funds with income, not of every position held
+        assert person['totalClients'] == len(clients)
+        assert person['totalFunds'] == len(funds)
+
+
+@pytest.fixture
+def history(served_state, monkeypatch):
+    """Gives the state a previous version whose sales and day digests differ on day 100."""
+    current = served_state.changelog
+    old = copy.deepcopy(current.digest)
+    old.date_digests[100] += 1
+    old.sales_digests[100, 1] += 1
+    monkeypatch.setattr(served_state, 'changelog', Changelog(current.version - 1, old).advance(
+        Changelog(current.version, current.digest)))
+    return served_state.income_store.dates[100], served_state.income_store.sales[1]
+
+
+def test_sales_delta_resends_rows_from_the_first_change(servers, served_state, history):
+    app = servers[0]
+    changed_date, changed_sales = history
+    full = app.build_sales(served_state, {})
+    delta = app.build_sales(served_state, {'since': str(served_state.changelog.version - 1)})
+
+    assert delta['full'] is False and full['full'] is True
+    assert [row['date'] for row in delta['dailyContribution']] == [changed_date.isoformat()]
+    assert delta['performanceFrom'] == {changed_sales: changed_date.isoformat()}
+    assert delta['individualPerformance'][changed_sales] == [
+        row for row in full['individualPerformance'][changed_sales] if row['date'] >= changed_date.isoformat()]
+    assert delta['salesPersons'] == full['salesPersons']
+
+
+def test_sales_delta_without_changes_builds_no_breakdowns(servers, served_state, monkeypatch):
+    app = servers[0]
+
+    def sales_breakdown(self, date):
+        pytest.fail("breakdown built for an empty delta")
+
+    monkeypatch.setattr(IncomeStore, 'sales_breakdown', sales_breakdown)
+    delta = app.build_sales(served_state, {'since': str(served_state.changelog.version)})
+    assert delta['individualPerformance'] == {} and delta['dailyContribution'] == []
+
+
+def test_full_sales_payload_is_built_once_per_view(servers, served_state):
+    app = servers[0]
+    assert app.build_sales(served_state, {}) is app.build_sales(served_state, {})
+    assert app.build_sales(served_state, {'fee_type': 'cus'}) is not app.build_sales(served_state, {})
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import tracemalloc
+
+import pytest
+
+from profiling import ProfileStore, SamplingProfiler
+
+
+def busy_work(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+
+
+def test_sampler_folds_the_profiled_thread():
+    with SamplingProfiler('test', interval=0.001, trace_memory=False) as profiler:
+        busy_work(0.2)
+    assert profiler.samples > 0 and profiler.duration >= 0.2
+    assert sum(profiler.stacks.values()) == profiler.samples
+    assert any(stack.split(';')[-1].startswith('busy_work (test_profiling.py:') for stack in profiler.stacks)
+    # Root first; one "stack count" line per distinct stack
+    for line in profiler.folded().splitlines():
+        stack, count = line.rsplit(' ', 1)
+        assert profiler.stacks[stack] == int(count)
+    assert profiler.allocations == []
+
+
+def test_sampler_profiles_another_thread():
+    started = threading.Event()
+
+    def worker():
+        started.set()
+        busy_work(0.2)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    started.wait()
+    with SamplingProfiler('worker', thread_id=thread.ident, interval=0.001, trace_memory=False) as profiler:
+        thread.join()
+    assert any('worker (test_profiling.py:' in stack for stack in profiler.stacks)
+    assert not any('test_sampler_profiles_another_thread' in stack for stack in profiler.stacks)
+
+
+def test_memory_profiles_record_allocations():
+    assert not tracemalloc.is_tracing()
+    with SamplingProfiler('memory') as profiler:
+        kept = [bytearray(1024) for _ in range(2000)]
+    assert len(kept) == 2000
+    assert profiler.allocations and profiler.allocations[0]['bytes'] >= 1024 * 1000
+    assert 'test_profiling.py' in profiler.allocations[0]['site']
+    assert not tracemalloc.is_tracing()
+
+
+def test_tracing_outlives_overlapping_profiles_and_the_callers_own():
+    outer = SamplingProfiler('outer').start()
+    inner = SamplingProfiler('inner').start()
+    inner.stop()
+    assert tracemalloc.is_tracing()
+    outer.stop()
+    assert not tracemalloc.is_tracing()
+
+    # Tracing the caller started is left running
+    tracemalloc.start()
+    try:
+        SamplingProfiler('nested').start().stop()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_profile_store_keeps_the_latest():
+    store = ProfileStore(capacity=2)
+    ids = [store.add(SamplingProfiler(f"p{i}", trace_memory=False).start().stop(), kind='request')
+           for i in range(3)]
+    assert store.get(ids[0]) is None
+    assert [summary['name'] for summary in store.summaries()] == ['p2', 'p1']
+    assert 'folded' not in store.summaries()[0] and 'folded' in store.get(ids[2])
+
+
+@pytest.fixture
+def admin(servers, with_state, monkeypatch):
+    monkeypatch.setattr(servers[0], 'ADMIN_TOKEN', 'secret')
+    return servers[0].app.test_client()
+
+
+def test_only_admins_can_profile(admin, servers, monkeypatch):
+    assert 'X-Kpi-Profile-Id' not in admin.get('/api/dashboard', headers={'X-Kpi-Profile': '1'}).headers
+    assert 'X-Kpi-Profile-Id' not in admin.get('/api/dashboard?profile=1',
+                                               headers={'X-Admin-Token': 'wrong'}).headers
+
+    response = admin.get('/api/dashboard?profile=1', headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 200
+    profile_id = response.headers['X-Kpi-Profile-Id']
+
+    assert admin.get('/api/admin/profiles').status_code == 403
+    assert admin.get(f'/api/admin/profiles/{profile_id}').status_code == 403
+    profile = admin.get(f'/api/admin/profiles/{profile_id}', headers={'X-Admin-Token': 'secret'}).get_json()
+    assert profile['path'] == '/api/dashboard' and profile['kind'] == 'request'
+    assert profile['allocations'] == []
+    folded = admin.get(f'/api/admin/profiles/{profile_id}?format=folded', headers={'X-Admin-Token': 'secret'})
+    assert folded.mimetype == 'text/plain'
+    assert admin.get('/api/admin/profiles/999999', headers={'X-Admin-Token': 'secret'}).status_code == 404
+
+
+def test_unprofiled_requests_start_no_profiler(admin, servers, monkeypatch):
+    def no_profiler(*args, **kwargs):
+        raise AssertionError("profiler started")
+
+    monkeypatch.setattr(servers[0], 'SamplingProfiler', no_profiler)
+    threads = threading.active_count()
+    response = admin.get('/api/dashboard', headers={'X-Kpi-Profile': '1'})
+    assert response.status_code == 200
+    assert 'X-Kpi-Profile-Id' not in response.headers
+    assert threading.active_count() == threads
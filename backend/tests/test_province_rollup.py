@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import datetime
+import os
+
+import pytest
+
+from income_store import IncomeStore
+from province_rollup import build_province_rollup, load_province_index
+
+D = datetime.date
+
+CLIENT_LIST = """CLIENT_NAME,SALES,PROVINCE
+c1,s1,广东省
+c2,s2,广东
+c3,s1,北京市
+c4,s1,-
+c5,s2,上海市
+"""
+
+
+@pytest.fixture
+def client_list(tmp_path):
+    path = tmp_path / 'CLIENT_LIST.csv'
+    path.write_text(CLIENT_LIST, encoding='utf-8')
+    return str(path)
+
+
+def test_province_names_are_normalised(client_list):
+    index = load_province_index(client_list)
+    assert index['CLIENT_NAME'].tolist() == ['c1', 'c2', 'c3', 'c5']
+    assert index['PROVINCE'].tolist() == ['广东', '广东', '北京', '上海']
+
+
+def test_index_is_reparsed_only_when_the_file_changes(client_list):
+    index = load_province_index(client_list)
+    assert load_province_index(client_list) is index
+    with open(client_list, 'a', encoding='utf-8') as file:
+        file.write('c6,s2,北京\n')
+    stat = os.stat(client_list)
+    os.utime(client_list, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    reloaded = load_province_index(client_list)
+    assert reloaded is not index
+    assert reloaded['CLIENT_NAME'].tolist()[-1] == 'c6'
+
+
+def test_rollup(client_list):
+    holdings = {
+        'c1': {'F': {D(2024, 1, 1): 100.0, D(2024, 1, 2): 100.0}},
+        'c2': {'F': {D(2024, 1, 1): 50.0}},
+        'c3': {'F': {D(2024, 1, 2): 300.0}},
+        'c4': {'F': {D(2024, 1, 2): 1000.0}},
+    }
+    store = IncomeStore.from_daily_holdings(holdings, {'F': 0.01}, {'c1': 's1', 'c2': 's2', 'c3': 's1', 'c4': 's1'})
+    counts, rollup = build_province_rollup(load_province_index(client_list), store)
+
+    assert counts == {'广东': 2, '北京': 1, '上海': 1}
+    # Sorted by cumulative income; c4 has no province, c5 no income
+    assert [entry['province'] for entry in rollup] == ['北京', '广东', '上海']
+    guangdong = rollup[1]
+    assert guangdong['clientCount'] == 2
+    assert guangdong['dailyIncome'] == pytest.approx(1.0)
+    assert guangdong['cumulativeIncome'] == pytest.approx(2.5)
+    assert guangdong['sales'] == {'s1': 1, 's2': 1}
+    assert rollup[2] == {'province': '上海', 'clientCount': 1, 'dailyIncome': 0.0, 'cumulativeIncome': 0.0,
+                         'sales': {'s2': 1}}
+
+
+def test_sample_rollup_matches_the_store(served_state):
+    store = served_state.income_store
+    index = served_state.fee_views.province_index
+    totals = store.named(store.client_totals(), store.clients)
+    expected = sum(totals.get(client, 0.0) for client in index['CLIENT_NAME'])
+    assert sum(entry['cumulativeIncome'] for entry in served_state.province_rollup) == pytest.approx(expected)
+    assert sum(served_state.province_counts.values()) == len(index)
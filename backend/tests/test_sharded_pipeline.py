@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from conftest import END_DATE
+from kpi_state import SNAPSHOT_DATE
+from sharded_pipeline import ROLLUPS, merge_rollups, partition, run_shard, run_sharded_pipeline, shard_tasks
+
+
+def leaves(nested, path=()):
+    """``{key path: number}`` of a nested dict."""
+    flat = {}
+    for key, value in nested.items():
+        if isinstance(value, dict):
+            flat.update(leaves(value, path + (key,)))
+        else:
+            flat[path + (key,)] = value
+    return flat
+
+
+def assert_same_rollups(actual, expected):
+    for name in ROLLUPS:
+        actual_leaves, expected_leaves = leaves(actual[name]), leaves(expected[name])
+        assert set(actual_leaves) == set(expected_leaves), name
+        for key, value in expected_leaves.items():
+            assert actual_leaves[key] == pytest.approx(value, rel=1e-9, abs=1e-6), (name, key)
+
+
+@pytest.fixture(scope='module')
+def pipeline_inputs(inputs):
+    snapshot, trades, fee_schedule, client_sales = inputs
+    return snapshot, trades, fee_schedule.product_info('ma'), client_sales
+
+
+@pytest.fixture(scope='module')
+def serial(pipeline_inputs):
+    return run_shard(shard_tasks(*pipeline_inputs, SNAPSHOT_DATE, END_DATE, 1)[0])
+
+
+def test_partition_is_disjoint_and_complete(pipeline_inputs):
+    snapshot, trades, _, _ = pipeline_inputs
+    parts = partition(snapshot, trades, 5)
+    assert sorted(c for holdings, _ in parts for c in holdings) == sorted(snapshot)
+    assert sorted(c for _, part_trades in parts for c in part_trades) == sorted(trades)
+
+
+def test_sharded_matches_serial(pipeline_inputs, serial):
+    assert_same_rollups(run_sharded_pipeline(*pipeline_inputs, SNAPSHOT_DATE, END_DATE, workers=1, shards=4),
+                        serial)
+
+
+def test_process_pool_matches_serial(pipeline_inputs, serial):
+    assert_same_rollups(run_sharded_pipeline(*pipeline_inputs, SNAPSHOT_DATE, END_DATE, workers=2, shards=3),
+                        serial)
+
+
+def test_merge_order_does_not_matter(pipeline_inputs):
+    results = [run_shard(task) for task in shard_tasks(*pipeline_inputs, SNAPSHOT_DATE, END_DATE, 3)]
+    forward = merge_rollups(merge_rollups(merge_rollups({}, results[0]), results[1]), results[2])
+    # merge_rollups adopts and then updates the dicts it is given; use fresh results
+    results = [run_shard(task) for task in shard_tasks(*pipeline_inputs, SNAPSHOT_DATE, END_DATE, 3)]
+    backward = merge_rollups(merge_rollups(merge_rollups({}, results[2]), results[1]), results[0])
+    assert_same_rollups(forward, backward)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import datetime
+import gc
+import os
+import pickle
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from conftest import END_DATE
+from fee_engine import FEE_SELECTORS, TOTAL_FEE_TYPE
+from kpi_state import SNAPSHOT_DATE, build_state
+
+
+@pytest.fixture(scope='module')
+def memory_state(data_dir):
+    return build_state(data_dir, SNAPSHOT_DATE, END_DATE, storage='memory')
+
+
+@pytest.fixture(scope='module')
+def sqlite_state(data_dir):
+    return build_state(data_dir, SNAPSHOT_DATE, END_DATE, storage='sqlite')
+
+
+def named_totals(store, method, index_name, **window):
+    totals = store.named(getattr(store, method)(**window), getattr(store, index_name))
+    return {name: value for name, value in totals.items() if value}
+
+
+@pytest.mark.parametrize('fee_type', FEE_SELECTORS)
+def test_sqlite_totals_match_memory(memory_state, sqlite_state, fee_type):
+    line = None if fee_type == TOTAL_FEE_TYPE else fee_type
+    memory = memory_state.fee_views.income_store.fee_line(line)
+    sql = sqlite_state.fee_views.income_store.fee_line(line)
+    assert sql.dates == memory.dates
+    assert list(sql.daily_totals()) == pytest.approx(list(memory.daily_totals()), rel=1e-9, abs=1e-6)
+    window = {'start_date': datetime.date(2024, 2, 1), 'end_date': datetime.date(2024, 5, 31)}
+    for method, index_name in (('client_totals', 'clients'), ('fund_totals', 'funds'), ('sales_totals', 'sales')):
+        for kwargs in ({}, window):
+            expected = named_totals(memory, method, index_name, **kwargs)
+            assert named_totals(sql, method, index_name, **kwargs) == pytest.approx(expected, rel=1e-9, abs=1e-6)
+
+
+def test_sqlite_breakdowns_match_memory(memory_state, sqlite_state):
+    date = datetime.date(2024, 6, 28)
+    memory, sql = memory_state.income_store, sqlite_state.income_store
+    assert sql.day_breakdown(date).keys() == memory.day_breakdown(date).keys()
+    assert sqlite_state.province_counts == memory_state.province_counts
+    assert sqlite_state.changelog.digest.date_digests.tolist() == memory_state.changelog.digest.date_digests.tolist()
+
+
+def test_sqlite_client_list_is_complete(data_dir, sqlite_state):
+    client_list = pd.read_csv(os.path.join(data_dir, 'CLIENT_LIST.csv'), encoding='utf-8')
+    with sqlite3.connect(sqlite_state.income_store.path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM client_list").fetchone()[0] == len(client_list)
+
+
+def test_sqlite_holdings_match_intervals(sqlite_state):
+    date = datetime.date(2024, 4, 15)
+    intervals = sqlite_state.holding_intervals
+    holdings = sqlite_state.income_store.holdings_on(date)
+    assert holdings
+    for client, funds in holdings.items():
+        for fund, amount in funds.items():
+            assert amount == pytest.approx(intervals.amount_on(client, fund, date))
+
+
+def test_database_lives_as_long_as_its_state(data_dir):
+    state = build_state(data_dir, SNAPSHOT_DATE, END_DATE, storage='sqlite')
+    path = state.income_store.path
+    # A pickled copy (the rebuild subprocess hands its state over this way) takes the file along
+    copy = pickle.loads(pickle.dumps(state))
+    del state
+    gc.collect()
+    assert os.path.exists(path)
+    assert copy.income_store.daily_totals().sum() > 0
+    del copy
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+def test_sqlite_sales_members_match_memory(memory_state, sqlite_state):
+    memory, sql = memory_state.income_store, sqlite_state.income_store
+    assert sql.sales.names == memory.sales.names
+    assert sql.sales_members() == memory.sales_members()
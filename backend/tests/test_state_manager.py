@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import datetime
+import os
+import threading
+import time
+
+import pytest
+
+import kpi_state
+from changelog import Changelog, data_version
+from kpi_state import DATA_FILES, KPIState, StateManager, input_mtimes
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def builds(served_state, monkeypatch):
+    """Fake ``build_served_state`` recording its calls; set ``gate`` to hold builds."""
+    calls = []
+    gate = threading.Event()
+    gate.set()
+
+    def build(data_dir, start_date, end_date):
+        gate.wait()
+        mtimes = input_mtimes(data_dir)
+        state = KPIState(data_dir=data_dir, mtimes=mtimes, build_seconds=0.0,
+                         changelog=Changelog(data_version(mtimes), served_state.changelog.digest))
+        calls.append(state)
+        return state
+
+    monkeypatch.setattr(kpi_state, 'build_served_state', build)
+    return calls, gate
+
+
+@pytest.fixture
+def manager(tmp_path):
+    trades = tmp_path / DATA_FILES['trades']
+    trades.write_text('')
+    manager = StateManager(str(tmp_path), datetime.date(2023, 12, 31), datetime.date(2024, 8, 31),
+                           poll_interval=0.02, rebuild_mode='thread')
+    yield manager
+    manager.stop()
+
+
+def touch(path, seconds):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10 ** 9))
+
+
+def test_watcher_rebuilds_on_changed_inputs(manager, builds, tmp_path):
+    calls, _ = builds
+    first = manager.start()
+    touch(tmp_path / DATA_FILES['trades'], 60)
+    wait_for(lambda: manager.status_info['rebuilds'] == 1 and manager.status_info['state'] == 'idle')
+    assert manager.current is calls[1] and manager.current is not first
+    assert manager.status_info['last_reason'] == 'changed: trades'
+    # The changelog carries on from the state it replaced
+    assert manager.current.changelog.version > first.changelog.version
+    assert manager.current.changelog.changes_since(first.changelog.version) is not None
+
+    # Unchanged inputs do not trigger another build
+    time.sleep(0.2)
+    assert len(calls) == 2
+
+
+def test_state_is_swapped_only_when_the_build_finishes(manager, builds):
+    calls, gate = builds
+    first = manager.start(watch=False)
+    gate.clear()
+    assert manager.request_rebuild('first')
+    wait_for(lambda: manager.status_info['state'] == 'rebuilding')
+    # A second request while building is queued, not run concurrently
+    assert not manager.request_rebuild('second')
+    assert manager.current is first
+    gate.set()
+    wait_for(lambda: manager.status_info['state'] == 'idle')
+    assert manager.status_info['rebuilds'] == 2
+    assert manager.status_info['last_reason'] == 'second'
+    assert manager.current is calls[-1]
+
+
+def test_failed_rebuilds_keep_the_current_state(manager, builds, monkeypatch):
+    first = manager.start(watch=False)
+
+    def fail(*args):
+        raise ValueError('broken input')
+
+    monkeypatch.setattr(kpi_state, 'build_served_state', fail)
+    manager.request_rebuild()
+    wait_for(lambda: manager.status_info['failures'] == 1 and manager.status_info['state'] == 'idle')
+    assert manager.current is first
+    assert manager.status_info['last_error'] == 'broken input'
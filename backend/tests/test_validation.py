@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import csv
+import datetime
+import os
+
+import pandas as pd
+import pytest
+
+from kpi_master_v1_07 import load_trades
+from validation import TradeValidator, validate_trades
+
+HEADER = ['CONFIRMED_DATE', 'FUND_NUM', 'CLIENT_NAME', 'ACCOUNT_NAME', 'TRADE_NUM', 'FUND_CODE', 'FUND_NAME',
+          'ACTION', 'SHARES_CHANGED', 'MONEY_CHANGED', 'REMAINING_SHARES']
+
+
+def trade(date='20240105', client='客户A', account='账户1', fund='基金X', action='申购', money='￥1,000.00',
+          shares='1,000.00', trade_num='1'):
+    return [date, 'F1', client, account, trade_num, '000001', fund, action, shares, money, shares]
+
+
+ROWS = [
+    trade(),                                    # line 2: accepted
+    trade(),                                    # line 3: duplicate of line 2
+    trade(money='￥2,000.00'),                   # line 4: second trade of line 2's position that day
+    trade(account='账户2'),                      # line 5: another account, accepted
+    trade(date='2024-01-32'),                   # line 6: bad date
+    trade(money='n/a'),                         # line 7: bad money
+    trade(action='赎回', money='￥-500.00'),      # line 8: another action, accepted
+    trade(),                                    # line 9: duplicate of line 2
+    trade(account='账户2', trade_num='2'),       # line 10: second trade of line 5's position that day
+    trade(fund='基金Y', client='客户B'),          # line 11: accepted, unknown fund and client
+]
+
+
+@pytest.fixture
+def trade_log(tmp_path):
+    path = tmp_path / 'TRADES_LOG.csv'
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(HEADER)
+        writer.writerows(ROWS)
+    return str(path)
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 3, 100])
+def test_issues_do_not_depend_on_chunking(tmp_path, trade_log, chunk_rows):
+    quarantine_path = str(tmp_path / 'quarantine.csv')
+    validator = TradeValidator(known_funds=['基金X'], known_clients=['客户A'], quarantine_path=quarantine_path,
+                               chunk_rows=chunk_rows)
+    accepted = pd.concat(list(validator.chunks(trade_log)))
+    report = validator.report
+
+    assert accepted['LINE'].tolist() == [2, 4, 5, 8, 10, 11]
+    assert report.rows == len(ROWS)
+    assert report.accepted == 6
+    assert {issue: report.counts[issue] for issue in ('bad_date', 'bad_money', 'duplicate', 'conflict')} == {
+        'bad_date': 1, 'bad_money': 1, 'duplicate': 2, 'conflict': 2}
+    assert [example['LINE'] for example in report.examples['conflict']] == [4, 10]
+    assert report.unknown_funds == {'基金Y': 1}
+    assert report.unknown_clients == {'客户B': 1}
+
+    quarantined = pd.read_csv(quarantine_path, dtype=str)
+    assert dict(zip(quarantined['LINE'].astype(int), quarantined['ISSUE'])) == {
+        3: 'duplicate', 6: 'bad_date', 7: 'bad_money', 9: 'duplicate'}
+
+
+def test_validate_trades_parses_accepted_rows(tmp_path, trade_log):
+    report_path = str(tmp_path / 'report.json')
+    chunks = validate_trades(trade_log, report_path=report_path)
+    assert not os.path.exists(report_path)
+    validated = pd.concat(list(chunks))
+    assert validated['money'].tolist() == [1000.0, 2000.0, 1000.0, -500.0, 1000.0, 1000.0]
+    assert str(validated['date'].iloc[0]) == '2024-01-05'
+    assert os.path.exists(report_path)
+
+
+def test_empty_log(tmp_path):
+    path = tmp_path / 'TRADES_LOG.csv'
+    path.write_text(','.join(HEADER) + '\n', encoding='utf-8')
+    assert all(chunk.empty for chunk in validate_trades(str(path)))
+    assert load_trades(str(path)) == {}
+
+
+def test_same_day_trades_are_all_counted(trade_log):
+    trades = load_trades(trade_log)
+    # Lines 2, 4, 5, 8 and 10; the exact repeats on lines 3 and 9 are dropped
+    assert trades['客户A']['基金X'] == {datetime.date(2024, 1, 5): 1000 + 2000 + 1000 - 500 + 1000}
+    assert trades['客户B']['基金Y'] == {datetime.date(2024, 1, 5): 1000}
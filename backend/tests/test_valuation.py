@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import numpy as np
+import pytest
+
+from valuation import build_nav_series, share_trades_by_position
+
+D = datetime.date
+
+
+@pytest.fixture
+def nav_series():
+    snapshot = [(D(2024, 1, 1), 'A', 1.0), (D(2024, 1, 1), 'B', 2.0)]
+    trades = [
+        # Implied NAV 1.1 for A on Jan 5; no shares confirmed on Jan 8
+        (D(2024, 1, 5), 'c1', 'A', 110.0, 100.0),
+        (D(2024, 1, 8), 'c1', 'A', 240.0, 0),
+    ]
+    history = [(D(2024, 1, 10), 'A', 1.2), (D(2024, 1, 5), 'A', 1.05), (D(2024, 1, 3), 'C', 3.0)]
+    return build_nav_series(snapshot, trades, history)
+
+
+def test_asof_forward_fills(nav_series):
+    assert nav_series.nav_on('A', D(2024, 1, 1)) == 1.0
+    assert nav_series.nav_on('A', D(2024, 1, 4)) == 1.0
+    # History wins over the trade-implied NAV on the same day
+    assert nav_series.nav_on('A', D(2024, 1, 5)) == 1.05
+    assert nav_series.nav_on('A', D(2024, 1, 9)) == 1.05
+    assert nav_series.nav_on('A', D(2024, 1, 10)) == 1.2
+    assert nav_series.nav_on('A', D(2025, 1, 1)) == 1.2
+    assert nav_series.nav_on('B', D(2024, 6, 1)) == 2.0
+
+
+def test_asof_before_the_first_observation(nav_series):
+    # Earlier days take the fund's first NAV, never the previous fund's last one
+    assert nav_series.nav_on('A', D(2023, 12, 1)) == 1.0
+    assert nav_series.nav_on('B', D(2023, 12, 31)) == 2.0
+    assert nav_series.nav_on('C', D(2024, 1, 1)) == 3.0
+    assert nav_series.nav_on('unknown', D(2024, 1, 5)) is None
+
+
+def test_asof_is_vectorised(nav_series):
+    funds = nav_series.funds
+    fund_ids = [funds.get('A'), funds.get('B'), -1, funds.get('C')]
+    ordinals = [D(2024, 1, 9).toordinal(), D(2024, 1, 2).toordinal(), D(2024, 1, 2).toordinal(),
+                D(2024, 2, 1).toordinal()]
+    result = nav_series.asof(fund_ids, ordinals)
+    assert result[[0, 1, 3]].tolist() == [1.05, 2.0, 3.0]
+    assert np.isnan(result[2])
+
+
+def test_unconfirmed_trades_convert_at_the_asof_nav(nav_series):
+    trades = [
+        (D(2024, 1, 5), 'c1', 'A', 110.0, 100.0),
+        (D(2024, 1, 8), 'c1', 'A', 210.0, 0),
+        (D(2024, 1, 8), 'c1', 'A', -105.0, -50.0),
+        (D(2024, 1, 8), 'c2', 'B', -40.0, 0),
+        (D(2024, 1, 8), 'c2', 'Z', 500.0, 0),
+    ]
+    result = share_trades_by_position(trades, nav_series)
+    assert result['c1']['A'][D(2024, 1, 5)] == 100.0
+    # 210 / 1.05 converted, summed with the confirmed -50 on the same day
+    assert result['c1']['A'][D(2024, 1, 8)] == pytest.approx(150.0)
+    assert result['c2']['B'] == {D(2024, 1, 8): -20.0}
+    # No NAV for Z: the trade is skipped
+    assert 'Z' not in result['c2']
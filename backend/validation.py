@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""Chunked, vectorised validation of the trade log during ingestion.
+
+``TradeValidator.chunks`` reads TRADES_LOG.csv with pandas in fixed-size
+chunks. Each chunk is checked as a whole, and only the accepted rows are
+yielded, with parsed ``date`` and ``money`` columns. Rows are quarantined
+(appended to a CSV with their line number and issue) when:
+
+* the date or the money value cannot be parsed;
+* they repeat an earlier row in every column (``duplicate``).
+
+Several trades of one position on one day (same client, account, fund, date
+and action, different amounts or trade numbers) are all kept, and summed by
+the loaders; they are only counted as ``conflict`` in the report. Trades of
+funds missing from PRODUCT_INFO or of clients missing from CLIENT_LIST are
+kept but counted too. Nothing is printed per row; the ``ValidationReport``
+aggregates counts, the first few examples of each issue and the unknown
+names, and prints one summary. Besides the chunk, the validator only keeps
+sets of 64-bit row and trade-key hashes for the repeat checks.
+``validate_trades`` yields the accepted rows chunk by chunk, so loaders can
+fold them into their own totals in one pass without holding the trade log.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Bump when the accepted rows change for the same input, so caches built
+# from the trade log (e.g. holdings checkpoints) are regenerated
+VALIDATION_VERSION = 3
+CHUNK_ROWS = 50_000
+MAX_EXAMPLES = 5
+QUARANTINE_ISSUES = ('bad_date', 'bad_money', 'duplicate')
+WARNING_ISSUES = ('conflict', 'unknown_fund', 'unknown_client')
+# Columns that identify the position and day of a trade
+TRADE_KEY = ('CLIENT_NAME', 'ACCOUNT_NAME', 'FUND_NAME', 'CONFIRMED_DATE', 'ACTION')
+# Columns of the accepted rows kept by ``validate_trades``
+VALIDATED_COLUMNS = ['CLIENT_NAME', 'FUND_NAME', 'ACTION', 'SHARES_CHANGED', 'date', 'money']
+
+
+def parse_money(values):
+    """Vectorised ``clean_money_string``: NaN where the value does not parse."""
+    return pd.to_numeric(values.str.replace(r'[^\d.-]', '', regex=True), errors='coerce')
+
+
+class ValidationReport:
+    """Aggregated result of validating one file."""
+
+    def __init__(self, source):
+        self.source = source
+        self.rows = 0
+        self.accepted = 0
+        self.counts = {issue: 0 for issue in QUARANTINE_ISSUES + WARNING_ISSUES}
+        self.examples = {issue: [] for issue in QUARANTINE_ISSUES + ('conflict',)}
+        self.unknown_funds = {}
+        self.unknown_clients = {}
+        self.quarantine_path = None
+
+    def add(self, issue, rows):
+        """Count the rows of ``issue``; ``rows`` is a DataFrame with a LINE column."""
+        self.counts[issue] += len(rows)
+        examples = self.examples.get(issue)
+        if examples is not None and len(examples) < MAX_EXAMPLES:
+            examples.extend(rows.head(MAX_EXAMPLES - len(examples)).to_dict('records'))
+
+    def add_unknown(self, names, target):
+        for name, count in names.value_counts().items():
+            target[name] = target.get(name, 0) + int(count)
+
+    @property
+    def quarantined(self):
+        return sum(self.counts[issue] for issue in QUARANTINE_ISSUES)
+
+    def to_dict(self):
+        return {
+            'source': self.source,
+            'rows': self.rows,
+            'accepted': self.accepted,
+            'quarantined': self.quarantined,
+            'counts': self.counts,
+            'examples': self.examples,
+            'unknownFunds': dict(sorted(self.unknown_funds.items(), key=lambda x: x[1], reverse=True)),
+            'unknownClients': dict(sorted(self.unknown_clients.items(), key=lambda x: x[1], reverse=True)),
+            'quarantineFile': self.quarantine_path,
+        }
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file, ensure_ascii=False, indent=2)
+
+    def print_summary(self):
+        print(f"Validated {self.rows} rows of {self.source}: {self.accepted} accepted, "
+              f"{self.quarantined} quarantined.")
+        for issue in QUARANTINE_ISSUES + ('conflict',):
+            if self.counts[issue]:
+                print(f"  {issue}: {self.counts[issue]} rows (first at line {self.examples[issue][0]['LINE']})")
+        for issue, names in (('unknown_fund', self.unknown_funds), ('unknown_client', self.unknown_clients)):
+            if names:
+                listed = ', '.join(list(names)[:MAX_EXAMPLES]) + (', ...' if len(names) > MAX_EXAMPLES else '')
+                print(f"  {issue}: {self.counts[issue]} rows for {len(names)} names ({listed})")
+        if self.quarantine_path and self.quarantined:
+            print(f"  Quarantined rows written to {self.quarantine_path}")
+
+
+class TradeValidator:
+    """Validates a trade log chunk by chunk; see the module docstring."""
+
+    def __init__(self, known_funds=None, known_clients=None, quarantine_path=None, chunk_rows=CHUNK_ROWS):
+        self.known_funds = None if known_funds is None else list(known_funds)
+        self.known_clients = None if known_clients is None else list(known_clients)
+        self.quarantine_path = quarantine_path
+        self.chunk_rows = chunk_rows
+        self.report = None
+        # Trade-key and full-row hashes of the accepted rows
+        self._keys = set()
+        self._rows = set()
+
+    def chunks(self, filename):
+        """Yield the accepted rows of ``filename``, chunk by chunk."""
+        self.report = ValidationReport(filename)
+        self._keys = set()
+        self._rows = set()
+        quarantine = None
+        if self.quarantine_path:
+            os.makedirs(os.path.dirname(self.quarantine_path) or '.', exist_ok=True)
+            quarantine = open(self.quarantine_path, 'w', encoding='utf-8', newline='')
+            self.report.quarantine_path = self.quarantine_path
+        try:
+            reader = pd.read_csv(filename, dtype=str, keep_default_na=False, encoding='utf-8-sig',
+                                 chunksize=self.chunk_rows)
+            header = True
+            for chunk in reader:
+                accepted, rejected = self._check(chunk)
+                if quarantine is not None and len(rejected):
+                    rejected.to_csv(quarantine, header=header, index=False)
+                    header = False
+                yield accepted
+        finally:
+            if quarantine is not None:
+                quarantine.close()
+
+    def _check(self, chunk):
+        report = self.report
+        report.rows += len(chunk)
+        # Line numbers in the file: the header is line 1
+        chunk = chunk.assign(LINE=chunk.index + 2)
+        issues = pd.Series('', index=chunk.index)
+
+        dates = pd.to_datetime(chunk['CONFIRMED_DATE'].str.strip(), format='%Y%m%d', errors='coerce')
+        money = parse_money(chunk['MONEY_CHANGED'])
+        issues[dates.isna()] = 'bad_date'
+        issues[(issues == '') & money.isna()] = 'bad_money'
+
+        # Repeats, against earlier chunks and within this one
+        valid = issues == ''
+        key_columns = [column for column in TRADE_KEY if column in chunk.columns]
+        data_columns = [column for column in chunk.columns if column != 'LINE']
+        keys = pd.util.hash_pandas_object(chunk.loc[valid, key_columns], index=False).to_numpy()
+        rows = pd.util.hash_pandas_object(chunk.loc[valid, data_columns], index=False).to_numpy()
+        duplicate = (np.array([row in self._rows for row in rows.tolist()], dtype=bool)
+                     | pd.Series(rows).duplicated().to_numpy())
+        kept = ~duplicate
+        conflict = np.zeros(len(keys), dtype=bool)
+        conflict[kept] = (np.array([key in self._keys for key in keys[kept].tolist()], dtype=bool)
+                          | pd.Series(keys[kept]).duplicated().to_numpy())
+        self._rows.update(rows[kept].tolist())
+        self._keys.update(keys[kept].tolist())
+        valid_index = chunk.index[valid]
+        issues[valid_index[duplicate]] = 'duplicate'
+        # Further trades of a position on the same day are kept; only report them
+        report.add('conflict', chunk.loc[valid_index[conflict]])
+
+        for issue in QUARANTINE_ISSUES:
+            report.add(issue, chunk[issues == issue])
+        accepted = chunk[issues == ''].assign(date=dates[issues == ''].dt.date, money=money[issues == ''])
+        report.accepted += len(accepted)
+        if self.known_funds is not None:
+            unknown = accepted.loc[~accepted['FUND_NAME'].isin(self.known_funds), 'FUND_NAME']
+            report.counts['unknown_fund'] += len(unknown)
+            report.add_unknown(unknown, report.unknown_funds)
+        if self.known_clients is not None:
+            unknown = accepted.loc[~accepted['CLIENT_NAME'].isin(self.known_clients), 'CLIENT_NAME']
+            report.counts['unknown_client'] += len(unknown)
+            report.add_unknown(unknown, report.unknown_clients)
+        return accepted, chunk[issues != ''].assign(ISSUE=issues[issues != ''])
+
+
+def validate_trades(filename, known_funds=None, known_clients=None, quarantine_path=None, report_path=None):
+    """Yield the accepted rows of the trade log (``VALIDATED_COLUMNS``) chunk by chunk.
+
+    Once the log is read, prints the summary and writes the JSON report to
+    ``report_path``.
+    """
+    validator = TradeValidator(known_funds, known_clients, quarantine_path)
+    for chunk in validator.chunks(filename):
+        yield chunk[VALIDATED_COLUMNS]
+    validator.report.print_summary()
+    if report_path:
+        validator.report.write(report_path)
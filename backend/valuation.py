@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Share-based, NAV-marked valuation of holdings.
+
+In this mode positions are tracked in fund shares (``REMANING_SHARES`` in
+the snapshot, ``SHARES_CHANGED`` in the trade log) and valued daily as
+shares × NAV. NAV observations come from the snapshot's ``NAV_DAILY``, the
+price implied by each trade that confirms both money and shares, and the
+optional ``NAV_HISTORY.csv`` (``DATE``, ``FUND_NAME``, ``NAV``), which wins
+on the same day. ``NavSeries.asof`` joins any number of (fund, date) pairs
+to the latest NAV on or before the date with one ``searchsorted`` over the
+sorted (fund, date) keys, which forward-fills missing days.
+"""
+
+import csv
+import datetime
+import os
+
+import numpy as np
+
+from kpi_master_v1_07 import clean_money_string
+from income_store import NameIndex
+from fee_engine import REDEMPTION
+from validation import parse_money, validate_trades
+
+VALUATION_MODES = ('money', 'nav')
+
+
+def parse_trade_date(value):
+    return datetime.datetime.strptime(value.strip(), '%Y%m%d').date()
+
+
+class NavSeries:
+    """Daily NAV observations per fund, sorted by (fund, date)."""
+
+    def __init__(self, funds, fund_ids, ordinals, navs):
+        self.funds = funds
+        order = np.lexsort((ordinals, fund_ids))
+        self.fund_ids = np.asarray(fund_ids, dtype=np.int64)[order]
+        self.ordinals = np.asarray(ordinals, dtype=np.int64)[order]
+        self.navs = np.asarray(navs, dtype=np.float64)[order]
+        self.keys = self.fund_ids * (1 << 32) + self.ordinals
+
+    def __len__(self):
+        return len(self.navs)
+
+    def asof(self, fund_ids, ordinals):
+        """Latest NAV on or before each date, NaN for funds with no NAV at all.
+
+        Days before a fund's first observation take that first NAV.
+        """
+        fund_ids = np.asarray(fund_ids, dtype=np.int64)
+        queries = fund_ids * (1 << 32) + np.asarray(ordinals, dtype=np.int64)
+        idx = np.searchsorted(self.keys, queries, side='right') - 1
+        # Before the fund's first observation idx points at the previous fund
+        first = np.searchsorted(self.keys, fund_ids * (1 << 32), side='left')
+        idx = np.maximum(idx, first)
+        valid = (fund_ids >= 0) & (idx < len(self.keys))
+        valid[valid] &= self.fund_ids[idx[valid]] == fund_ids[valid]
+        result = np.full(len(queries), np.nan)
+        result[valid] = self.navs[idx[valid]]
+        return result
+
+    def nav_on(self, fund, date):
+        value = self.asof([self.funds.get(fund, -1)], [date.toordinal()])[0]
+        return None if np.isnan(value) else float(value)
+
+
+# 加载份额数据
+def load_share_snapshot(filename, target_date='20231231'):
+    """``({client: {fund: shares}}, [(date, fund, nav)])`` from the holdings snapshot."""
+    holdings = {}
+    navs = []
+    with open(filename, 'r', encoding='utf-8-sig') as file:
+        for row in csv.DictReader(file):
+            if row.get('SHARES_DATE', '') != target_date:
+                continue
+            client_funds = holdings.setdefault(row['CLIENT_NAME'], {})
+            fund = row['FUND_NAME']
+            client_funds[fund] = client_funds.get(fund, 0) + clean_money_string(row['REMANING_SHARES'])
+            if row.get('NAV_DAILY'):
+                navs.append((parse_trade_date(target_date), fund, clean_money_string(row['NAV_DAILY'])))
+    print(f"Loaded share holdings for {len(holdings)} clients as of {target_date}.")
+    return holdings, navs
+
+
+def share_trade_rows(validated):
+    """``(rows, unparseable)`` of one chunk of validated trade rows.
+
+    Rows are ``(date, client, fund, signed money, signed shares)``; shares are
+    0 where the trade log has not confirmed them yet.
+    """
+    shares = parse_money(validated['SHARES_CHANGED'])
+    valid = validated[shares.notna()]
+    sign = np.where(valid['ACTION'] == REDEMPTION, -1, 1)
+    rows = list(zip(valid['date'], valid['CLIENT_NAME'], valid['FUND_NAME'], valid['money'].tolist(),
+                    (sign * np.abs(shares[shares.notna()].to_numpy())).tolist()))
+    return rows, int(shares.isna().sum())
+
+
+def load_share_trades(filename, validated=None):
+    """Trade rows as ``(date, client, fund, signed money, signed shares)``.
+
+    Rows are checked by ``validate_trades`` like in ``load_trades``, unless
+    ``validated`` passes the chunks of an earlier validation.
+    """
+    if validated is None:
+        validated = validate_trades(filename)
+    rows, bad_shares = [], 0
+    for chunk in validated:
+        chunk_rows, unparseable = share_trade_rows(chunk)
+        rows.extend(chunk_rows)
+        bad_shares += unparseable
+    report_share_trades(rows, bad_shares)
+    return rows
+
+
+def report_share_trades(rows, bad_shares):
+    if bad_shares:
+        print(f"Skipped {bad_shares} trades with unparseable SHARES_CHANGED.")
+    print(f"Loaded {len(rows)} share trades.")
+
+
+def load_nav_history(filename):
+    """``[(date, fund, nav)]`` from NAV_HISTORY.csv, or ``[]`` if there is none."""
+    if not os.path.exists(filename):
+        return []
+    navs = []
+    with open(filename, 'r', encoding='utf-8-sig') as file:
+        for row in csv.DictReader(file):
+            navs.append((parse_trade_date(row['DATE'].replace('-', '')), row['FUND_NAME'],
+                         clean_money_string(row['NAV'])))
+    print(f"Loaded {len(navs)} NAV observations from {filename}.")
+    return navs
+
+
+def build_nav_series(snapshot_navs, share_trades, history_navs):
+    """Merge the NAV sources; later sources win for the same fund and day."""
+    observations = {}
+    for date, fund, nav in snapshot_navs:
+        observations[(fund, date)] = nav
+    for date, _, fund, money, shares in share_trades:
+        if shares and money:
+            observations[(fund, date)] = abs(money) / abs(shares)
+    for date, fund, nav in history_navs:
+        observations[(fund, date)] = nav
+
+    funds = NameIndex()
+    fund_ids, ordinals, navs = [], [], []
+    for (fund, date), nav in observations.items():
+        fund_ids.append(funds.add(fund))
+        ordinals.append(date.toordinal())
+        navs.append(nav)
+    print(f"Built NAV series with {len(navs)} observations for {len(funds)} funds.")
+    return NavSeries(funds, fund_ids, ordinals, navs)
+
+
+def share_trades_by_position(share_trades, nav_series):
+    """``{client: {fund: {date: shares}}}``, converting unconfirmed trades at the as-of NAV.
+
+    Trades on the same day for the same position are summed.
+    """
+    pending = [i for i, trade in enumerate(share_trades) if not trade[4]]
+    navs = nav_series.asof([nav_series.funds.get(share_trades[i][2], -1) for i in pending],
+                           [share_trades[i][0].toordinal() for i in pending])
+    converted = dict(zip(pending, navs.tolist()))
+
+    trades = {}
+    skipped = 0
+    for i, (date, client, fund, money, shares) in enumerate(share_trades):
+        if i in converted:
+            nav = converted[i]
+            if np.isnan(nav) or nav <= 0:
+                skipped += 1
+                continue
+            shares = money / nav
+        fund_trades = trades.setdefault(client, {}).setdefault(fund, {})
+        fund_trades[date] = fund_trades.get(date, 0) + shares
+    if skipped:
+        print(f"Skipped {skipped} trades without shares or a NAV to convert them.")
+    return trades
+
@@ -1,30 +1,42 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts';
 import { Card, Row, Col, Statistic, Spin, Alert } from 'antd';
 import { DollarOutlined, TeamOutlined, FundOutlined, ShoppingOutlined } from '@ant-design/icons';
+import { POLL_INTERVAL_MS, withSince, mergeByDate } from '../deltaSync';
 
 function Dashboard() {
   const [dashboardData, setDashboardData] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const versionRef = useRef(null);
 
   useEffect(() => {
-    fetchDashboardData();
+    fetchDashboardData(true);
+    const timer = setInterval(() => fetchDashboardData(false), POLL_INTERVAL_MS);
+    return () => clearInterval(timer);
   }, []);
 
-  const fetchDashboardData = async () => {
+  const fetchDashboardData = async (initial) => {
     try {
-      setLoading(true);
-      const response = await fetch(`${process.env.REACT_APP_API_URL}/api/dashboard`);
+      if (initial) setLoading(true);
+      const response = await fetch(withSince(`${process.env.REACT_APP_API_URL}/api/dashboard`, versionRef.current));
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
       const data = await response.json();
-      setDashboardData(data);
+      versionRef.current = data.version;
+      setDashboardData(prev => (data.full || !prev) ? data : {
+        ...data,
+        income_trend: mergeByDate(prev.income_trend, data.income_trend, data.removedDates),
+      });
     } catch (e) {
-      setError(`获取仪表盘数据失败: ${e.message}`);
+      if (initial) {
+        setError(`获取仪表盘数据失败: ${e.message}`);
+      } else {
+        console.error("刷新仪表盘数据失败:", e);
+      }
     } finally {
-      setLoading(false);
+      if (initial) setLoading(false);
     }
   };
 
@@ -1,26 +1,36 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts';
 import { Card, Spin, Alert } from 'antd';
 import axios from 'axios';
+import { POLL_INTERVAL_MS, withSince, replaceFrom } from '../deltaSync';
 
 const Forecast = () => {
   const [forecastData, setForecastData] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const versionRef = useRef(null);
 
   useEffect(() => {
-    fetchForecastData();
+    fetchForecastData(true);
+    const timer = setInterval(() => fetchForecastData(false), POLL_INTERVAL_MS);
+    return () => clearInterval(timer);
   }, []);
 
-  const fetchForecastData = async () => {
+  const fetchForecastData = async (initial) => {
     try {
-      setLoading(true);
-      const response = await axios.get(`${process.env.REACT_APP_API_URL}/api/forecast`);
-      setForecastData(response.data);
+      if (initial) setLoading(true);
+      const response = await axios.get(withSince(`${process.env.REACT_APP_API_URL}/api/forecast`, versionRef.current));
+      const data = response.data;
+      versionRef.current = data.version;
+      setForecastData(prev => data.full ? data.points : replaceFrom(prev, data.fromDate, data.points));
     } catch (e) {
-      setError(`获取预测数据失败: ${e.message}`);
+      if (initial) {
+        setError(`获取预测数据失败: ${e.message}`);
+      } else {
+        console.error("刷新预测数据失败:", e);
+      }
     } finally {
-      setLoading(false);
+      if (initial) setLoading(false);
     }
   };
 
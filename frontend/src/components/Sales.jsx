@@ -1,7 +1,8 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { BarChart, Bar, LineChart, Line, AreaChart, Area, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts';
 import { Card, Row, Col, Spin, Alert, Select, Table, Radio } from 'antd';
 import axios from 'axios';
+import { POLL_INTERVAL_MS, withSince, mergeByDate, replaceFrom } from '../deltaSync';
 
 const { Option } = Select;
 
@@ -12,30 +13,49 @@ function Sales({ searchTerm }) {
   const [selectedSalesPerson, setSelectedSalesPerson] = useState(null);
   const [contributionType, setContributionType] = useState('cumulative');
   const [breakdownType, setBreakdownType] = useState('daily');
+  const versionRef = useRef(null);
 
   useEffect(() => {
-    fetchSalesData();
+    fetchSalesData(true);
+    const timer = setInterval(() => fetchSalesData(false), POLL_INTERVAL_MS);
+    return () => clearInterval(timer);
   }, []);
 
-  const fetchSalesData = async () => {
+  const mergeSalesData = (prev, data) => {
+    const individualPerformance = {};
+    data.salesPersons.forEach(({ name }) => {
+      const previous = prev.individualPerformance[name] || [];
+      individualPerformance[name] = name in data.individualPerformance
+        ? replaceFrom(previous, data.performanceFrom[name], data.individualPerformance[name])
+        : previous;
+    });
+    return {
+      ...data,
+      dailyContribution: mergeByDate(prev.dailyContribution, data.dailyContribution, data.removedDates),
+      individualPerformance,
+    };
+  };
+
+  const fetchSalesData = async (initial) => {
     try {
-      setLoading(true);
-      const response = await axios.get(`${process.env.REACT_APP_API_URL}/api/sales`);
+      if (initial) setLoading(true);
+      const response = await axios.get(withSince(`${process.env.REACT_APP_API_URL}/api/sales`, versionRef.current));
       console.log("Sales API response:", response.data);
 
       if (response.data.error) {
         throw new Error(response.data.error);
       }
 
-      setSalesData(response.data);
-      if (response.data.salesPersons.length > 0) {
+      versionRef.current = response.data.version;
+      setSalesData(prev => (response.data.full || !prev) ? response.data : mergeSalesData(prev, response.data));
+      if (initial && response.data.salesPersons.length > 0) {
         setSelectedSalesPerson(response.data.salesPersons[0].name);
       }
     } catch (e) {
       console.error("获取销售数据错误:", e);
-      setError(`错误: ${e.message}`);
+      if (initial) setError(`错误: ${e.message}`);
     } finally {
-      setLoading(false);
+      if (initial) setLoading(false);
     }
   };
 
@@ -0,0 +1,25 @@
+// Helpers for polling the API with ?since=<version> and merging the deltas
+// into the data already on screen. A response with `full: true` replaces it.
+
+export const POLL_INTERVAL_MS = Number(process.env.REACT_APP_POLL_INTERVAL_MS || 60000);
+
+export const withSince = (url, version) => {
+  const separator = url.includes('?') ? '&' : '?';
+  return `${url}${separator}since=${version ?? 0}`;
+};
+
+const byDate = (a, b) => (a.date < b.date ? -1 : a.date > b.date ? 1 : 0);
+
+// Replace changed rows and drop removed dates, keyed by `date`
+export const mergeByDate = (rows, changedRows, removedDates = []) => {
+  const merged = new Map(rows.map(row => [row.date, row]));
+  removedDates.forEach(date => merged.delete(date));
+  changedRows.forEach(row => merged.set(row.date, row));
+  return [...merged.values()].sort(byDate);
+};
+
+// Keep the rows before `fromDate` and append the resent tail
+export const replaceFrom = (rows, fromDate, tail) => {
+  if (fromDate == null) return rows;
+  return [...rows.filter(row => row.date < fromDate), ...tail];
+};